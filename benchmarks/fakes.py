@@ -0,0 +1,652 @@
+"""Local stand-ins for the Docker Engine, Docker Hub and GitHub APIs.
+
+The fakes implement only the requests made by labslauncher, returning
+responses of realistic size such that the launcher's own costs can be
+measured without network access or a docker daemon.
+"""
+import hashlib
+import http.server
+import json
+import os
+import re
+import socket
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+
+
+def _digest(text):
+    return "sha256:{}".format(hashlib.sha256(text.encode()).hexdigest())
+
+
+def manifest_digest(tag, revision=0):
+    """Return the registry digest of a tag.
+
+    :param tag: image tag.
+    :param revision: number of times a mutable tag has been updated.
+    """
+    return _digest("manifest-{}-{}".format(tag, revision))
+
+
+def layer_ids(tag, layers):
+    """Return the (uncompressed) layer digests of an image tag.
+
+    The first half of the layers are common to all tags.
+
+    :param tag: image tag.
+    :param layers: number of layers.
+    """
+    return [
+        _digest("base-{}".format(i) if i < layers // 2
+                else "{}-{}".format(tag, i))
+        for i in range(layers)]
+
+
+def semver_tags(count, prefix='v'):
+    """Return `count` distinct semantic version tags, oldest first.
+
+    :param count: number of tags.
+    :param prefix: tag prefix.
+    """
+    tags = list()
+    for i in range(count):
+        major, rem = divmod(i, 100)
+        minor, patch = divmod(rem, 10)
+        tags.append("{}{}.{}.{}".format(prefix, major, minor, patch))
+    return tags
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Base handler sending JSON responses on persistent connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Do not log requests."""
+
+    def send_json(self, data, code=200):
+        """Send a JSON response.
+
+        :param data: JSON serializable data.
+        :param code: HTTP status code.
+        """
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        """Send a chunk of a chunked response.
+
+        :param data: bytes, an empty chunk ends the response.
+        """
+        self.wfile.write("{:x}\r\n".format(len(data)).encode())
+        self.wfile.write(data + b"\r\n")
+
+    @property
+    def query(self):
+        """Return the parsed query string."""
+        return urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+
+class DockerEngineHandler(_Handler):
+    """Handle Docker Engine API requests."""
+
+    def setup(self):
+        """Set a client address, absent for Unix sockets."""
+        super().setup()
+        self.client_address = ('fake-docker', 0)
+
+    def _route(self):
+        self.server.engine.requests += 1
+        path = urllib.parse.urlsplit(self.path).path
+        # requests may or may not include an API version prefix
+        return urllib.parse.unquote(re.sub(r'^/v[0-9.]+', '', path))
+
+    def do_HEAD(self):
+        """Respond to pings."""
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        """Serve queries."""
+        engine = self.server.engine
+        path = self._route()
+        if path == '/_ping':
+            body = b'OK'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == '/version':
+            self.send_json(engine.version)
+        elif path == '/info':
+            self.send_json(engine.info)
+        elif path == '/containers/json':
+            self.send_json(engine.container_list())
+        elif path.startswith('/containers/') and path.endswith('/json'):
+            cont = engine.inspect_container(path[len('/containers/'):-5])
+            if cont is None:
+                self.send_json({'message': 'No such container'}, 404)
+            else:
+                self.send_json(cont)
+        elif path == '/images/json':
+            self.send_json(engine.image_list())
+        elif path == '/system/df':
+            self.send_json(engine.disk_usage())
+        elif path.startswith('/images/') and path.endswith('/json'):
+            image = engine.inspect_image(path[len('/images/'):-5])
+            if image is None:
+                self.send_json({'message': 'No such image'}, 404)
+            else:
+                self.send_json(image)
+        else:
+            self.send_json({'message': 'Not implemented'}, 404)
+
+    def do_DELETE(self):
+        """Serve image and container removal."""
+        path = self._route()
+        if path.startswith('/containers/'):
+            if self.server.engine.remove_container(
+                    path[len('/containers/'):]):
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_json({'message': 'No such container'}, 404)
+        elif path.startswith('/images/'):
+            removed = self.server.engine.remove_image(path[len('/images/'):])
+            if removed is None:
+                self.send_json({'message': 'No such image'}, 404)
+            else:
+                self.send_json(removed)
+        else:
+            self.send_json({'message': 'Not implemented'}, 404)
+
+    def do_POST(self):
+        """Serve image pulls."""
+        length = int(self.headers.get('Content-Length', 0))
+        if length > 0:
+            self.rfile.read(length)
+        path = self._route()
+        if path == '/images/create':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            image = self.query['fromImage'][0]
+            tag = self.query.get('tag', ['latest'])[0]
+            engine = self.server.engine
+            failure = None
+            if len(engine.pull_failures) > 0:
+                failure = engine.pull_failures.pop(0)
+            lines = list(engine.pull_log(image, tag, complete=failure is None))
+            if failure is not None:
+                lines = lines[:len(lines) // 2]
+            for line in lines:
+                self.send_chunk(line)
+            if failure == 'drop':
+                # end the connection without completing the response
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                self.close_connection = True
+                return
+            if failure is not None:
+                self.send_chunk(json.dumps({
+                    'errorDetail': {'message': failure},
+                    'error': failure}).encode())
+            self.send_chunk(b'')
+        elif path.startswith('/containers/') and path.endswith('/start'):
+            if self.server.engine.start_container(
+                    path[len('/containers/'):-len('/start')]):
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_json({'message': 'No such container'}, 404)
+        else:
+            self.send_json({'message': 'Not implemented'}, 404)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _Fake():
+    """Run a server in a background thread."""
+
+    server = None
+
+    def start(self):
+        """Start serving."""
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        """Start serving."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stop serving."""
+        self.stop()
+
+
+class FakeDockerEngine(_Fake):
+    """A Docker Engine API served on a Unix socket.
+
+    :param containers: number of host containers.
+    :param local_tags: tags of the image available locally.
+    :param pull_bytes: total size of a pulled image.
+    :param layers: number of layers of a pulled image.
+    :param chunk: bytes downloaded between progress messages.
+    """
+
+    def __init__(
+            self, image, containers=300, local_tags=(), pull_bytes=5 * 10**9,
+            layers=20, chunk=2 * 2**20, running=None):
+        """Initialize the engine, see class docstring for parameters.
+
+        :param image: image name.
+        :param running: name of a running server container.
+        """
+        self.image = image
+        self.local_tags = list(local_tags)
+        self.pull_bytes = pull_bytes
+        self.layers = layers
+        self.chunk = chunk
+        # API requests served, approximate under concurrency
+        self.requests = 0
+        # failures of successive pulls: 'drop' to close the connection
+        # part way, or an error message
+        self.pull_failures = list()
+        self.version = {
+            'Version': '20.10.7', 'ApiVersion': '1.41',
+            'MinAPIVersion': '1.12', 'Os': 'linux', 'Arch': 'amd64'}
+        self.info = {
+            'DockerRootDir': None, 'OperatingSystem': 'Fake Linux',
+            'Containers': containers, 'Images': len(self.local_tags)}
+        self.containers = dict()
+        for i in range(containers):
+            name = "container-{:04d}".format(i)
+            self.containers[name] = self._container(
+                name, 'running' if i % 3 else 'exited',
+                'library/image-{}:latest'.format(i % 20), {})
+        if running is not None:
+            tag = self.local_tags[0] if self.local_tags else 'latest'
+            self.containers[running] = self._container(
+                running, 'running', "{}:{}".format(image, tag),
+                {'labslauncher.instance': running})
+            self.containers[running]['ImageID'] = _digest(tag)
+        self.tmpdir = tempfile.mkdtemp()
+        self.info['DockerRootDir'] = self.tmpdir
+        self.path = os.path.join(self.tmpdir, 'docker.sock')
+        self.server = _UnixServer(self.path, DockerEngineHandler)
+        self.server.engine = self
+
+    @property
+    def url(self):
+        """Return the DOCKER_HOST URL of the engine."""
+        return "unix://{}".format(self.path)
+
+    def _container(self, name, state, image, labels):
+        return {
+            'Id': hashlib.sha256(name.encode()).hexdigest(),
+            'Names': ['/{}'.format(name)], 'Image': image,
+            'ImageID': _digest(image), 'Command': 'start-notebook.sh',
+            'Created': 1600000000, 'State': state,
+            'Status': 'Up 2 hours' if state == 'running' else 'Exited (0)',
+            'Ports': [{
+                'IP': '0.0.0.0', 'PrivatePort': 8888, 'PublicPort': 8888,
+                'Type': 'tcp'}] if labels else [],
+            'Labels': labels, 'HostConfig': {'NetworkMode': 'default'},
+            'Mounts': []}
+
+    def container_list(self):
+        """Return the summary of all containers."""
+        return list(self.containers.values())
+
+    def inspect_container(self, name):
+        """Return details of a container, or None."""
+        for cont in self.containers.values():
+            if name in (cont['Id'], cont['Names'][0][1:]):
+                return {
+                    'Id': cont['Id'], 'Name': cont['Names'][0],
+                    'Image': cont['ImageID'],
+                    'Args': [
+                        '--NotebookApp.token=token', '--port=8888'],
+                    'State': {
+                        'Status': cont['State'],
+                        'Running': cont['State'] == 'running',
+                        'ExitCode': cont.get('ExitCode', 0),
+                        'OOMKilled': cont.get('OOMKilled', False),
+                        'Error': ''},
+                    'Config': {
+                        'Image': cont['Image'], 'Labels': cont['Labels']},
+                    'HostConfig': {'PortBindings': {}},
+                    'NetworkSettings': {'Ports': {}}}
+        return None
+
+    def exit_container(self, name, code=1, oom_killed=False):
+        """Mark a container as exited.
+
+        :param name: container name.
+        :param code: exit code.
+        :param oom_killed: whether the container was killed for lack of
+            memory.
+        """
+        cont = self.containers[name]
+        cont.update(
+            State='exited', Status='Exited ({})'.format(code),
+            ExitCode=code, OOMKilled=oom_killed)
+
+    def start_container(self, name):
+        """Start a container, returning whether it exists."""
+        for cont in self.containers.values():
+            if name in (cont['Id'], cont['Names'][0][1:]):
+                cont.update(State='running', Status='Up 1 second')
+                return True
+        return False
+
+    def remove_container(self, name):
+        """Remove a container, returning whether it existed."""
+        for key, cont in list(self.containers.items()):
+            if name in (cont['Id'], cont['Names'][0][1:]):
+                del self.containers[key]
+                return True
+        return False
+
+    def image_list(self):
+        """Return the summary of local images."""
+        return [
+            {'Id': _digest(tag), 'RepoTags': [
+                "{}:{}".format(self.image, tag)],
+             'Size': self.pull_bytes, 'Created': 1600000000}
+            for tag in self.local_tags]
+
+    def disk_usage(self):
+        """Return disk usage, images share half of their layers."""
+        images = self.image_list()
+        shared = self.pull_bytes // 2 if len(images) > 1 else 0
+        for image in images:
+            image['SharedSize'] = shared
+            image['Containers'] = 0
+            image['RepoDigests'] = list()
+        layers = sum(x['Size'] - x['SharedSize'] for x in images)
+        if len(images) > 1:
+            layers += shared
+        return {
+            'LayersSize': layers, 'Images': images,
+            'Containers': self.container_list(), 'Volumes': list()}
+
+    def remove_image(self, name):
+        """Remove a local image tag, returning the removal report."""
+        image, _, tag = name.rpartition(':')
+        if image != self.image or tag not in self.local_tags:
+            return None
+        self.local_tags.remove(tag)
+        return [{'Untagged': name}, {'Deleted': _digest(tag)}]
+
+    def inspect_image(self, name):
+        """Return details of a local image, by name or ID, or None."""
+        image, _, tag = name.rpartition(':')
+        for local in self.local_tags:
+            if name == _digest(local):
+                image, tag = self.image, local
+        if image != self.image or tag not in self.local_tags:
+            return None
+        return {
+            'Id': _digest(tag), 'RepoTags': [
+                "{}:{}".format(self.image, tag)], 'Size': self.pull_bytes,
+            'RepoDigests': [
+                "{}@{}".format(self.image, manifest_digest(tag))],
+            'Architecture': self.version['Arch'], 'Os': 'linux',
+            'RootFS': {
+                'Type': 'layers', 'Layers': layer_ids(tag, self.layers)}}
+
+    def pull_log(self, image, tag, complete=True):
+        """Yield the lines of a pull progress stream.
+
+        :param image: image name.
+        :param tag: image tag.
+        :param complete: add the tag to local images.
+        """
+        yield json.dumps({
+            'status': 'Pulling from {}'.format(image), 'id': tag}).encode()
+        size = self.pull_bytes // self.layers
+        for layer in range(self.layers):
+            layer_id = "{:012x}".format(layer)
+            yield json.dumps({
+                'status': 'Pulling fs layer', 'progressDetail': {},
+                'id': layer_id}).encode()
+            for current in range(self.chunk, size + self.chunk, self.chunk):
+                current = min(current, size)
+                yield json.dumps({
+                    'status': 'Downloading',
+                    'progressDetail': {'current': current, 'total': size},
+                    'progress': '[=>   ]', 'id': layer_id}).encode()
+            yield json.dumps({
+                'status': 'Download complete', 'progressDetail': {},
+                'id': layer_id}).encode()
+        if complete and tag not in self.local_tags:
+            self.local_tags.append(tag)
+        yield json.dumps({
+            'status': 'Digest: {}'.format(_digest(tag))}).encode()
+
+    def stop(self):
+        """Stop serving and remove the socket."""
+        super().stop()
+        try:
+            os.remove(self.path)
+            os.rmdir(self.tmpdir)
+        except OSError:
+            pass
+
+
+class RegistryHandler(_Handler):
+    """Handle Docker Hub, registry and GitHub API requests."""
+
+    def end_headers(self):
+        """Add rate limit headers to all responses."""
+        fake = self.server.fake
+        self.send_header(
+            'RateLimit-Limit', '{};w=21600'.format(fake.pull_limit))
+        self.send_header(
+            'RateLimit-Remaining', '{};w=21600'.format(fake.pull_budget))
+        super().end_headers()
+
+    def do_HEAD(self):
+        """Serve manifest existence, without counting a pull."""
+        path = urllib.parse.urlsplit(self.path).path
+        match = re.match(r'^/v2/(.+)/manifests/([^/]+)$', path)
+        found = match is not None and self.server.fake.registry(
+            match.group(1), 'manifests', match.group(2)) is not None
+        self.send_response(200 if found else 404)
+        if found:
+            tag = match.group(2)
+            self.send_header('Docker-Content-Digest', manifest_digest(
+                tag, self.server.fake.revisions.get(tag, 0)))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        """Serve queries."""
+        fake = self.server.fake
+        path = urllib.parse.urlsplit(self.path).path
+        page = int(self.query.get('page', ['1'])[0])
+        if path == '/token':
+            self.send_json({'token': 'token'})
+            return
+        match = re.match(r'^/v2/(.+)/(manifests|blobs)/([^/]+)$', path)
+        if match is not None:
+            data = fake.registry(*match.groups())
+            if data is None:
+                self.send_json({'errors': [{'code': 'UNKNOWN'}]}, 404)
+            else:
+                if match.group(2) == 'manifests':
+                    fake.pull_budget = max(0, fake.pull_budget - 1)
+                self.send_json(data)
+            return
+        match = re.match(r'^/v2/repositories/(.+)/tags/?$', path)
+        if match is not None:
+            self.send_json(fake.tags_page(match.group(1), page))
+            return
+        match = re.match(r'^/users/([^/]+)$', path)
+        if match is not None:
+            self.send_json(fake.user(match.group(1)))
+            return
+        match = re.match(r'^/repos/([^/]+)/([^/]+)$', path)
+        if match is not None:
+            self.send_json(fake.repo(match.group(1), match.group(2)))
+            return
+        match = re.match(r'^/repos/([^/]+)/([^/]+)/releases$', path)
+        if match is not None:
+            releases, link = fake.releases_page(
+                match.group(1), match.group(2), page)
+            body = json.dumps(releases).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if link is not None:
+                self.send_header('Link', link)
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_json({'message': 'Not Found'}, 404)
+
+
+class FakeRegistry(_Fake):
+    """Docker Hub tag listing and GitHub release APIs on localhost.
+
+    :param image: image name.
+    :param tags: number of image tags.
+    :param releases: number of application releases.
+    :param page_size: items per page of listings.
+    """
+
+    def __init__(
+            self, image, tags=500, releases=100, page_size=100,
+            image_bytes=5 * 10**9, layers=20):
+        """Initialize the registry, see class docstring for parameters.
+
+        :param image_bytes: compressed size of each image tag.
+        :param layers: number of layers of each image tag.
+        """
+        self.image = image
+        self.image_bytes = image_bytes
+        self.layers = layers
+        self.pull_limit = 100
+        self.pull_budget = 100
+        self.tags = semver_tags(tags)
+        # platforms for which each tag is built
+        self.platforms = {tag: ['linux/amd64'] for tag in self.tags}
+        # updates of mutable tags, see `manifest_digest`
+        self.revisions = dict()
+        self.releases = semver_tags(releases)
+        self.page_size = page_size
+        self.server = _TCPServer(('127.0.0.1', 0), RegistryHandler)
+        self.server.fake = self
+
+    @property
+    def url(self):
+        """Return the base URL of the registry."""
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def _page(self, items, page):
+        start = (page - 1) * self.page_size
+        return items[start:start + self.page_size], \
+            start + self.page_size < len(items)
+
+    def tags_page(self, image, page):
+        """Return a page of the tag listing of an image, newest first."""
+        items, more = self._page(list(reversed(self.tags)), page)
+        nxt = None
+        if more:
+            nxt = "{}/v2/repositories/{}/tags?page={}".format(
+                self.url, image, page + 1)
+        return {
+            'count': len(self.tags), 'next': nxt,
+            'previous': None, 'results': [{
+                'name': tag, 'full_size': self.image_bytes,
+                'last_updated': '2020-01-01T00:00:00.000000Z',
+                'images': [{
+                    'architecture': plat.split('/')[1], 'os': 'linux',
+                    'digest': _digest(tag + plat), 'size': self.image_bytes}
+                    for plat in self.platforms[tag]]}
+                for tag in items]}
+
+    def registry(self, image, kind, reference):
+        """Return an image manifest or configuration, or None.
+
+        :param image: image name.
+        :param kind: 'manifests' or 'blobs'.
+        :param reference: tag or digest.
+        """
+        if image != self.image:
+            return None
+        if kind == 'manifests' and reference in self.tags:
+            return {
+                'schemaVersion': 2, 'manifests': [{
+                    'digest': '{}-{}'.format(plat.split('/')[1], reference),
+                    'platform': {
+                        'os': 'linux', 'architecture': plat.split('/')[1]}}
+                    for plat in self.platforms[reference]]}
+        if kind == 'manifests' and '-' in reference:
+            tag = reference.split('-', 1)[1]
+            size = self.image_bytes // self.layers
+            return {
+                'schemaVersion': 2,
+                'config': {'digest': 'config-{}'.format(tag)},
+                'layers': [
+                    {'digest': _digest('compressed-{}'.format(x)),
+                     'size': size}
+                    for x in layer_ids(tag, self.layers)]}
+        if kind == 'blobs' and reference.startswith('config-'):
+            return {
+                'architecture': 'amd64', 'os': 'linux',
+                'rootfs': {
+                    'type': 'layers',
+                    'diff_ids': layer_ids(reference[7:], self.layers)}}
+        return None
+
+    def user(self, login):
+        """Return a GitHub user."""
+        return {
+            'login': login, 'id': 1, 'type': 'Organization',
+            'url': "{}/users/{}".format(self.url, login)}
+
+    def repo(self, owner, name):
+        """Return a GitHub repository."""
+        return {
+            'id': 1, 'name': name, 'full_name': "{}/{}".format(owner, name),
+            'owner': self.user(owner),
+            'url': "{}/repos/{}/{}".format(self.url, owner, name)}
+
+    def releases_page(self, owner, name, page):
+        """Return a page of GitHub releases and the Link header."""
+        items, more = self._page(list(reversed(self.releases)), page)
+        link = None
+        if more:
+            link = '<{}/repos/{}/{}/releases?page={}>; rel="next"'.format(
+                self.url, owner, name, page + 1)
+        releases = [{
+            'id': i, 'name': tag, 'tag_name': tag, 'draft': False,
+            'prerelease': False, 'body': 'Release {}.'.format(tag),
+            'url': "{}/repos/{}/{}/releases/{}".format(
+                self.url, owner, name, i)}
+            for i, tag in enumerate(items)]
+        return releases, link
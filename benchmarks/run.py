@@ -0,0 +1,273 @@
+"""Measure the cost of launcher operations against local fake services.
+
+A fake Docker Engine (on a Unix socket) and a fake Docker Hub and GitHub
+(on localhost) are started and the launcher is pointed at them. Results
+are written as JSON, for comparison between revisions::
+
+    python benchmarks/run.py --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docker  # noqa: E402
+from fakes import FakeDockerEngine, FakeRegistry  # noqa: E402
+
+import labslauncher  # noqa: E402
+from labslauncher import dockerutil  # noqa: E402
+
+
+IMAGE = "ontresearch/epi2melabs-notebook"
+SERVER = "epi2melabs"
+
+
+def clear_caches():
+    """Clear caches of docker hub responses."""
+    dockerutil.IMAGE_META_CACHE.clear()
+    dockerutil.TAG_META_CACHE.clear()
+
+
+def measure(name, func, repeats, setup=None, **extra):
+    """Time repeated calls of a function.
+
+    :param name: name of the benchmark.
+    :param func: function to time, its return value is passed to `extra`
+        functions.
+    :param repeats: number of timed calls.
+    :param setup: function called (untimed) before each call.
+    :param extra: functions of the last return value and the list of
+        times, giving additional result fields.
+    """
+    times = list()
+    value = None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        value = func()
+        times.append(time.perf_counter() - start)
+    result = {
+        'name': name, 'repeats': repeats, 'unit': 's',
+        'min': min(times), 'median': statistics.median(times),
+        'mean': statistics.mean(times), 'max': max(times)}
+    for key, extract in extra.items():
+        result[key] = extract(value, times)
+    sys.stderr.write("{:<16} median {:.4f}s\n".format(name, result['median']))
+    return result
+
+
+def rss():
+    """Return the resident memory (bytes) of this process."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak, rather than current, usage
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def tray_mode(engine, seconds):
+    """Measure idle timer wakeups, docker requests and memory of the GUI.
+
+    The main window is measured when shown and when minimised to the
+    system tray, each for `seconds`. Memory is given both as the number of
+    live widgets and as the RSS of the process.
+
+    :param engine: the `FakeDockerEngine` in use.
+    :param seconds: duration (seconds) of each measurement.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtCore import QEvent, QEventLoop, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication, QSystemTrayIcon
+    from labslauncher import app as gui
+    from labslauncher.qtext import Settings
+    from labslauncher.settings import MemoryStore
+
+    class WakeupCounter(QObject):
+        count = 0
+
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Timer:
+                self.count += 1
+            return False
+
+    qapp = QApplication.instance() or QApplication([])
+    settings = Settings(labslauncher.Defaults(), store=MemoryStore())
+    for key, value in (
+            ('server_name', SERVER), ('send_pings', False),
+            ('control_api', False), ('tray_mode', True)):
+        settings[key] = value
+    # the offscreen platform has no system tray
+    with mock.patch.object(
+            QSystemTrayIcon, 'isSystemTrayAvailable', return_value=True):
+        launcher = gui.LabsLauncher(qapp, settings)
+    launcher.show()
+    counter = WakeupCounter()
+    qapp.installEventFilter(counter)
+
+    def idle():
+        loop = QEventLoop()
+        QTimer.singleShot(1000, loop.quit)  # settle
+        loop.exec_()
+        wakeups, requests = counter.count, engine.requests
+        QTimer.singleShot(int(1000 * seconds), loop.quit)
+        loop.exec_()
+        per_min = 60 / seconds
+        return {
+            'wakeups_per_min': (counter.count - wakeups) * per_min,
+            'docker_requests_per_min': (engine.requests - requests) * per_min,
+            'widgets': len(qapp.allWidgets()),
+            'rss': rss()}
+
+    result = {'name': 'tray_mode', 'seconds': seconds}
+    for mode, action in (
+            ('windowed', launcher.leave_tray), ('tray', launcher.enter_tray)):
+        action()
+        for key, value in idle().items():
+            result['{}_{}'.format(mode, key)] = value
+        sys.stderr.write(
+            "{:<16} {}: {:.0f} wakeups/min, {:.0f} docker requests/min, "
+            "{} widgets, {:.1f}MB\n".format(
+                'tray_mode', mode, result['{}_wakeups_per_min'.format(mode)],
+                result['{}_docker_requests_per_min'.format(mode)],
+                result['{}_widgets'.format(mode)],
+                result['{}_rss'.format(mode)] / 1e6))
+    launcher.quit_from_tray()
+    launcher.pool.waitForDone()
+    return result
+
+
+def run(args):
+    """Run all benchmarks, returning a list of results."""
+    engine = FakeDockerEngine(
+        IMAGE, containers=args.containers, pull_bytes=args.pull_gb * 10**9,
+        local_tags=['v0.0.0'], running=SERVER)
+    registry = FakeRegistry(IMAGE, tags=args.tags, releases=args.releases)
+    os.environ['DOCKER_HOST'] = engine.url
+    os.environ['NO_PROXY'] = '127.0.0.1,localhost'
+    dockerutil.HUB_URL = registry.url
+    dockerutil.REGISTRY_URL = registry.url
+    dockerutil.REGISTRY_AUTH_URL = "{}/token".format(registry.url)
+    labslauncher.GITHUB_URL = registry.url
+    results = list()
+    with engine, registry:
+        results.append(measure(
+            'image_meta', lambda: dockerutil._get_image_meta(IMAGE),
+            args.repeats, setup=clear_caches,
+            tags=lambda value, _: len(value)))
+        results.append(measure(
+            'image_tags', lambda: dockerutil.get_image_tags(IMAGE),
+            args.repeats, setup=clear_caches,
+            tags=lambda value, _: len(value)))
+
+        tags = dockerutil.get_image_tags(IMAGE)
+        # proxies are part of the cache key, an https proxy is not used
+        # for requests to the fakes
+        proxies = {'https': 'http://127.0.0.1:9'}
+        results.append(measure(
+            'tag_meta_proxies',
+            lambda: dockerutil.get_image_meta(
+                IMAGE, tags[0], proxies=proxies),
+            args.repeats, setup=clear_caches,
+            tag=lambda value, _: value['name']))
+        client = docker.from_env()
+        # only the oldest tag is local, such that all tags are inspected
+        results.append(measure(
+            'newest_tag',
+            lambda: dockerutil.newest_tag(IMAGE, tags=tags, client=client),
+            args.repeats, inspected=lambda *_: len(tags)))
+
+        def pull():
+            events = 0
+            for current, total in dockerutil.pull_with_progress(
+                    IMAGE, tags[0]):
+                events += 1
+            return events, current
+        results.append(measure(
+            'pull_progress', pull, args.repeats,
+            events=lambda value, _: value[0],
+            bytes=lambda value, _: value[1],
+            events_per_s=lambda value, times: value[0] / min(times)))
+
+        options = dict(
+            image_name=IMAGE, server_name=SERVER, data_bind='/epi2melabs',
+            container_cmd='start-notebook.sh', host_only=True)
+        dclient = dockerutil.DockerClient(**options)
+        dclient.is_running(refresh=False)
+        results.append(measure(
+            'set_status', dclient.set_status, args.repeats,
+            containers=lambda *_: args.containers + 1))
+        results.append(measure(
+            'pull_space', lambda: dclient.pull_space(tags[0]), args.repeats,
+            setup=dockerutil.IMAGE_LAYERS_CACHE.clear,
+            download=lambda value, _: value['download']))
+
+        def startup():
+            dclient = dockerutil.DockerClient(**options)
+            dclient.is_running()
+            releases = labslauncher.app_releases(
+                repository='labslauncher', user='epi2me-labs')
+            return dclient, releases
+        results.append(measure(
+            'startup', startup, args.repeats, setup=clear_caches,
+            status=lambda value, _: value[0].status.value[1],
+            releases=lambda value, _: len(value[1])))
+        if args.tray_seconds > 0:
+            results.append(tray_mode(engine, args.tray_seconds))
+    return results
+
+
+def main(argv=None):
+    """Run benchmarks and write results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--repeats', type=int, default=5, help='Timed calls per benchmark.')
+    parser.add_argument(
+        '--tags', type=int, default=500, help='Image tags on docker hub.')
+    parser.add_argument(
+        '--containers', type=int, default=300, help='Host containers.')
+    parser.add_argument(
+        '--pull_gb', type=int, default=5, help='Size of pulled image (GB).')
+    parser.add_argument(
+        '--releases', type=int, default=100, help='Application releases.')
+    parser.add_argument(
+        '--tray_seconds', type=float, default=60,
+        help='Duration of each tray mode measurement, 0 to skip.')
+    parser.add_argument(
+        '--output', help='Output file, default stdout.')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        'meta': {
+            'launcher_version': labslauncher.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'scale': {
+                'tags': args.tags, 'containers': args.containers,
+                'pull_bytes': args.pull_gb * 10**9,
+                'releases': args.releases}},
+        'results': results}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as fh:
+            fh.write(text + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
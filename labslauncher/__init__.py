@@ -1,19 +1,25 @@
 """Application for managing a notebook server."""
 import argparse
+import atexit
+import contextlib
 import functools
+import gzip
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 import sys
+import time
 import traceback
 
-import github
-from PyQt5 import sip  # noqa: F401
-from PyQt5.QtWidgets import QMessageBox
 import semver
 
 __version__ = "1.0.6"
 __UNCAUGHT__ = "Uncaught exception:"
 __LOGDIR__ = os.path.expanduser(os.path.join('~', '.labslauncher'))
+GITHUB_URL = "https://api.github.com"
 
 
 def get_server_link(port, token):
@@ -35,6 +41,131 @@ def get_named_logger(name):
     return logger
 
 
+@contextlib.contextmanager
+def timed(logger, operation):
+    """Log the duration of an operation.
+
+    :param logger: logger to use.
+    :param operation: name of the operation.
+
+    The duration is attached to the log record as the `duration` attribute
+    such that it is recorded by the structured log written by
+    `setup_logging`.
+    """
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - t0
+        logger.info(
+            "{} took {:.3f}s.".format(operation, duration),
+            extra={'operation': operation, 'duration': duration})
+
+
+def log_duration(operation):
+    """Decorate a method to log its duration with the instance's logger.
+
+    :param operation: name of the operation.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with timed(self.logger, operation):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as single line JSON objects."""
+
+    fields = ('operation', 'duration')
+
+    def format(self, record):
+        """Format a record.
+
+        :param record: a `logging.LogRecord`.
+        """
+        data = {
+            'time': record.created, 'logger': record.name,
+            'level': record.levelname, 'message': record.getMessage()}
+        for field in self.fields:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        return json.dumps(data)
+
+
+def duration_filter(record):
+    """Filter log records without a duration."""
+    return int(hasattr(record, 'duration'))
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as fh_in, gzip.open(dest, 'wb') as fh_out:
+        shutil.copyfileobj(fh_in, fh_out)
+    os.remove(source)
+
+
+def rotating_handler(fname, max_bytes, backups):
+    """Create a size-rotating file handler writing compressed archives.
+
+    :param fname: log filename.
+    :param max_bytes: size at which to rotate the log.
+    :param backups: number of archives to keep.
+    """
+    handler = logging.handlers.RotatingFileHandler(
+        fname, maxBytes=max_bytes, backupCount=backups)
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(
+        level, logdir=__LOGDIR__, max_bytes=10 * 1024 * 1024, backups=5,
+        console_level=None):
+    """Set up the application logging pipeline.
+
+    :param level: logging level.
+    :param logdir: directory in which to write logs.
+    :param max_bytes: size at which logs are rotated.
+    :param backups: number of compressed archives to keep.
+    :param console_level: logging level of the console, by default
+        `level`.
+
+    Records are placed on a queue by the calling thread and written to the
+    console, a text log and a structured (JSON lines) log of operation
+    durations by a background thread.
+
+    :returns: the package logger and the `QueueListener`.
+    """
+    os.makedirs(logdir, exist_ok=True)
+    formatter = logging.Formatter(
+        '[%(asctime)s - %(name)s] %(message)s', datefmt='%H:%M:%S')
+    filehandler = rotating_handler(
+        os.path.join(logdir, 'labslauncher.log'), max_bytes, backups)
+    filehandler.setFormatter(formatter)
+    jsonhandler = rotating_handler(
+        os.path.join(logdir, 'labslauncher.json'), max_bytes, backups)
+    jsonhandler.setFormatter(JSONFormatter())
+    jsonhandler.addFilter(duration_filter)
+    streamhandler = logging.StreamHandler()
+    streamhandler.setFormatter(formatter)
+    streamhandler.addFilter(uncaught_filter)
+    if console_level is not None:
+        streamhandler.setLevel(console_level)
+
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, filehandler, jsonhandler, streamhandler,
+        respect_handler_level=True)
+    logger = logging.getLogger(__package__)
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return logger, listener
+
+
 def log_level():
     """Parser to set logging level."""
     parser = argparse.ArgumentParser(
@@ -53,6 +184,8 @@ def log_level():
 
 def handle_unhandled(logger=None):
     """Set logging of uncaught exceptions and exit application."""
+    from PyQt5.QtWidgets import QMessageBox
+
     def _except_hook(logger, orig_hook, exctype, value, tb):
         lines = ''.join(traceback.format_exception(exctype, value, tb))
         if logger is not None:
@@ -99,13 +232,16 @@ def app_releases(
     by interpreting release names as semantic versioning versions after
     removing `release_prefix` if present.
     """
+    # imported here as it is slow to import and not required by the CLI
+    import github
+
     logger = get_named_logger("GHRlease")
     if token == "":
         token = None
     try:
         if token is None and user is None:
             raise ValueError("One of `token` or `user` must be given")
-        gh = github.Github(token)
+        gh = github.Github(token, base_url=GITHUB_URL)
         gh_user = gh.get_user(user)
         try:
             repo = gh_user.get_repo(repository)
@@ -185,6 +321,18 @@ class Defaults(list):
             "Fixed Tag",
             "Fix the container image to a specific tag.",
             "fixed_tag", "", True)
+        self.append(
+            "Channel",
+            "Server versions to follow: stable (releases), prerelease "
+            "(releases and release candidates) or dev (development "
+            "builds).",
+            "channel", "stable", True)
+        self.append(
+            "Version range",
+            "Restrict server versions, e.g. '>=1.2,<2'. An upper bound "
+            "also excludes prereleases of versions beyond it (e.g. "
+            "2.0.0-rc1 for '<2'). Leave empty to follow the newest version.",
+            "version_range", "", True)
         self.append(
             "Help link",
             "URL to quick start documentation.",
@@ -197,8 +345,13 @@ class Defaults(list):
             False)
         self.append(
             "Server Name",
-            "The name given to the actively running container.",
+            "The name given to the actively running container. A change "
+            "takes effect once the current server is stopped.",
             "server_name", "Epi2Me-Labs-Server", True)
+        self.append(
+            "Server instances",
+            "Additional notebook server instances (JSON list).",
+            "instances", "[]", False)
         self.append(
             "Data Mount",
             "Location on host computer accessible within notebooks.",
@@ -215,6 +368,11 @@ class Defaults(list):
             "Auxiliary Port",
             "Auxiliary network port for additional applications.",
             "aux_port", 8889, False)
+        self.append(
+            "Automatic ports",
+            "Choose free ports automatically when those requested are in "
+            "use.",
+            "auto_ports", False, True)
         self.append(
             "Security Token",
             "Security token for notebook server.",
@@ -247,10 +405,70 @@ class Defaults(list):
             "Docker arguments",
             "Extra arguments to provide to `docker run`.",
             "docker_args", "", True)
+        self.append(
+            "Cache volumes",
+            "Keep package caches and user installs in persistent docker "
+            "volumes.",
+            "cache_volumes", False, True)
+        self.append(
+            "Images to keep",
+            "Number of most recent server versions kept when removing old "
+            "images.",
+            "keep_images", 2, False)
+        self.append(
+            "Remove old images",
+            "Remove old server versions after downloading an update.",
+            "auto_remove_images", False, True)
+        self.append(
+            "Native images only",
+            "Use only server versions built for this computer's "
+            "architecture, rather than run others under (slow) emulation.",
+            "native_only", False, True)
+        self.append(
+            "Restart on failure",
+            "Restart the server automatically if it exits unexpectedly.",
+            "auto_restart", False, True)
+        self.append(
+            "Restart limit",
+            "Number of failures within the restart window after which "
+            "automatic restarts stop.",
+            "restart_limit", 5, False)
+        self.append(
+            "Restart window",
+            "Time (seconds) over which failures are counted.",
+            "restart_window", 600, False)
+        self.append(
+            "Health check interval",
+            "Time (seconds) between checks that the notebook server is "
+            "responding.",
+            "health_interval", 30, False)
+        self.append(
+            "Restart unresponsive server",
+            "Restart the server if it stops responding.",
+            "restart_unresponsive", False, True)
+        self.append(
+            "Run in system tray",
+            "Keep the server managed from the system tray when the window "
+            "is closed, checking its status less often.",
+            "tray_mode", False, True)
+        self.append(
+            "Tray status interval",
+            "Time (seconds) between status checks whilst in the system "
+            "tray.",
+            "tray_interval", 60, False)
         self.append(
             "Local access only",
             "Restrict access to notebook server to this computer only.",
             "docker_restrict", True, True)
+        self.append(
+            "Control API",
+            "Serve launcher state and accept commands on a local HTTP "
+            "port.",
+            "control_api", True, True)
+        self.append(
+            "Control API port",
+            "Port of the control API, zero to choose a free port.",
+            "control_port", 0, False)
         self.append(
             "Send pings",
             "Send usage statistics to ONT.",
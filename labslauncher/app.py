@@ -1,13 +1,9 @@
 """Labslauncher main application."""
 import argparse
-import configparser
+import collections
 from enum import Enum
 import functools
-import logging
-import logging.handlers
 import os
-import platform
-import socket
 import sys
 import webbrowser
 
@@ -15,19 +11,42 @@ from epi2melabs import ping
 import markdown
 from password_strength import PasswordPolicy
 from pkg_resources import resource_filename
+from PyQt5 import sip  # noqa: F401
 from PyQt5.QtCore import (
     PYQT_VERSION_STR, pyqtSignal as Signal, pyqtSlot as Slot,
     Qt, QT_VERSION_STR, QThreadPool, QTimer)
 from PyQt5.QtGui import QIcon, QIntValidator, QPixmap
 from PyQt5.QtWidgets import (
-    QAction, QApplication, QCheckBox, QComboBox, QDesktopWidget, QDialog,
-    QFileDialog, QGridLayout, QHBoxLayout, QLabel, QLineEdit, QMainWindow,
-    QMessageBox, QProgressBar, QPushButton, QStackedWidget, QTextEdit,
-    QVBoxLayout, QWidget)
+    QAbstractItemView, QAction, QApplication, QCheckBox, QComboBox,
+    QDesktopWidget, QDialog, QFileDialog, QGridLayout, QHBoxLayout, QLabel,
+    QLineEdit, QMainWindow, QMenu, QMessageBox, QProgressBar, QPushButton,
+    QStackedWidget, QSystemTrayIcon, QTableWidget, QTableWidgetItem,
+    QTextEdit, QVBoxLayout, QWidget)
 
 import labslauncher
-from labslauncher.dockerutil import DockerClient
-from labslauncher.qtext import Settings, Worker
+from labslauncher import dockerutil, preflight
+from labslauncher import health
+from labslauncher.control import ControlServer, ControlState
+from labslauncher.dockerutil import (
+    client_options, InsufficientSpaceError, PullError)
+from labslauncher.instances import (
+    container_resources, InstanceManager, ServerInstance)
+from labslauncher.logview import LogViewer
+from labslauncher.pings import PingQueue
+from labslauncher.qdocker import DockerClient
+from labslauncher.qtext import (
+    Settings, StringProperty, TaskManager, UpdateScheduler)
+from labslauncher.supervisor import OOM, RestartSupervisor
+from labslauncher.tagpolicy import TagPolicy
+
+
+FILE_SHARE_HELP = (
+    "The path {} is not shared with Docker. You can "
+    "configure shared paths from Docker > Settings "
+    "> Resources > Filesharing. The path specified "
+    "in Docker should either be the same as or "
+    "contain the path you specify in this "
+    "application.")
 
 
 class Screen(QWidget):
@@ -46,6 +65,16 @@ class Screen(QWidget):
         """Return the applications logger."""
         return self.app.logger
 
+    def subscribe(self, keys, callback):
+        """Subscribe to settings changes for the lifetime of the screen.
+
+        :param keys: iterable of setting keys.
+        :param callback: function called with the set of changed keys.
+        """
+        settings = self.app.settings
+        settings.subscribe(keys, callback)
+        self.destroyed.connect(lambda *args: settings.unsubscribe(callback))
+
 
 class HomeScreen(Screen):
     """The application home screen."""
@@ -101,6 +130,9 @@ class HomeScreen(Screen):
         # add callbacks
         self.app.docker.status.changed.connect(self.on_status)
         self.app.docker.tag.changed.connect(self.on_tag)
+        self.app.health.changed.connect(self.on_health)
+        self.subscribe(
+            ('help_link',), lambda keys: self.set_welcome_lbl_text())
         self.on_status(self.app.docker.status.value)
         self.on_tag(self.app.docker.tag.value)
 
@@ -114,7 +146,7 @@ class HomeScreen(Screen):
 
     def on_stop(self):
         """Stop and remove the container."""
-        self.app.docker.clear_container()
+        self.app.stop_server()
 
     @Slot(str)
     def on_tag(self, value):
@@ -123,6 +155,11 @@ class HomeScreen(Screen):
             "Launcher version: {}    Server Version: {}".format(
                 self.app.version, value))
 
+    @Slot(str)
+    def on_health(self, value):
+        """Update the status display when the server health changes."""
+        self.on_status(self.app.docker.status.value)
+
     @Slot(object)
     def on_status(self, status):
         """Set state when container status changes."""
@@ -139,6 +176,13 @@ class HomeScreen(Screen):
             extra_msg = "<br>(waiting for docker)"
         elif new == "running":
             color = "DarkGreen"
+            server_health = self.app.health.value
+            if server_health == health.DEGRADED:
+                color = "Orange"
+                extra_msg = "<br>(server is slow to respond)"
+            elif server_health == health.UNRESPONSIVE:
+                color = "Crimson"
+                extra_msg = "<br>(server is not responding)"
         else:
             color = "MediumTurquoise"
             start_text = "Start"
@@ -153,18 +197,15 @@ class HomeScreen(Screen):
         self.set_welcome_lbl_text()
 
         address = ""
-        container = self.app.docker.container
-        if container is not None and new == 'running':
-            cargs = container.__dict__['attrs']['Args']
-            for c in cargs:
-                if c.startswith('--port='):
-                    port = int(c.split('=')[1])
-                elif c.startswith('--NotebookApp.token='):
-                    token = c.split('=')[1]
-            address = labslauncher.get_server_link(port, token)
+        options = None
+        if new == 'running':
+            options = self.app.docker.server_options()
+        if options is not None:
+            address = labslauncher.get_server_link(
+                options['port'], options['token'])
             address = "<a href='{}'>Open EPI2MELabs</a>".format(address)
         self.address_lbl.setText(address)
-        self.repaint()
+        self.app.scheduler.schedule(self)
 
 
 class StartScreen(Screen):
@@ -194,6 +235,8 @@ class StartScreen(Screen):
         self.token_policy = PasswordPolicy.from_names(
             length=8, uppercase=1, numbers=1)
         self.onlyInt = QIntValidator()
+        self.pull_handle = None
+        self.pull_callback = None
         self.layout = QVBoxLayout()
 
         # header
@@ -256,6 +299,8 @@ class StartScreen(Screen):
         self.setLayout(self.layout)
 
         self.app.docker.status.changed.connect(self.on_status)
+        self.subscribe(
+            ('data_mount', 'token', 'port', 'aux_port'), self.on_settings)
         self.on_status(self.app.docker.status.value)
 
     def select_path(self):
@@ -267,24 +312,56 @@ class StartScreen(Screen):
         if path != "":  # did not press cancel
             self.path_txt.setText(path)
             self.app.settings["data_mount"] = path
+            self.app.tasks.submit(
+                self._probe_share, path, key=('share', path),
+                lane=TaskManager.INTERACTIVE).connect(
+                    result=self.on_share_probe)
+
+    def _probe_share(self, path, **kwargs):
+        """Probe whether a path can be shared with docker."""
+        return path, self.app.docker.can_share(path)
+
+    @Slot(object)
+    def on_share_probe(self, result):
+        """Warn the user if the selected path cannot be shared."""
+        path, shared = result
+        if shared is False and path == self.path_txt.text():
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Warning)
+            msg.setWindowTitle("File sharing")
+            msg.setText("Cannot share data path with server")
+            msg.setInformativeText(FILE_SHARE_HELP.format(path))
+            msg.exec_()
 
     def token_change(self):
         """Set state when user changes token."""
         self.app.settings["token"] = self.token_txt.text()
-        self.app.home.set_welcome_lbl_text()
 
     def port_change(self):
         """Set state when user changes port."""
-        self.app.settings["port"] = self.port_txt.text()
-        self.app.home.set_welcome_lbl_text()
+        if self.port_txt.hasAcceptableInput():
+            self.app.settings["port"] = self.port_txt.text()
 
     def aux_port_change(self):
         """Set state when user changes auxilary port."""
-        self.app.settings["aux_port"] = self.aux_port_txt.text()
-        self.app.home.set_welcome_lbl_text()
+        if self.aux_port_txt.hasAcceptableInput():
+            self.app.settings["aux_port"] = self.aux_port_txt.text()
+
+    def on_settings(self, keys):
+        """Display server options changed elsewhere.
+
+        :param keys: the changed setting keys.
+        """
+        boxes = {
+            'data_mount': self.path_txt, 'token': self.token_txt,
+            'port': self.port_txt, 'aux_port': self.aux_port_txt}
+        for key in keys:
+            value = str(self.app.settings[key])
+            if boxes[key].text() != value:
+                boxes[key].setText(value)
 
     def validate_and_start(self):
-        """Start the container."""
+        """Validate inputs and run start-up checks in a thread."""
         mount = self.app.settings["data_mount"]
         token = self.app.settings["token"]
         port = self.app.settings["port"]
@@ -292,18 +369,20 @@ class StartScreen(Screen):
         # validate inputs
         valid = all([
             mount != "",
-            os.path.isdir(mount),
             len(self.token_policy.test(token)) == 0,
             self.port_txt.hasAcceptableInput() and int(port) > 1024,
             self.aux_port_txt.hasAcceptableInput() and int(aux_port) > 1024,
             port != aux_port])
 
         if valid:
-            if (self.app.docker.latest_available_tag is None or
-                    self.app.settings["fixed_tag"] == "dev"):
-                self.pull_image(callback=self._start_container)
-            else:
-                self._start_container()
+            self.logger.info("Starting thread to run start-up checks.")
+            self.start_btn.setEnabled(False)
+            self.header_lbl.setText("Start server: (checking)")
+            checks = preflight.server_checks(
+                self.app.docker, mount, (port, aux_port))
+            self.app.tasks.submit(
+                preflight.run_checks, checks, key='preflight',
+                lane=TaskManager.INTERACTIVE).connect(result=self.on_checks)
         else:
             self.logger.warning("Container start options were invalid.")
             msg = QMessageBox(self)
@@ -319,61 +398,225 @@ class StartScreen(Screen):
                 "4. Port and Aux. port must be distinct.")
             msg.exec_()
 
+    @Slot(object)
+    def on_checks(self, results):
+        """Start the container if start-up checks passed.
+
+        :param results: list of `preflight.CheckResult`.
+        """
+        self.start_btn.setEnabled(True)
+        self.header_lbl.setText("Start server:")
+        results = {x.name: x for x in results}
+        failed = [x.name for x in results.values() if not x.passed]
+        conflict = results["Ports"].value
+        if failed == ["Ports"] and isinstance(
+                conflict, preflight.PortConflict):
+            if not self.resolve_ports(conflict):
+                return
+        elif len(failed) > 0:
+            self.logger.warning(
+                "Start-up checks failed: {}.".format(", ".join(failed)))
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Warning)
+            msg.setText("Start-up checks failed")
+            msg.setInformativeText(
+                "The server cannot be started, the following checks "
+                "failed: {}.".format(", ".join(failed)))
+            msg.setWindowTitle("Start-up error")
+            msg.setDetailedText(preflight.summarise(results.values()))
+            msg.exec_()
+            return
+
+        if results["Image"].value is None or results["Image update"].value:
+            self.pull_image(callback=self._start_container)
+        else:
+            self._start_container()
+
+    def resolve_ports(self, conflict):
+        """Optionally choose other ports when those requested are in use.
+
+        :param conflict: the `preflight.PortConflict` of the Ports check.
+
+        :returns: whether the container can be started.
+        """
+        if conflict.free is None:
+            self.logger.warning("Failed to find free ports.")
+            return False
+        port, aux_port = conflict.free
+        if not self.app.settings["auto_ports"]:
+            reply = QMessageBox.question(
+                self, "Port conflict",
+                "The port(s) {} are already in use. Use port {} and "
+                "auxiliary port {} instead?".format(
+                    ", ".join(str(x) for x in conflict.conflicts),
+                    port, aux_port))
+            if reply != QMessageBox.Yes:
+                return False
+        self.logger.info(
+            "Using free ports: {}, {}.".format(port, aux_port))
+        self.port_txt.setText(str(port))
+        self.aux_port_txt.setText(str(aux_port))
+        return True
+
     def _start_container(self):
-        """Start container."""
+        """Start container in a thread."""
         mount = self.app.settings["data_mount"]
         token = self.app.settings["token"]
         port = self.app.settings["port"]
         aux_port = self.app.settings["aux_port"]
+        send_pings = self.app.settings["send_pings"]
 
         for btn in (self.start_btn, self.update_btn):
             btn.setEnabled(False)
+        self.app.scheduler.schedule(self)
+        # a deliberate start forgives previous failures, whereas automatic
+        # restarts must not
+        self.app.supervisor.reset()
+        self.app.tasks.submit(
+            self._run_container, mount, token, port, aux_port, send_pings,
+            key='start_container', lane=TaskManager.INTERACTIVE).connect(
+                result=self.on_started, error=self.on_start_error,
+                finished=self.on_start_finished)
+
+    def _run_container(
+            self, mount, token, port, aux_port, send_pings, **kwargs):
+        """Start container and write configuration to the mount.
+
+        :returns: the container status after the start.
+        """
         self.app.docker.start_container(mount, token, port, aux_port)
-        self.repaint()
 
-        if self.app.docker.status.value[1] != "running":
+        status = self.app.docker.status.value[1]
+        if status != "running":
             self.logger.error("Failed to start container.")
         else:
             self.logger.info("Container started, writing config to mount.")
-            config = configparser.ConfigParser()
-            config['Host'] = {
-                'hostname': socket.gethostname(),
-                'operating_system': platform.platform()}
-            config['Container'] = {
-                'mount': mount, 'port': port, 'aux_port': aux_port,
-                'image_tag': self.app.docker.latest_available_tag,
-                'latest_tag': str(self.app.docker.latest_tag),
-                'id': self.app.docker.container.id}
-            config['Pings'] = {'enabled': self.app.settings["send_pings"]}
-            fname = os.path.join(mount, os.path.basename(ping.CONTAINER_META))
-            with open(fname, 'w') as config_file:
-                config.write(config_file)
+            self.app.docker.write_server_config(
+                mount, port, aux_port, send_pings)
             self.logger.info("Container started and primed.")
+        return status
+
+    @Slot(object)
+    def on_started(self, status):
+        """Report a container which failed to start.
+
+        Containers which were created but exited are reported by
+        `LabsLauncher.on_status`.
+        """
+        if status in ("running", "created", "exited"):
+            return
+        self._start_failed(self.app.docker.last_failure)
+
+    @Slot(tuple)
+    def on_start_error(self, error):
+        """Report an error raised whilst starting the container."""
+        _, _, tb = error
+        self._start_failed(tb)
+
+    def _start_failed(self, details):
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Critical)
+        msg.setWindowTitle("Server Error")
+        msg.setText("Failed to start server")
+        msg.setInformativeText(
+            "The notebook server could not be started, see details "
+            "below.")
+        msg.setDetailedText(details)
+        msg.exec_()
+
+    @Slot()
+    def on_start_finished(self):
+        """Re-enable the start and update buttons."""
+        new = self.app.docker.status.value[1]
+        self.start_btn.setEnabled(new != "unknown")
+        self.update_btn.setEnabled(
+            self.app.docker.update_available and new != "unknown")
+        self.app.scheduler.schedule(self)
 
     def pull_image(self, *args, callback=None):
         """Pull new image in a thread.
 
         :param callback: function to run when pull as completed.
         """
-        self.logger.info("Starting thread to pull image.")
-        self.worker = Worker(self.app.docker.pull_image)
-        self.worker.setAutoDelete(True)
-        self.app.closing.connect(self.worker.stop)
-
-        self.worker.signals.finished.connect(
-            lambda: self.update_btn.setEnabled(
-                self.app.docker.update_available))
-
+        handle = self.app.tasks.submit(
+            self.app.docker.pull_image, key=('pull', 'latest'),
+            lane=TaskManager.INTERACTIVE)
+        if handle is not self.pull_handle:
+            # a new pull, rather than a repeat request for one in progress
+            self.logger.info("Starting thread to pull image.")
+            self.pull_handle = handle
+            self.pull_callback = None
+            handle.finished.connect(
+                lambda: self.update_btn.setEnabled(
+                    self.app.docker.update_available))
+            self.progress_dlg = DownloadDialog(
+                progress=handle.progress, parent=self)
+            self.progress_dlg.finished.connect(handle.cancel)
+            handle.finished.connect(self.progress_dlg.close)
+            handle.connect(result=self.on_pulled, error=self.on_pull_error)
         if callback is not None:
-            self.worker.signals.finished.connect(callback)
-        self.progress_dlg = DownloadDialog(
-            progress=self.worker.signals.progress, parent=self)
-        self.progress_dlg.finished.connect(self.worker.stop)
-        self.worker.signals.finished.connect(self.progress_dlg.close)
-
-        self.app.pool.start(self.worker)
+            self.pull_callback = callback
         self.progress_dlg.show()
 
+    @Slot(object)
+    def on_pulled(self, image):
+        """Run the pending callback of a successful pull."""
+        callback, self.pull_callback = self.pull_callback, None
+        if image is not None and self.app.docker.platform_warning:
+            QMessageBox.warning(
+                self, "Server architecture",
+                "{}\n\nEnable 'native_only' in the settings to use only "
+                "versions built for this computer.".format(
+                    self.app.docker.platform_warning))
+        if image is not None and callback is not None:
+            callback()
+
+    @Slot(tuple)
+    def on_pull_error(self, error):
+        """Report a failed pull.
+
+        If the pull was refused for lack of disk space and removing old
+        images would free space, the user is offered to do so after which
+        the pull is retried.
+        """
+        callback, self.pull_callback = self.pull_callback, None
+        exctype, value, _ = error
+        if issubclass(exctype, PullError):
+            QMessageBox.warning(
+                self, "Download error",
+                "Failed to download the server ({} error, {} attempt(s)):"
+                "\n\n{}".format(value.kind, value.attempts, value))
+            return
+        if not issubclass(exctype, InsufficientSpaceError):
+            QMessageBox.warning(
+                self, "Download error",
+                "Failed to download the server:\n\n{}".format(value))
+            return
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Download error")
+        msg.setText("Insufficient disk space")
+        info = "{} Please free disk space and try again.".format(value)
+        remove_btn = None
+        if value.reclaimable > 0:
+            info = "{} Removing old server images would free {:.2f}Gb.".format(
+                value, value.reclaimable / 1024 ** 3)
+            remove_btn = msg.addButton(
+                "Remove old images", QMessageBox.AcceptRole)
+        msg.setInformativeText(info)
+        msg.addButton(QMessageBox.Cancel)
+        msg.exec_()
+        if remove_btn is not None and msg.clickedButton() == remove_btn:
+            self.app.tasks.submit(
+                self.app.docker.remove_old_images, key='remove_images',
+                lane=TaskManager.INTERACTIVE).connect(
+                    result=functools.partial(self._retry_pull, callback))
+
+    def _retry_pull(self, callback, report):
+        self.logger.info("Removed images: {}, retrying download.".format(
+            report['removed']))
+        self.pull_image(callback=callback)
+
     @Slot(float)
     def on_download(self, value):
         """Set state when download progress changes."""
@@ -400,7 +643,7 @@ class StartScreen(Screen):
         self.header_lbl.setText('Start server: {}'.format(msg))
         self.update_btn.setEnabled(
             self.app.docker.update_available and new != "unknown")
-        self.repaint()
+        self.app.scheduler.schedule(self)
 
 
 class DownloadDialog(QDialog):
@@ -503,6 +746,8 @@ class LabsLauncher(QMainWindow):
     """Main application window."""
 
     closing = Signal(bool)
+    control_command = Signal(str)
+    error_log_lines = 200
 
     def __init__(self, app, settings):
         """Initialize the main window."""
@@ -510,13 +755,15 @@ class LabsLauncher(QMainWindow):
         self.settings = settings
         self.version = labslauncher.__version__
         self.logger = labslauncher.get_named_logger("Launcher")
-        self.about = About(self.version)
-        releases = labslauncher.app_releases(
+        self.in_tray = False
+        self.quitting = False
+        # an error dialog deferred whilst in the tray, see `leave_tray`
+        self.pending_error = None
+        # the change log is recreated with the window contents
+        self.releases = labslauncher.app_releases(
             repository=self.settings['github_repo'],
             user=self.settings['github_user'],
             token=self.settings['github_token'])
-        self.change_log = ChangeLog(releases)
-        self.settings_dlg = SettingsDlg(self.settings, parent=self)
 
         self.setWindowTitle("EPI2ME Labs Launcher")
         # display in centre of screen and fixed size
@@ -526,66 +773,146 @@ class LabsLauncher(QMainWindow):
         self.move(qtRectangle.topLeft())
         self.setFixedSize(400, 400)
 
-        app.aboutToQuit.connect(self.settings.qsettings.sync)
+        app.aboutToQuit.connect(self.settings.flush)
 
         self.pool = QThreadPool()
+        self.tasks = TaskManager(self.pool, self)
+        # outstanding tasks (e.g. pulls) are cancelled once, on closing
+        self.closing.connect(self.tasks.cancel_all)
+        app.aboutToQuit.connect(self.tasks.cancel_all)
         app.aboutToQuit.connect(self.pool.waitForDone)
+        self.scheduler = UpdateScheduler(self)
 
-        fixed_tag = self.settings["fixed_tag"]
-        if fixed_tag == "":
-            fixed_tag = None
-        proxy = None
-        for protocol in ('ftp', 'http', 'https'):
-            value = self.settings["{}_proxy".format(protocol)]
-            if value != "":
-                if proxy is None:
-                    proxy = dict()
-                proxy[protocol] = value
-        self.docker = DockerClient(
-            self.settings["image_name"], self.settings["server_name"],
-            self.settings["data_bind"], self.settings["container_cmd"],
-            host_only=self.settings["docker_restrict"],
-            fixed_tag=fixed_tag, proxies=proxy)
+        self.docker = DockerClient(**client_options(self.settings))
+        self.settings.subscribe(self.docker_settings, self.on_docker_settings)
+        self.instances = InstanceManager.from_settings(
+            self.docker, self.settings)
 
         self.ping_timer = QTimer(self)
+        self.ping_timer.setInterval(1000*60*20)  # 20 minutes
+        self.ping_timer.timeout.connect(functools.partial(self.ping, 'update'))
         self.pinger = ping.Pingu()
+        self.ping_queue = PingQueue(
+            self.pinger, enabled=self.settings["send_pings"])
+        self.settings.subscribe(('send_pings',), self.on_ping_settings)
+        app.aboutToQuit.connect(self.ping_queue.stop)
+        self.supervisor = RestartSupervisor(
+            limit=self.settings["restart_limit"],
+            window=self.settings["restart_window"])
+        self.settings.subscribe(
+            ('restart_limit', 'restart_window'), self.on_restart_settings)
+        self.restart_timer = QTimer(self)
+        self.restart_timer.setSingleShot(True)
+        self.restart_timer.timeout.connect(self.restart_server)
+        self.hang_timer = QTimer(self)
+        self.hang_timer.setSingleShot(True)
+        self.hang_timer.timeout.connect(self.restart_unresponsive)
+        # whilst an unresponsive server is restarted it may be seen to exit
+        self.restarting_unresponsive = False
+        self.health = StringProperty(health.UNKNOWN)
+        self.health_monitor = health.HealthMonitor()
+        self.health_timer = QTimer(self)
+        self.health_timer.setInterval(
+            1000 * self.settings["health_interval"])
+        self.health_timer.timeout.connect(self.probe_health)
+        self.settings.subscribe(
+            ('health_interval',), lambda keys: self.health_timer.setInterval(
+                1000 * self.settings["health_interval"]))
         self.docker.status.changed.connect(self.on_status)
         self.on_status(self.docker.status.value, boot=True)
 
-        self.layout = QVBoxLayout()
+        self.control = None
+        self.control_state = ControlState(resources=self.server_resources)
+        for prop in (self.docker.status, self.docker.tag,
+                     self.docker._available, self.instances.statuses,
+                     self.health):
+            prop.changed.connect(self.publish_state)
+        self.publish_state()
+        self.control_command.connect(self.on_control_command)
+        self.settings.subscribe(
+            ('control_api', 'control_port'), self.on_control_settings)
+        self.on_control_settings()
+        app.aboutToQuit.connect(self.stop_control)
 
         self.file_menu = self.menuBar().addMenu("&File")
         self.exit_act = QAction("Exit", self)
         self.exit_act.triggered.connect(self.close)
         self.file_menu.addAction(self.exit_act)
         self.settings_act = QAction("Setting", self)
-        self.settings_act.triggered.connect(self.settings_dlg.show)
+        self.settings_act.triggered.connect(lambda: self.settings_dlg.show())
         self.file_menu.addAction(self.settings_act)
+        self.instances_act = QAction("Server instances", self)
+        self.instances_act.triggered.connect(lambda: self.instances_dlg.show())
+        self.file_menu.addAction(self.instances_act)
+        self.cache_act = QAction("Cache volumes", self)
+        self.cache_act.triggered.connect(lambda: self.cache_dlg.show())
+        self.file_menu.addAction(self.cache_act)
+        self.images_act = QAction("Server images", self)
+        self.images_act.triggered.connect(lambda: self.images_dlg.show())
+        self.file_menu.addAction(self.images_act)
+        self.log_act = QAction("Server log", self)
+        self.log_act.triggered.connect(lambda: self.log_viewer.show())
+        self.file_menu.addAction(self.log_act)
         self.help_menu = self.menuBar().addMenu("&Help")
         self.about_act = QAction('About', self)
-        self.about_act.triggered.connect(self.about.show)
+        self.about_act.triggered.connect(lambda: self.about.show())
         self.help_menu.addAction(self.about_act)
         self.change_log_act = QAction('Change log', self)
-        self.change_log_act.triggered.connect(self.change_log.show)
+        self.change_log_act.triggered.connect(lambda: self.change_log.show())
         self.help_menu.addAction(self.change_log_act)
         self.help_act = QAction("Help", self)
         self.help_act.triggered.connect(self.show_help)
         self.help_menu.addAction(self.help_act)
+        self.diagnostics_act = QAction("Diagnostics", self)
+        self.diagnostics_act.triggered.connect(
+            lambda: self.diagnostics_dlg.show())
+        self.help_menu.addAction(self.diagnostics_act)
+
+        self.tray = None
+        if QSystemTrayIcon.isSystemTrayAvailable():
+            self.tray = self.create_tray(app)
+            self.tray_act = QAction("Minimise to tray", self)
+            self.tray_act.triggered.connect(self.enter_tray)
+            self.file_menu.insertAction(self.exit_act, self.tray_act)
+
+        self.build_ui()
+        self.maybe_show_app_update()
+        self.logger.info("Application started.")
+
+    # dialogs destroyed with the screens in the tray, see `.release_ui()`
+    dialogs = (
+        'about', 'change_log', 'settings_dlg', 'instances_dlg', 'cache_dlg',
+        'images_dlg', 'log_viewer', 'diagnostics_dlg')
+
+    def build_ui(self):
+        """Create the screens and dialogs of the window."""
+        self.about = About(self.version)
+        self.change_log = ChangeLog(self.releases)
+        self.settings_dlg = SettingsDlg(self.settings, parent=self)
+        self.instances_dlg = InstancesDlg(self.instances, parent=self)
+        self.cache_dlg = CacheDlg(self.docker, parent=self)
+        self.images_dlg = ImagesDlg(self.docker, parent=self)
+        self.log_viewer = LogViewer(self.docker, parent=self)
+        self.closing.connect(self.log_viewer.stop)
+        self.diagnostics_dlg = DiagnosticsDlg(parent=self)
 
         self.stack = QStackedWidget()
         self.home = HomeScreen(parent=self)
         self.start = StartScreen(parent=self)
         self.update = UpdateScreen(parent=self)
         self.app_update = AppUpdateScreen(parent=self)
+        for screen in (self.home, self.start, self.update, self.app_update):
+            self.scheduler.watch(screen)
         # TODO: several parts of the code use the stack indexes
         self.stack.addWidget(self.home)
         self.stack.addWidget(self.start)
         self.stack.addWidget(self.update)
         self.stack.addWidget(self.app_update)
-        self.layout.addWidget(self.stack)
+        layout = QVBoxLayout()
+        layout.addWidget(self.stack)
 
         w = QWidget()
-        w.setLayout(self.layout)
+        w.setLayout(layout)
         self.setCentralWidget(w)
 
         self.home.goto_start.connect(self.show_start)
@@ -594,15 +921,135 @@ class LabsLauncher(QMainWindow):
             functools.partial(self.stack.setCurrentIndex, 1))
         self.app_update.goto_next.connect(
             functools.partial(self.stack.setCurrentIndex, 0))
-        self.maybe_show_app_update()
-        self.logger.info("Application started.")
+
+    def release_ui(self):
+        """Destroy the screens and dialogs whilst in the tray.
+
+        Only the status held by the docker client, instance manager and
+        health monitor is kept, the window contents are recreated by
+        `.leave_tray()`. Release is postponed whilst an interactive task,
+        which may report to a screen, or a modal dialog is open.
+        """
+        if not self.in_tray or self.home is None:
+            return
+        if (self.tasks.in_progress(TaskManager.INTERACTIVE) > 0
+                or QApplication.activeModalWidget() is not None):
+            QTimer.singleShot(1000, self.release_ui)
+            return
+        self.logger.info("Releasing window contents.")
+        self.log_viewer.stop()
+        self.centralWidget().deleteLater()
+        self.stack = self.home = self.start = self.update = None
+        self.app_update = None
+        for name in self.dialogs:
+            getattr(self, name).deleteLater()
+            setattr(self, name, None)
 
     def closeEvent(self, event):
-        """Emit closing signal on window close."""
+        """Emit closing signal on window close.
+
+        In tray mode the window is instead hidden, see `.enter_tray()`.
+        """
+        if (self.settings["tray_mode"] and self.tray is not None
+                and not self.quitting):
+            event.ignore()
+            self.enter_tray()
+            return
         self.logger.info("Quiting application.")
         self.closing.emit(True)
         super().closeEvent(event)
 
+    def create_tray(self, app):
+        """Create the system tray icon and its menu.
+
+        :param app: the `QApplication`.
+        """
+        tray = QSystemTrayIcon(app.windowIcon(), self)
+        menu = QMenu(self)
+        self.tray_status_act = menu.addAction("")
+        self.tray_status_act.setEnabled(False)
+        menu.addSeparator()
+        menu.addAction("Open").triggered.connect(self.leave_tray)
+        self.tray_stop_act = menu.addAction("Stop server")
+        self.tray_stop_act.triggered.connect(self.stop_server)
+        menu.addAction("Exit").triggered.connect(self.quit_from_tray)
+        tray.setContextMenu(menu)
+        tray.activated.connect(self.on_tray_activated)
+        for prop in (self.docker.status, self.health):
+            prop.changed.connect(self.update_tray)
+        return tray
+
+    def enter_tray(self):
+        """Hide the window, polling docker less often.
+
+        The screens and dialogs are destroyed, see `.release_ui()`.
+        """
+        if self.tray is None or self.in_tray:
+            return
+        self.logger.info("Entering tray mode.")
+        self.in_tray = True
+        QApplication.setQuitOnLastWindowClosed(False)
+        for name in self.dialogs:
+            getattr(self, name).hide()
+        self.log_viewer.stop()
+        self.hide()
+        interval = self.settings["tray_interval"]
+        self.docker.set_heartbeat(interval)
+        self.health_timer.setInterval(
+            1000 * max(interval, self.settings["health_interval"]))
+        self.update_tray()
+        self.tray.show()
+        self.release_ui()
+
+    def leave_tray(self):
+        """Show the window, restoring normal polling."""
+        if not self.in_tray:
+            return
+        self.logger.info("Leaving tray mode.")
+        self.in_tray = False
+        self.docker.set_heartbeat()
+        self.health_timer.setInterval(
+            1000 * self.settings["health_interval"])
+        # refresh state which may be up to a tray interval old
+        self.docker.is_running()
+        self.docker.set_status()
+        self.tray.hide()
+        QApplication.setQuitOnLastWindowClosed(True)
+        if self.home is None:
+            self.build_ui()
+            self.show_home()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        if self.pending_error is not None:
+            (reason,), self.pending_error = self.pending_error, None
+            self.display_error_dialog(reason=reason)
+
+    def quit_from_tray(self):
+        """Exit the application from the tray."""
+        self.quitting = True
+        self.close()
+        QApplication.quit()
+
+    def on_tray_activated(self, reason):
+        """Open the window when the tray icon is clicked."""
+        if reason in (
+                QSystemTrayIcon.Trigger, QSystemTrayIcon.DoubleClick):
+            self.leave_tray()
+
+    def update_tray(self, *args):
+        """Show the server status in the tray."""
+        if self.tray is None:
+            return
+        status = self.docker.status.value[1]
+        text = "Server: {}".format(status)
+        if status == "running" and self.health.value in (
+                health.DEGRADED, health.UNRESPONSIVE):
+            text = "{} ({})".format(text, self.health.value)
+        self.tray.setToolTip("EPI2ME Labs Launcher\n{}".format(text))
+        self.tray_status_act.setText(text)
+        self.tray_stop_act.setEnabled(status not in ("inactive", "unknown"))
+
     def show_help(self):
         """Open webbrowser with application help."""
         webbrowser.open(self.settings['help_link'])
@@ -611,6 +1058,7 @@ class LabsLauncher(QMainWindow):
         """Move to the home screen."""
         self.stack.setCurrentIndex(0)
 
+    @labslauncher.log_duration("maybe_show_app_update")
     def maybe_show_app_update(self):
         """Move to the application update screen."""
         releases = labslauncher.app_releases(
@@ -653,17 +1101,34 @@ class LabsLauncher(QMainWindow):
         if old == new:
             return
         self.logger.info("Status changed: '{}'->'{}'".format(old, new))
+        if new != "running":
+            self.docker.sampler.stop()
+        if new != "exited":
+            self.restart_timer.stop()
+        if new != "running":
+            self.hang_timer.stop()
+        self.health_monitor.reset()
+        self.health.value = health.UNKNOWN
+        if new == "running":
+            self.health_timer.start()
+        else:
+            self.health_timer.stop()
         if new == "running":
+            # samples are used by pings and served by the control API
+            if self.settings["send_pings"] or self.settings["control_api"]:
+                self.docker.sampler.start()
             if self.settings["send_pings"]:
                 self.ping('start')
-                callback = functools.partial(self.ping, 'update')
-                self.ping_timer.setInterval(1000*60*20)  # 20 minutes
                 self.ping_timer.start()
-                self.ping_timer.timeout.connect(callback)
         elif old == "running" and new == "inactive":
             if self.settings["send_pings"]:
                 self.ping_timer.stop()
                 self.ping('stop')
+        elif new == "unknown" and self.in_tray:
+            self.ping_timer.stop()
+            self.tray.showMessage(
+                "EPI2ME Labs", "The launcher cannot communicate with docker.",
+                QSystemTrayIcon.Warning)
         elif new == "unknown":
             self.ping_timer.stop()  # might not be required
             msg = QMessageBox(self)
@@ -674,7 +1139,7 @@ class LabsLauncher(QMainWindow):
                 "The application cannot communicate with docker.\n"
                 "Please ensure that docker is running\n")
             msg.exec_()
-        elif old == "unknown" and not boot:
+        elif old == "unknown" and not boot and not self.in_tray:
             msg = QMessageBox(self)
             msg.setWindowTitle("Docker connection")
             msg.setText("Docker connection")
@@ -682,13 +1147,146 @@ class LabsLauncher(QMainWindow):
                 "Connection to docker established.")
             msg.exec_()
         elif new == "exited" and not boot:
+            self.on_exited()
+
+    def on_exited(self):
+        """Restart the exited server, or display the error."""
+        if self.restarting_unresponsive:
+            # the hang was recorded, the exit is that of the restart
+            self.logger.info("Ignoring exit during restart of server.")
+            return
+        state = self.docker.exit_state()
+        if state is None:
             self.display_error_dialog()
+            return
+        if self.settings["auto_restart"]:
+            record, delay = self.supervisor.on_exit(state)
+            if delay is not None:
+                self.restart_timer.start(int(1000 * delay))
+                return
+        else:
+            record = self.supervisor.record(state)
+        reason = None
+        if record.reason == OOM:
+            reason = (
+                "The notebook server ran out of memory. Consider "
+                "increasing the memory available to docker.")
+        if self.supervisor.crash_loop:
+            reason = (
+                "The notebook server exited {} times in {} minutes, "
+                "automatic restarts have stopped. {}".format(
+                    len(self.supervisor.recent()),
+                    self.supervisor.window // 60, reason or "")).strip()
+        self.display_error_dialog(reason=reason)
+
+    def restart_server(self):
+        """Restart the exited server in a thread."""
+        self.tasks.submit(
+            self.docker.restart_container, key='restart_container').connect(
+                result=self.on_restarted)
 
-    def display_error_dialog(self):
+    @Slot(object)
+    def on_restarted(self, restarted):
+        """Handle a restart which left the server exited.
+
+        If the restart failed, or the server exited again before its status
+        was read, no status change is emitted, so the exit is handled here.
+
+        :param restarted: whether the container was restarted.
+        """
+        if self.docker.status.value == ("exited", "exited"):
+            self.logger.warning(
+                "Server exited {} restart.".format(
+                    "again after" if restarted else "following failed"))
+            self.on_exited()
+
+    def probe_health(self):
+        """Probe the responsiveness of the running server in a thread."""
+        options = self.docker.server_options()
+        if options is None:
+            return
+        port = options['port']
+        self.tasks.submit(
+            lambda **kwargs: health.probe_latency(port),
+            key='probe_health').connect(result=self.on_health)
+
+    @Slot(object)
+    def on_health(self, latency):
+        """Update the server health from a probe result.
+
+        :param latency: response time (seconds) or None.
+        """
+        if self.docker.status.value[1] != "running":
+            return
+        state = self.health_monitor.record(latency)
+        self.health.value = state
+        if (state != health.UNRESPONSIVE
+                or not self.settings["restart_unresponsive"]
+                or self.supervisor.crash_loop
+                or self.hang_timer.isActive()):
+            return
+        _, delay = self.supervisor.on_unresponsive()
+        if delay is None:
+            self.display_error_dialog(reason=(
+                "The notebook server stopped responding {} times in {} "
+                "minutes, automatic restarts have stopped.".format(
+                    len(self.supervisor.recent()),
+                    self.supervisor.window // 60)))
+            return
+        self.logger.warning(
+            "Restarting unresponsive server in {}s.".format(delay))
+        self.hang_timer.start(int(1000 * delay))
+
+    def restart_unresponsive(self):
+        """Restart the running, unresponsive, server in a thread."""
+        self.health_monitor.reset()
+        self.restarting_unresponsive = True
+        self.tasks.submit(
+            self.docker.restart_container, running=True,
+            key='restart_container').connect(
+                result=self.on_unresponsive_restarted,
+                finished=self.on_unresponsive_restart_finished)
+
+    @Slot(object)
+    def on_unresponsive_restarted(self, restarted):
+        """Report a failed restart of an unresponsive server.
+
+        :param restarted: whether the container was restarted.
+        """
+        if restarted or self.docker.status.value[1] == "running":
+            return
+        self.logger.warning("Failed to restart unresponsive server.")
+        self.display_error_dialog(reason=(
+            "The notebook server stopped responding and could not be "
+            "restarted."))
+
+    def on_unresponsive_restart_finished(self):
+        """Resume handling of server exits after a restart."""
+        self.restarting_unresponsive = False
+
+    def on_restart_settings(self, *args):
+        """Apply changed restart settings to the supervisor."""
+        self.supervisor.limit = self.settings["restart_limit"]
+        self.supervisor.window = self.settings["restart_window"]
+
+    def display_error_dialog(self, reason=None):
         """Display a dialog detailing the last server error.
 
+        :param reason: a description of the error, if known.
+
+        In tray mode a notification is shown and the dialog deferred until
+        the window is reopened.
+
         .. note:: It is assumed an error has indeed been encountered.
         """
+        if self.in_tray:
+            self.pending_error = (reason,)
+            self.tray.showMessage(
+                "EPI2ME Labs", "{} Open the launcher for details.".format(
+                    reason or "The notebook server has stopped."),
+                QSystemTrayIcon.Warning)
+            return
+        save_btn = None
         msg = QMessageBox(self)
         msg.setIcon(QMessageBox.Critical)
         msg.setText("Notebook server error")
@@ -698,25 +1296,44 @@ class LabsLauncher(QMainWindow):
                 "Cannot share data path with server. "
                 "Please check sharing has been enabled in docker.")
             msg.setDetailedText(
-                "The path {} is not shared with Docker. You can "
-                "configure shared paths from Docker > Settings "
-                "> Resources > Filesharing. The path specified "
-                "in Docker should either be the same as or "
-                "contain the path you specify in this "
-                "application.".format(self.settings["data_mount"]))
+                FILE_SHARE_HELP.format(self.settings["data_mount"]))
         else:
+            if reason is None:
+                reason = (
+                    "An unexpected error occurred in the notebook server.")
             msg.setInformativeText(
-                "An unexpected error occurred in the notebook server.")
-            logs = self.docker.container_logs()
+                "{} The last {} lines of the server log are shown "
+                "below.".format(reason, self.error_log_lines))
+            logs = self.docker.container_logs(tail=self.error_log_lines)
             if logs is None:
                 logs = "Unknown error."
+            else:
+                save_btn = msg.addButton(
+                    "Save full log", QMessageBox.ActionRole)
             self.logger.error(
                 "\n"
                 "<<<Start Container logs:\n"
                 "{}\n"
                 "<<<End Container logs.".format(logs))
             msg.setDetailedText(logs)
+        msg.addButton(QMessageBox.Ok)
         msg.exec_()
+        if save_btn is not None and msg.clickedButton() == save_btn:
+            self.save_container_logs()
+
+    def save_container_logs(self):
+        """Write the full container log to a file in a thread."""
+        fname, _ = QFileDialog.getSaveFileName(
+            self, "Save server log",
+            os.path.join(os.path.expanduser("~"), "epi2melabs-server.log"))
+        if fname == "":
+            return
+        handle = self.tasks.submit(
+            self.docker.save_logs, fname, key=('save_logs', fname))
+        handle.connect(result=self._on_logs_saved)
+
+    def _on_logs_saved(self, fname):
+        self.logger.info("Container logs written to {}.".format(fname))
 
     def moveEvent(self, event):
         """Move the progress dialog when main window moves."""
@@ -727,8 +1344,151 @@ class LabsLauncher(QMainWindow):
             geo.moveTopLeft(geo.topLeft() + diff)
             self.start.progress_dlg.setGeometry(geo)
 
+    docker_settings = (
+        'image_name', 'server_name', 'data_bind', 'container_cmd',
+        'docker_restrict', 'fixed_tag', 'ftp_proxy', 'http_proxy',
+        'https_proxy', 'cache_volumes', 'keep_images', 'auto_remove_images',
+        'native_only', 'channel', 'version_range')
+
+    def on_docker_settings(self, keys):
+        """Apply changed settings to the docker client.
+
+        :param keys: the changed setting keys.
+        """
+        self.docker.configure(**client_options(self.settings))
+        if self.start is not None and {
+                'image_name', 'fixed_tag', 'channel', 'version_range'}.\
+                intersection(keys):
+            self.start.update_btn.setEnabled(self.docker.update_available)
+
+    def publish_state(self, *args):
+        """Publish the server state to the control API."""
+        status = self.docker.status.value[1]
+        port = None
+        if status == "running":
+            options = self.docker.server_options()
+            if options is not None:
+                port = options['port']
+        self.control_state.update(
+            name=self.docker.server_name, status=status,
+            tag=self.docker.tag.value, available=self.docker._available.value,
+            health=self.health.value,
+            port=port, instances=dict(self.instances.statuses.value),
+            launcher_version=self.version)
+
+    def server_resources(self):
+        """Return the most recent resource usage of the server (or None).
+
+        .. note:: This method is called from control API threads.
+        """
+        stats = self.docker.sampler.latest
+        if stats is None or self.docker.status.value[1] != "running":
+            return None
+        return container_resources(stats)
+
+    def on_control_settings(self, *args):
+        """Start or stop the control API according to the settings."""
+        self.stop_control()
+        if not self.settings["control_api"]:
+            return
+        try:
+            self.control = ControlServer(
+                self.control_state, self.control_command.emit,
+                port=self.settings["control_port"])
+        except OSError:
+            self.logger.exception("Failed to start control API.")
+            return
+        self.control.start()
+
+    def stop_control(self, *args):
+        """Stop the control API."""
+        if self.control is not None:
+            self.control.stop()
+            self.control = None
+
+    @Slot(str)
+    def on_control_command(self, command):
+        """Run a command received by the control API.
+
+        :param command: one of `control.COMMANDS`.
+        """
+        if command == "start":
+            if self.start is None:
+                # released in the tray, the start screen runs the checks
+                self.build_ui()
+                QTimer.singleShot(0, self.release_ui)
+            self.start.validate_and_start()
+        elif command == "stop":
+            self.stop_server()
+
+    def stop_server(self):
+        """Stop and remove the server container in a thread."""
+        self.tasks.submit(
+            lambda **kwargs: self.docker.clear_container(),
+            key='stop_container', lane=TaskManager.INTERACTIVE)
+
+    def diagnostics(self):
+        """Return diagnostic information on the application.
+
+        :returns: dictionary of section title to a list of (item, value).
+        """
+        properties = (
+            ("Server status", self.docker.status),
+            ("Host containers", self.docker.states),
+            ("Server version", self.docker.tag),
+            ("Docker available", self.docker._available),
+            ("Instance statuses", self.instances.statuses),
+            ("Server health", self.health))
+        return collections.OrderedDict((
+            ("Property emissions (emitted/suppressed)", [
+                (name, "{}/{}".format(prop.emitted, prop.suppressed))
+                for name, prop in properties]),
+            ("Rendering", self.scheduler.stats()),
+            ("Tasks", self.tasks.stats()),
+            ("Last download", self._pull_diagnostics()),
+            ("Server restarts", self.supervisor.stats()),
+            ("Server health", self.health_monitor.stats()),
+            ("Docker Hub rate limits",
+                dockerutil.HUB_BUDGET.stats() +
+                dockerutil.REGISTRY_BUDGET.stats())))
+
+    def probe_rate_limits(self):
+        """Update the Docker Hub pull budget in a thread."""
+        def _probe(**kwargs):
+            try:
+                tag = self.docker.latest_available_tag or 'latest'
+                return dockerutil.probe_pull_budget(
+                    self.docker.image_name, tag, proxies=self.docker.proxies)
+            except Exception as e:
+                self.logger.warning(
+                    "Failed to query Docker Hub pull budget: {}".format(e))
+        self.tasks.submit(_probe, key='probe_rate_limits').connect(
+            result=self._on_rate_limits)
+
+    def _on_rate_limits(self, *args):
+        if self.diagnostics_dlg is not None:
+            self.diagnostics_dlg.refresh()
+
+    def _pull_diagnostics(self):
+        stats = self.docker.pull_stats
+        if stats is None:
+            return list()
+        return [
+            ("Attempts", stats['attempts']),
+            ("Time in failed attempts", "{:.1f}s".format(
+                stats['failed_time'])),
+            ("Time waiting to retry", "{:.1f}s".format(stats['backoff'])),
+            ("Error", stats['error'] or "none")]
+
+    def on_ping_settings(self, *args):
+        """Enable or disable pings, discarding undelivered pings."""
+        enabled = self.settings["send_pings"]
+        self.ping_queue.set_enabled(enabled)
+        if not enabled:
+            self.ping_timer.stop()
+
     def ping(self, state):
-        """Send a status ping.
+        """Queue a status ping.
 
         :param state: the container state (start, update, stop).
         """
@@ -739,13 +1499,13 @@ class LabsLauncher(QMainWindow):
         if state == 'stop':
             stats = self.docker.final_stats
         else:
-            if self.docker.container is None:
+            if self.docker.status.value[1] != "running":
                 return
             else:
-                stats = self.docker.container.stats(stream=False)
-        self.logger.info("Sending ping data, state={}.".format(state))
-        self.pinger.send_container_ping(
-            state, stats, self.docker.image_name)
+                # evaluated by the queue's thread
+                stats = self.docker.sampler.get
+        self.logger.info("Queueing ping data, state={}.".format(state))
+        self.ping_queue.put(state, stats, self.docker.image_name)
 
 
 class About(QDialog):
@@ -770,6 +1530,40 @@ class About(QDialog):
         self.setLayout(self.layout)
 
 
+class DiagnosticsDlg(QDialog):
+    """Dialog displaying application diagnostics."""
+
+    def __init__(self, parent=None):
+        """Initialize the dialog."""
+        super().__init__(parent)
+        self.setWindowTitle("Diagnostics")
+        self.layout = QVBoxLayout()
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.layout.addWidget(self.text)
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.layout.addWidget(self.refresh_btn)
+        self.setLayout(self.layout)
+        self.resize(400, 400)
+
+    def showEvent(self, event):
+        """Refresh diagnostics when shown."""
+        super().showEvent(event)
+        self.parent().probe_rate_limits()
+        self.refresh()
+
+    def refresh(self):
+        """Display current diagnostics."""
+        text = list()
+        for section, items in self.parent().diagnostics().items():
+            text.append("<b>{}</b><br>".format(section))
+            for item, value in items:
+                text.append("{}: {}<br>".format(item, value))
+            text.append("<br>")
+        self.text.setHtml("".join(text))
+
+
 class ChangeLog(QDialog):
     """Application changelog dialog."""
 
@@ -793,6 +1587,424 @@ class ChangeLog(QDialog):
         self.setFixedSize(400, 400)
 
 
+class InstanceDlg(QDialog):
+    """Dialog to define an additional server instance."""
+
+    def __init__(self, parent=None):
+        """Initialize the dialog."""
+        super().__init__(parent)
+        self.setWindowTitle("New server instance")
+        self.token_policy = PasswordPolicy.from_names(
+            length=8, uppercase=1, numbers=1)
+        self.onlyInt = QIntValidator()
+        self.layout = QVBoxLayout()
+
+        self.l0 = QGridLayout()
+        self.name_txt = QLineEdit()
+        self.path_btn = QPushButton('Select folder')
+        self.path_btn.clicked.connect(self.select_path)
+        self.path_txt = QLineEdit(text=os.path.expanduser("~"))
+        self.path_txt.setReadOnly(True)
+        self.token_txt = QLineEdit()
+        self.token_txt.setMaxLength(16)
+        self.token_txt.setToolTip(StartScreen.token_help)
+        self.port_txt = QLineEdit()
+        self.port_txt.setValidator(self.onlyInt)
+        self.aux_port_txt = QLineEdit()
+        self.aux_port_txt.setValidator(self.onlyInt)
+        rows = (
+            (QLabel('Name:'), self.name_txt),
+            (self.path_btn, self.path_txt),
+            (QLabel('Token:'), self.token_txt),
+            (QLabel('Port:'), self.port_txt),
+            (QLabel('Aux. Port:'), self.aux_port_txt))
+        for row, (lab, wid) in enumerate(rows):
+            self.l0.addWidget(lab, row, 0)
+            self.l0.addWidget(wid, row, 1)
+        self.layout.addLayout(self.l0)
+
+        self.l1 = QHBoxLayout()
+        self.ok_btn = QPushButton("OK")
+        self.ok_btn.clicked.connect(self.validate)
+        self.l1.addWidget(self.ok_btn)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.reject)
+        self.l1.addWidget(self.cancel_btn)
+        self.layout.addLayout(self.l1)
+        self.setLayout(self.layout)
+
+    def select_path(self):
+        """Open data path dialog."""
+        path = QFileDialog.getExistingDirectory(
+            None, 'Open working directory', self.path_txt.text(),
+            QFileDialog.ShowDirsOnly)
+        if path != "":
+            self.path_txt.setText(path)
+
+    def validate(self):
+        """Accept the dialog if inputs are valid."""
+        port, aux_port = self.port_txt.text(), self.aux_port_txt.text()
+        valid = all([
+            self.name_txt.text() != "",
+            os.path.isdir(self.path_txt.text()),
+            len(self.token_policy.test(self.token_txt.text())) == 0,
+            self.port_txt.hasAcceptableInput() and int(port) > 1024,
+            self.aux_port_txt.hasAcceptableInput() and int(aux_port) > 1024,
+            port != aux_port])
+        if valid:
+            self.accept()
+        else:
+            QMessageBox.warning(
+                self, "Input error",
+                "A name and valid folder must be given, the token must be "
+                "8 characters and include uppercase, lowercase and numbers, "
+                "and the ports must be distinct and >1024.")
+
+    def instance(self):
+        """Return the `ServerInstance` defined by the dialog."""
+        return ServerInstance(
+            self.name_txt.text(), self.path_txt.text(),
+            self.token_txt.text(), self.port_txt.text(),
+            self.aux_port_txt.text())
+
+
+class InstancesDlg(QDialog):
+    """Dialog to manage additional server instances."""
+
+    columns = (
+        "Name", "Status", "Port", "Aux. Port", "Mount", "CPU", "Memory")
+
+    def __init__(self, manager, parent=None):
+        """Initialize the dialog.
+
+        :param manager: an `InstanceManager`.
+        """
+        super().__init__(parent)
+        self.logger = self.parent().logger
+        self.manager = manager
+        self.resources = dict()
+        self.setWindowTitle("Server instances")
+        self.resize(700, 300)
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.layout.addWidget(self.table)
+
+        self.l0 = QHBoxLayout()
+        buttons = (
+            ("Add", self.add_instance), ("Remove", self.remove_instance),
+            ("Start", self.start_instance), ("Stop", self.stop_instance),
+            ("Resources", self.refresh_resources), ("Close", self.close))
+        for text, slot in buttons:
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            self.l0.addWidget(btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+
+        self.manager.statuses.changed.connect(self.on_statuses)
+        self.on_statuses(self.manager.statuses.value)
+
+    @property
+    def selected(self):
+        """Return the name of the selected instance, or None."""
+        rows = self.table.selectionModel().selectedRows()
+        if len(rows) == 0:
+            return None
+        return self.table.item(rows[0].row(), 0).text()
+
+    @Slot(object)
+    def on_statuses(self, statuses):
+        """Populate the table when instance statuses change."""
+        selected = self.selected
+        self.table.setRowCount(len(self.manager.instances))
+        for row, inst in enumerate(self.manager.instances.values()):
+            status = statuses.get(inst.name, "unknown")
+            cpu, mem = "", ""
+            if status == "running" and inst.name in self.resources:
+                res = self.resources[inst.name]
+                cpu = "{:.1f}%".format(res['cpu'])
+                mem = "{:.2f}Gb".format(res['memory'] / 1024 ** 3)
+            values = (
+                inst.name, status, inst.port, inst.aux_port, inst.mount,
+                cpu, mem)
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(str(value)))
+            if inst.name == selected:
+                self.table.selectRow(row)
+
+    def add_instance(self):
+        """Define a new instance."""
+        dlg = InstanceDlg(parent=self)
+        if dlg.exec_() != QDialog.Accepted:
+            return
+        settings = self.parent().settings
+        try:
+            self.manager.add(
+                dlg.instance(),
+                reserved=(settings["port"], settings["aux_port"]))
+        except ValueError as e:
+            QMessageBox.warning(self, "Input error", str(e))
+        else:
+            self.manager.save(settings)
+            self.manager.refresh()
+
+    def remove_instance(self):
+        """Stop the selected instance in a thread, then remove it."""
+        name = self.selected
+        if name is not None:
+            self.parent().tasks.submit(
+                self._stop_instance, name,
+                key=('remove_instance', name)).connect(
+                    result=self.on_instance_removed)
+
+    @Slot(object)
+    def on_instance_removed(self, name):
+        """Remove the definition of a stopped instance."""
+        if name in self.manager.instances:
+            self.manager.remove(name, stop=False)
+            self.manager.save(self.parent().settings)
+        self.manager.refresh()
+
+    def start_instance(self):
+        """Start the selected instance in a thread."""
+        name = self.selected
+        if name is not None:
+            self.parent().tasks.submit(
+                self._start_instance, name, key=('start_instance', name),
+                lane=TaskManager.INTERACTIVE).connect(
+                    result=self.on_instance_started,
+                    error=self.on_instance_error)
+
+    def _start_instance(self, name, **kwargs):
+        self.manager.start(name)
+        return name
+
+    @Slot(object)
+    def on_instance_started(self, name):
+        """Check the started instance is running."""
+        self.manager.refresh()
+        if self.manager.statuses.value.get(name) != "running":
+            QMessageBox.warning(
+                self, "Server Error",
+                "Failed to start instance '{}'.".format(name))
+
+    @Slot(tuple)
+    def on_instance_error(self, error):
+        """Display an error from starting an instance."""
+        exctype, value, _ = error
+        if issubclass(exctype, ValueError):
+            QMessageBox.warning(self, "Port conflict", str(value))
+        else:
+            QMessageBox.warning(
+                self, "Server Error",
+                "Failed to start instance:\n\n{}".format(value))
+
+    def stop_instance(self):
+        """Stop the selected instance in a thread."""
+        name = self.selected
+        if name is not None:
+            self.parent().tasks.submit(
+                self._stop_instance, name,
+                key=('stop_instance', name)).connect(
+                    finished=self.manager.refresh)
+
+    def _stop_instance(self, name, **kwargs):
+        self.manager.stop(name)
+        return name
+
+    def refresh_resources(self):
+        """Fetch resource usage of running instances in a thread."""
+        self.parent().tasks.submit(
+            self.manager.resources, key='instance_resources').connect(
+                result=self.on_resources)
+
+    @Slot(object)
+    def on_resources(self, resources):
+        """Display resource usage of running instances."""
+        self.resources = resources
+        self.on_statuses(self.manager.statuses.value)
+
+
+class CacheDlg(QDialog):
+    """Dialog to display and prune persistent cache volumes."""
+
+    columns = ("Volume", "Type", "Server version", "Size")
+
+    def __init__(self, client, parent=None):
+        """Initialize the dialog.
+
+        :param client: a `DockerClient`.
+        """
+        super().__init__(parent)
+        self.client = client
+        self.setWindowTitle("Cache volumes")
+        self.resize(600, 300)
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.layout.addWidget(self.table)
+        self.total_lbl = QLabel()
+        self.layout.addWidget(self.total_lbl)
+
+        self.l0 = QHBoxLayout()
+        buttons = (
+            ("Refresh", self.refresh),
+            ("Prune old", functools.partial(self.prune, True)),
+            ("Remove all", functools.partial(self.prune, False)),
+            ("Close", self.close))
+        for text, slot in buttons:
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            self.l0.addWidget(btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+
+    def showEvent(self, event):
+        """Refresh volume information when shown."""
+        super().showEvent(event)
+        self.refresh()
+
+    def _start(self, fn, key):
+        self.total_lbl.setText("Querying docker...")
+        self.parent().tasks.submit(fn, key=key).connect(
+            result=self.on_usage, error=self.on_error)
+
+    def refresh(self):
+        """Fetch volume information in a thread."""
+        self._start(self.client.cache_volume_usage, 'cache_usage')
+
+    def prune(self, keep_current):
+        """Remove cache volumes in a thread.
+
+        :param keep_current: keep volumes for the current server version.
+        """
+        def _prune(**kwargs):
+            self.client.prune_cache_volumes(keep_current=keep_current)
+            return self.client.cache_volume_usage()
+        self._start(_prune, ('cache_prune', keep_current))
+
+    @Slot(tuple)
+    def on_error(self, error):
+        """Report failure to query docker."""
+        self.total_lbl.setText("Failed to query docker.")
+
+    @Slot(object)
+    def on_usage(self, usage):
+        """Populate the table with volume information."""
+        self.table.setRowCount(len(usage))
+        for row, vol in enumerate(usage):
+            size = "unknown"
+            if vol['size'] >= 0:
+                size = "{:.2f}Gb".format(vol['size'] / 1024 ** 3)
+            values = (vol['name'], vol['kind'], vol['tag'], size)
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(str(value)))
+        total = sum(x['size'] for x in usage if x['size'] > 0)
+        self.total_lbl.setText(
+            "Total size: {:.2f}Gb".format(total / 1024 ** 3))
+
+
+class ImagesDlg(QDialog):
+    """Dialog to display and remove old server images."""
+
+    columns = (
+        "Server version", "Platform", "Size", "Unique size", "Retained")
+
+    def __init__(self, client, parent=None):
+        """Initialize the dialog.
+
+        :param client: a `DockerClient`.
+        """
+        super().__init__(parent)
+        self.client = client
+        self.setWindowTitle("Server images")
+        self.resize(600, 300)
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.layout.addWidget(self.table)
+        self.total_lbl = QLabel()
+        self.total_lbl.setWordWrap(True)
+        self.layout.addWidget(self.total_lbl)
+
+        self.l0 = QHBoxLayout()
+        buttons = (
+            ("Refresh", self.refresh),
+            ("Remove old", self.remove),
+            ("Close", self.close))
+        for text, slot in buttons:
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            self.l0.addWidget(btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+        self.report = None
+
+    def showEvent(self, event):
+        """Refresh image information when shown."""
+        super().showEvent(event)
+        self.report = None
+        self.refresh()
+
+    def _start(self, fn, key):
+        self.total_lbl.setText("Querying docker...")
+        self.parent().tasks.submit(fn, key=key).connect(
+            result=self.on_usage, error=self.on_error)
+
+    def refresh(self):
+        """Fetch image information in a thread."""
+        def _usage(**kwargs):
+            return self.client.image_usage()
+        self._start(_usage, 'image_usage')
+
+    def remove(self):
+        """Remove images not retained in a thread."""
+        def _remove(**kwargs):
+            self.report = self.client.remove_old_images()
+            return self.client.image_usage()
+        self._start(_remove, 'remove_images')
+
+    @Slot(tuple)
+    def on_error(self, error):
+        """Report failure to query docker."""
+        self.total_lbl.setText("Failed to query docker.")
+
+    @Slot(object)
+    def on_usage(self, usage):
+        """Populate the table with image information."""
+        images = usage['images']
+        self.table.setRowCount(len(images))
+        for row, image in enumerate(images):
+            values = (
+                ", ".join(image['tags']) or "untagged", image['platform'],
+                "{:.2f}Gb".format(image['size'] / 1024 ** 3),
+                "{:.2f}Gb".format(image['unique_size'] / 1024 ** 3),
+                image['keep'] or "no")
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(str(value)))
+        text = "Docker images use {:.2f}Gb, removable: {:.2f}Gb.".format(
+            usage['layers_size'] / 1024 ** 3,
+            sum(x['unique_size'] for x in images if x['keep'] is None)
+            / 1024 ** 3)
+        if self.report is not None:
+            text += " Removed {} image(s), reclaiming {:.2f}Gb.".format(
+                len(self.report['removed']),
+                self.report['reclaimed'] / 1024 ** 3)
+            if len(self.report['failed']) > 0:
+                text += " Failed to remove: {}.".format(
+                    ", ".join(self.report['failed']))
+        self.total_lbl.setText(text)
+
+
 class SettingsDlg(QDialog):
     """About dialog."""
 
@@ -856,31 +2068,53 @@ class SettingsDlg(QDialog):
     def _mutable_settings(self):
         return (x for x in self.settings.spec if x['gui_menu'])
 
+    def showEvent(self, event):
+        """Display the current settings when shown."""
+        super().showEvent(event)
+        for key, wid in self.val_boxes.items():
+            self._set_widget(wid, self.settings[key])
+
     def store_settings(self):
-        """Save settings in edit fields to Qt settings manager."""
+        """Save settings in edit fields, applying changes immediately."""
         self.logger.info("Saving configuration.")
-        for key, wid in self.val_boxes.items():
-            value = None
-            if isinstance(wid, QLineEdit):
-                value = wid.text()
-            elif isinstance(wid, QCheckBox):
-                value = wid.isChecked()
-            elif isinstance(wid, QComboBox):
-                value = wid.currentData()
-            else:
-                raise TypeError("Unhandled widget type when setting item.")
-            self.settings[key] = value
-        self.settings.qsettings.sync()
-        msg = QMessageBox()
-        msg.setIcon(QMessageBox.Information)
-        msg.setText("Restart Application")
-        msg.setInformativeText(
-            "Please restart the Launcher application for settings "
-            "to take effect.")
-        msg.setWindowTitle("Restart Notice")
-        msg.exec_()
+        try:
+            TagPolicy(
+                self.val_boxes['channel'].text(),
+                self.val_boxes['version_range'].text())
+        except ValueError as e:
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Information)
+            msg.setText("Input error")
+            msg.setInformativeText(str(e))
+            msg.setWindowTitle("Input error")
+            msg.exec_()
+            return
+        with self.settings.batch():
+            for key, wid in self.val_boxes.items():
+                value = None
+                if isinstance(wid, QLineEdit):
+                    value = wid.text()
+                elif isinstance(wid, QCheckBox):
+                    value = wid.isChecked()
+                elif isinstance(wid, QComboBox):
+                    value = wid.currentData()
+                else:
+                    raise TypeError(
+                        "Unhandled widget type when setting item.")
+                self.settings[key] = value
         self.close()
 
+    def _set_widget(self, wid, value):
+        if isinstance(wid, QLineEdit):
+            wid.setText(value)
+        elif isinstance(wid, QCheckBox):
+            wid.setChecked(value)
+        elif isinstance(wid, QComboBox):
+            wid.setCurrentText(value.name)
+        else:
+            raise TypeError("Unhandled widget type when setting value.")
+        self.parent().scheduler.schedule(wid)
+
     def set_defaults(self):
         """Set edit fields to default values.
 
@@ -888,16 +2122,7 @@ class SettingsDlg(QDialog):
         """
         self.logger.info("Preparing default configuration.")
         for key, wid in self.val_boxes.items():
-            value = self.settings.spec.by_key[key]['default']
-            if isinstance(wid, QLineEdit):
-                wid.setText(value)
-            elif isinstance(wid, QCheckBox):
-                wid.setChecked(value)
-            elif isinstance(wid, QComboBox):
-                wid.setCurrentText(value.name)
-            else:
-                raise TypeError("Unhandled widget type when setting default.")
-            wid.repaint()
+            self._set_widget(wid, self.settings.spec.by_key[key]['default'])
 
 
 def main():
@@ -918,25 +2143,15 @@ def main():
     app.setWindowIcon(app_icon)
 
     # setup logging
-    os.makedirs(labslauncher.__LOGDIR__, exist_ok=True)
-    formatter = logging.Formatter(
-        '[%(asctime)s - %(name)s] %(message)s', datefmt='%H:%M:%S')
-    logger = logging.getLogger(__package__)
-    logger.setLevel(args.log_level)
-    filehandler = logging.handlers.RotatingFileHandler(
-        os.path.join(labslauncher.__LOGDIR__, 'labslauncher.log'))
-    filehandler.setFormatter(formatter)
-    logger.addHandler(filehandler)
-    streamhandler = logging.StreamHandler()
-    streamhandler.setFormatter(formatter)
-    streamhandler.addFilter(labslauncher.uncaught_filter)
-    logger.addHandler(streamhandler)
+    logger, _ = labslauncher.setup_logging(args.log_level)
 
     # write unhandled exceptions to log, and force exit
     labslauncher.handle_unhandled(logger)
 
     # start gui
     logger.info("Starting application.")
-    launcher = LabsLauncher(app, settings)
+    with labslauncher.timed(
+            labslauncher.get_named_logger("Launcher"), "startup"):
+        launcher = LabsLauncher(app, settings)
     launcher.show()
     sys.exit(app.exec_())
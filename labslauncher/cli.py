@@ -0,0 +1,345 @@
+"""Command line interface for managing a notebook server without Qt."""
+import argparse
+import json
+import logging
+import sys
+import urllib.request
+
+import labslauncher
+from labslauncher import control, preflight
+from labslauncher.dockerutil import (
+    client_options, DockerClient, get_image_tags,
+    INSTANCE_LABEL, InsufficientSpaceError, PullError)
+from labslauncher.settings import JSONStore, MemoryStore, SettingsModel
+
+
+class Progress():
+    """Write download progress to stderr, in place of a Qt signal."""
+
+    def __init__(self, quiet=False):
+        """Initialize the writer.
+
+        :param quiet: write nothing.
+        """
+        self.quiet = quiet
+        self.last = None
+
+    def emit(self, value):
+        """Write progress.
+
+        :param value: percentage progress.
+        """
+        value = int(value)
+        if self.quiet or value == self.last:
+            return
+        self.last = value
+        sys.stderr.write("\rDownloading: {}%".format(value))
+        if value >= 100:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+def load_settings():
+    """Load the settings last stored by the graphical application.
+
+    Changes are not written back, such that command line options apply only
+    to the current invocation.
+    """
+    return SettingsModel(
+        labslauncher.Defaults(), store=MemoryStore(JSONStore().load()))
+
+
+def _tail(value):
+    return value if value == 'all' else int(value)
+
+
+def _output(args, data, text):
+    if args.json:
+        print(json.dumps(data, indent=2, sort_keys=True))
+    else:
+        print(text)
+
+
+def control_status(timeout=0.5):
+    """Return the state served by a running launcher, or None.
+
+    :param timeout: request timeout (seconds).
+    """
+    found = control.discover()
+    if found is None:
+        return None
+    try:
+        with urllib.request.urlopen(
+                "http://127.0.0.1:{}/status".format(found[0]),
+                timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except Exception:
+        return None
+
+
+def _platform_warning(client):
+    if client.platform_warning:
+        sys.stderr.write("Warning: {} Use --native_only 1 to use only "
+                         "native versions.\n".format(client.platform_warning))
+
+
+def _report_status(args, settings, name, server, instances):
+    link = labslauncher.get_server_link(settings["port"], settings["token"])
+    lines = ["{}: {}".format(name, server)]
+    if server == "running":
+        lines.append(link)
+    lines.extend("{}: {}".format(*x) for x in sorted(instances.items()))
+    _output(
+        args, {'name': name, 'status': server, 'link': link,
+               'instances': instances},
+        "\n".join(lines))
+    return 0
+
+
+def status(args, settings, client):
+    """Report the status of the server and instance containers."""
+    name = settings["server_name"]
+    server = "inactive"
+    instances = dict()
+    # a single sparse query for the server and any other instances
+    for cont in client.docker.api.containers(all=True):
+        if name in (x.lstrip('/') for x in cont['Names']):
+            server = cont['State']
+        inst = (cont.get('Labels') or dict()).get(INSTANCE_LABEL)
+        if inst is not None and inst != name:
+            instances[inst] = cont['State']
+    return _report_status(args, settings, name, server, instances)
+
+
+def start(args, settings, client):
+    """Start the server, pulling the image if necessary."""
+    name = settings["server_name"]
+    if not args.restart and client.container_states().get(name) == "running":
+        print("{} is already running.".format(name))
+        return 0
+    mount = settings["data_mount"]
+    port, aux_port = settings["port"], settings["aux_port"]
+    # ports of the current server container are reported free
+    checks = preflight.server_checks(client, mount, (port, aux_port))
+    results = preflight.run_checks(checks)
+    failed = [x.name for x in results if not x.passed]
+    values = {x.name: x.value for x in results}
+    conflict = values["Ports"]
+    if (failed == ["Ports"] and isinstance(conflict, preflight.PortConflict)
+            and conflict.free is not None):
+        # as the graphical application, without asking
+        if not settings["auto_ports"]:
+            sys.stderr.write(
+                "{} Ports {} and {} are free, use --auto_ports 1 to use "
+                "them.\n".format(conflict, *conflict.free))
+            return 1
+        port, aux_port = conflict.free
+        sys.stderr.write("Using free ports: {}, {}.\n".format(port, aux_port))
+    elif len(failed) > 0:
+        sys.stderr.write(preflight.summarise(results) + "\n")
+        return 1
+    if values["Image"] is None or values["Image update"]:
+        client.pull_image(progress=Progress(args.quiet_progress))
+        _platform_warning(client)
+    client.start_container(mount, settings["token"], port, aux_port)
+    if client.status.value[1] != "running":
+        sys.stderr.write("Failed to start server:\n{}\n".format(
+            client.last_failure))
+        return 1
+    client.write_server_config(
+        mount, port, aux_port, settings["send_pings"])
+    _output(
+        args, {'name': name, 'status': 'running',
+               'link': labslauncher.get_server_link(
+                   port, settings["token"])},
+        labslauncher.get_server_link(port, settings["token"]))
+    return 0
+
+
+def stop(args, settings, client):
+    """Stop and remove the server container."""
+    client.clear_container()
+    return 0
+
+
+def pull(args, settings, client):
+    """Pull the latest (or a given) image tag."""
+    tag = args.tag
+    if tag is None:
+        tag = client.latest_tag
+        if tag is None:
+            sys.stderr.write("Failed to determine the latest image tag.\n")
+            return 1
+        if tag == client.latest_available_tag and not args.force:
+            print("Image {} is up to date.".format(
+                client.full_image_name(tag)))
+            return 0
+    client.pull_image(
+        tag, progress=Progress(args.quiet_progress),
+        check_space=not args.skip_space_check)
+    _platform_warning(client)
+    print(client.full_image_name(tag))
+    return 0
+
+
+def logs(args, settings, client):
+    """Write the server log to stdout."""
+    chunks = client.container_logs(
+        stream=True, tail=args.tail, follow=args.follow)
+    if chunks is None:
+        sys.stderr.write("Server is not running.\n")
+        return 1
+    try:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def tags(args, settings, client):
+    """List image tags available on dockerhub, marking local tags."""
+    image = settings["image_name"]
+    remote = [x for x in get_image_tags(image, proxies=client.proxies)
+              if x is not None]
+    local = set()
+    for img in client.docker.images.list(name=image):
+        for name in img.tags:
+            local.add(name.rsplit(':', 1)[1])
+    data = [{'tag': x, 'local': x in local} for x in remote]
+    _output(args, data, "\n".join(
+        "{} {}".format("*" if x['local'] else " ", x['tag']) for x in data))
+    return 0
+
+
+def images(args, settings, client):
+    """List local server images, optionally removing old images."""
+    if args.remove or args.dry_run:
+        report = client.remove_old_images(
+            keep=args.keep, pinned=args.pin, dry_run=args.dry_run)
+        verb = "Would remove" if args.dry_run else "Removed"
+        lines = ["{}: {}".format(verb, x) for x in report['removed']]
+        lines.extend("Failed to remove: {}".format(x)
+                     for x in report['failed'])
+        lines.append("Estimated space freed: {:.2f}Gb".format(
+            report['estimated'] / 1024 ** 3))
+        if not args.dry_run:
+            lines.append("Space reclaimed: {:.2f}Gb".format(
+                report['reclaimed'] / 1024 ** 3))
+        _output(args, report, "\n".join(lines))
+        return 1 if len(report['failed']) > 0 else 0
+    usage = client.image_usage(keep=args.keep, pinned=args.pin)
+    _output(args, usage, "\n".join(
+        "{:<12} {:<12} {:>8.2f}Gb {:>8.2f}Gb  {}".format(
+            ",".join(x['tags']) or "untagged", x['platform'],
+            x['size'] / 1024 ** 3, x['unique_size'] / 1024 ** 3,
+            x['keep'] or "remove")
+        for x in usage['images']))
+    return 0
+
+
+def main(argv=None):
+    """Entry point to manage the server from the command line."""
+    settings = load_settings()
+    parser = argparse.ArgumentParser(
+        prog="labslauncher-cli",
+        description="EPI2ME Labs Server Management (command line).",
+        epilog="Log messages are written to {}, use --debug or --quiet "
+        "to also display them.".format(labslauncher.__LOGDIR__),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[labslauncher.log_level(), settings.parser])
+    parser.set_defaults(log_level=logging.CRITICAL)
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Write machine readable output.')
+    parser.add_argument(
+        '--quiet_progress', action='store_true',
+        help='Do not display download progress.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    sub = subparsers.add_parser('status', help=status.__doc__)
+    sub.add_argument(
+        '--docker', action='store_true',
+        help='Query docker rather than a running launcher.')
+    sub.set_defaults(func=status)
+    sub = subparsers.add_parser('start', help=start.__doc__)
+    sub.add_argument(
+        '--restart', action='store_true',
+        help='Restart the server if already running.')
+    sub.set_defaults(func=start)
+    subparsers.add_parser('stop', help=stop.__doc__).set_defaults(func=stop)
+    sub = subparsers.add_parser('pull', help=pull.__doc__)
+    sub.add_argument('--tag', help='Image tag to pull.')
+    sub.add_argument(
+        '--force', action='store_true',
+        help='Pull the latest tag even if available locally.')
+    sub.add_argument(
+        '--skip_space_check', action='store_true',
+        help='Do not check for sufficient disk space before pulling.')
+    sub.set_defaults(func=pull)
+    sub = subparsers.add_parser('logs', help=logs.__doc__)
+    sub.add_argument(
+        '--tail', default=100, type=_tail,
+        help="Number of lines to display, or 'all'.")
+    sub.add_argument(
+        '--follow', action='store_true', help='Follow the log.')
+    sub.set_defaults(func=logs)
+    subparsers.add_parser('tags', help=tags.__doc__).set_defaults(func=tags)
+    sub = subparsers.add_parser('images', help=images.__doc__)
+    sub.add_argument(
+        '--remove', action='store_true',
+        help='Remove images not retained.')
+    sub.add_argument(
+        '--dry_run', action='store_true',
+        help='Report the images which would be removed.')
+    sub.add_argument(
+        '--keep', type=int,
+        help='Number of most recent tags to retain, by default the '
+        'keep_images setting.')
+    sub.add_argument(
+        '--pin', action='append', default=list(),
+        help='Tag to retain, may be given multiple times.')
+    sub.set_defaults(func=images)
+
+    args = parser.parse_args(argv)
+    settings.override(args)
+    logger, _ = labslauncher.setup_logging(
+        min(logging.INFO, args.log_level), console_level=args.log_level)
+
+    if args.command == 'status' and not args.docker:
+        # a running launcher already knows the state
+        state = control_status()
+        if state is not None:
+            return _report_status(
+                args, settings, state['name'], state['status'],
+                state.get('instances', dict()))
+
+    client = DockerClient(**client_options(settings))
+    if not client.is_running(refresh=False):
+        sys.stderr.write("Cannot communicate with docker.\n")
+        return 1
+    try:
+        return args.func(args, settings, client)
+    except InsufficientSpaceError as e:
+        sys.stderr.write("Error: {}\n".format(e))
+        if e.reclaimable > 0:
+            sys.stderr.write(
+                "Removing old server images would free {:.2f}Gb, see "
+                "'labslauncher-cli images --remove'.\n".format(
+                    e.reclaimable / 1024 ** 3))
+        return 1
+    except PullError as e:
+        sys.stderr.write(
+            "Error: download failed ({} error, {} attempt(s)): {}\n".format(
+                e.kind, e.attempts, e))
+        return 1
+    except Exception as e:
+        logger.exception("Command '{}' failed.".format(args.command))
+        sys.stderr.write("Error: {}\n".format(e))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
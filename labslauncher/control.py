@@ -0,0 +1,274 @@
+"""Local HTTP API exposing launcher state and accepting commands.
+
+The server listens on the loopback interface only. Read requests are served
+from state published by the application, such that clients do not cause
+additional docker queries::
+
+    GET /status     launcher and server state.
+    GET /ready      200 if the notebook server is responding, else 503.
+    GET /resources  most recent resource usage sample of the server.
+    GET /events     stream of state as JSON lines, on each change.
+
+Commands require the token stored, with the port, in the discovery file
+(`control.json` in the log directory)::
+
+    POST /start     start the server, as if pressing Start.
+    POST /stop      stop the server.
+"""
+import binascii
+import hmac
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.request
+
+import labslauncher
+
+
+DISCOVERY_FILE = os.path.join(labslauncher.__LOGDIR__, 'control.json')
+COMMANDS = ('start', 'stop')
+
+
+def server_ready(port, timeout=1.0):
+    """Return whether a notebook server responds on a local port.
+
+    :param port: notebook server port.
+    :param timeout: request timeout (seconds).
+    """
+    try:
+        with urllib.request.urlopen(
+                "http://127.0.0.1:{}/api".format(port),
+                timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+class ControlState():
+    """Launcher state published to the control API.
+
+    The state is updated by the application and read by request handler
+    threads. Each change increments `.version`, waking subscribers.
+    """
+
+    def __init__(self, resources=None, ready_ttl=5):
+        """Initialize the state.
+
+        :param resources: function returning the most recent resource
+            usage of the server (without querying docker), or None.
+        :param ready_ttl: time (seconds) for which a readiness probe
+            result is reused.
+        """
+        self.resources = resources
+        self.ready_ttl = ready_ttl
+        self.data = dict()
+        self.version = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self._ready = (None, False)
+
+    def update(self, **fields):
+        """Update state fields, notifying subscribers of changes."""
+        with self.condition:
+            changed = {
+                k: v for k, v in fields.items() if self.data.get(k) != v}
+            if len(changed) == 0:
+                return
+            self.data.update(changed)
+            self.data['updated'] = time.time()
+            self.version += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """Wake and end all subscriptions."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """Return the current version and a copy of the state."""
+        with self.condition:
+            data = dict(self.data)
+            data['version'] = self.version
+            return self.version, data
+
+    def wait(self, version, timeout):
+        """Wait for the state to change from a version.
+
+        :param version: the version last seen.
+        :param timeout: maximum time (seconds) to wait.
+
+        :returns: the current version.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.version != version or self.closed, timeout)
+            return self.version
+
+    def ready(self):
+        """Return whether the notebook server is ready.
+
+        The server is probed only when running and not reported
+        unresponsive by the health watchdog, and at most once every
+        `ready_ttl` seconds.
+        """
+        _, data = self.get()
+        if data.get('status') != 'running':
+            return False
+        if data.get('health') == 'unresponsive':
+            return False
+        checked, ready = self._ready
+        now = time.monotonic()
+        if checked is None or now - checked > self.ready_ttl:
+            ready = server_ready(data['port'])
+            self._ready = (now, ready)
+        return ready
+
+
+class ControlHandler(http.server.BaseHTTPRequestHandler):
+    """Handle control API requests."""
+
+    keepalive = 15  # seconds between blank lines in event streams
+
+    def log_message(self, format, *args):
+        """Log requests to the application log."""
+        self.server.logger.debug(format % args)
+
+    def _send(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _status(self):
+        _, data = self.server.state.get()
+        data['ready'] = self.server.state.ready()
+        return data
+
+    def do_GET(self):
+        """Serve state."""
+        state = self.server.state
+        if self.path == '/status':
+            self._send(200, self._status())
+        elif self.path == '/ready':
+            ready = state.ready()
+            self._send(200 if ready else 503, {'ready': ready})
+        elif self.path == '/resources':
+            resources = None
+            if state.resources is not None:
+                resources = state.resources()
+            self._send(200, {'resources': resources})
+        elif self.path == '/events':
+            self._stream()
+        else:
+            self._send(404, {'error': 'Unknown path.'})
+
+    def _stream(self):
+        state = self.server.state
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        version = None
+        try:
+            while not state.closed:
+                current = state.wait(version, self.keepalive)
+                if current != version:
+                    version = current
+                    line = json.dumps(self._status())
+                else:
+                    line = ""  # detect disconnected clients
+                self.wfile.write((line + "\n").encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        """Run commands."""
+        command = self.path.strip('/')
+        if command not in COMMANDS:
+            self._send(404, {'error': 'Unknown command.'})
+        elif not hmac.compare_digest(
+                self.headers.get('Authorization', ''),
+                'Bearer {}'.format(self.server.token)):
+            self._send(403, {'error': 'Invalid token.'})
+        else:
+            self.server.logger.info(
+                "Received command: {}.".format(command))
+            self.server.command(command)
+            self._send(202, {'accepted': command})
+
+
+class ControlServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Serve the control API from a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, state, command, port=0, discovery=DISCOVERY_FILE):
+        """Initialize the server.
+
+        :param state: a `ControlState`.
+        :param command: function called (from a handler thread) with the
+            name of a command to run.
+        :param port: port to listen on, zero to choose a free port.
+        :param discovery: file to which the port and command token are
+            written.
+        """
+        super().__init__(('127.0.0.1', port), ControlHandler)
+        self.state = state
+        self.command = command
+        self.discovery = discovery
+        self.token = binascii.hexlify(os.urandom(16)).decode()
+        self.logger = labslauncher.get_named_logger("Control")
+        self.thread = None
+
+    @property
+    def port(self):
+        """Return the port the server is listening on."""
+        return self.server_address[1]
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.state.closed = False
+        if self.discovery is not None:
+            os.makedirs(os.path.dirname(self.discovery), exist_ok=True)
+            fd = os.open(
+                self.discovery, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({
+                    'port': self.port, 'token': self.token,
+                    'pid': os.getpid()}, fh)
+        self.thread = threading.Thread(
+            target=self.serve_forever, daemon=True)
+        self.thread.start()
+        self.logger.info("Control API listening on port {}.".format(
+            self.port))
+
+    def stop(self, *args):
+        """Stop serving."""
+        self.state.close()
+        self.shutdown()
+        self.server_close()
+        if self.discovery is not None:
+            try:
+                os.remove(self.discovery)
+            except OSError:
+                pass
+        self.logger.info("Control API stopped.")
+
+
+def discover(discovery=DISCOVERY_FILE):
+    """Return the port and token of a running control API, or None.
+
+    :param discovery: the discovery file written by `ControlServer`.
+    """
+    try:
+        with open(discovery) as fh:
+            data = json.load(fh)
+        return data['port'], data['token']
+    except (OSError, ValueError, KeyError):
+        return None
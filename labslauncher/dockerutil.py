@@ -1,21 +1,89 @@
 """Miscellaneous utility functions to support labslauncher application."""
 
+import codecs
+import collections
+import configparser
+import contextlib
 import functools
 import json
 import os
 import platform
+import shutil
+import socket
+import threading
+import time
 import traceback
 
-from cachetools import cached, TTLCache
+from cachetools import cached, LRUCache, TTLCache
 from cachetools.keys import hashkey
 import docker
-from PyQt5.QtCore import QTimer
+from epi2melabs import ping
 from ratelimitingfilter import RateLimitingFilter
 import requests
 import semver
+import urllib3
 
 import labslauncher
-from labslauncher import qtext
+from labslauncher.tagpolicy import TagPolicy
+
+LOG_MAX_BYTES = 1024 * 1024
+INSTANCE_LABEL = "labslauncher.instance"
+CACHE_LABEL = "labslauncher.cache"
+TAG_LABEL = "labslauncher.tag"
+# persistent volumes for package caches and user installs
+CACHE_VOLUMES = {
+    'pip': '/home/jovyan/.cache',
+    'conda': '/opt/conda/pkgs',
+    'jupyter': '/home/jovyan/.local'}
+HUB_URL = "https://hub.docker.com"
+REGISTRY_URL = "https://registry-1.docker.io"
+REGISTRY_AUTH_URL = "https://auth.docker.io/token"
+MANIFEST_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json')
+# ratio of extracted to compressed layer size, the compressed download
+# is held until extraction completes
+EXTRACTION_FACTOR = 2.5
+# free space left on docker's data root after a pull
+DISK_RESERVE = 1024 ** 3
+# attempts to pull an image after the first, and backoff (seconds)
+# between attempts
+PULL_RETRIES = 5
+PULL_BACKOFF = 2
+PULL_BACKOFF_MAX = 60
+PULL_RATE_LIMIT_BACKOFF = 60
+# classes of pull error, see `classify_pull_error`
+NETWORK, RATE_LIMIT, DISK, AUTH, OTHER = (
+    'network', 'rate limit', 'disk', 'authorization', 'other')
+RETRYABLE = (NETWORK, RATE_LIMIT)
+PULL_ERROR_MESSAGES = (
+    (RATE_LIMIT, ('toomanyrequests', 'too many requests', 'rate limit')),
+    (DISK, ('no space left on device', 'disk quota exceeded')),
+    (AUTH, (
+        'unauthorized', 'authentication required', 'access denied',
+        'denied: requested access')),
+    (NETWORK, (
+        'connection reset', 'connection refused', 'connection aborted',
+        'broken pipe', 'i/o timeout', 'timeout', 'timed out',
+        'context deadline exceeded',
+        'unexpected eof', 'tls handshake', 'no such host',
+        'temporary failure in name resolution', 'network is unreachable',
+        'read: connection', 'net/http', 'connection broken')))
+# names given by `platform.machine()` to docker architectures
+ARCH_ALIASES = {
+    'x86_64': 'amd64', 'aarch64': 'arm64', 'armv7l': 'arm', 'armv6l': 'arm'}
+# messages from docker indicating a path is not shared (Windows, macOS)
+FILE_SHARE_ERRORS = ("Filesharing has been cancelled", "Mounts denied")
+
+
+def is_file_share_error(msg):
+    """Return whether a docker error message indicates a sharing failure.
+
+    :param msg: error message or traceback.
+    """
+    return any(x in msg for x in FILE_SHARE_ERRORS)
 
 
 def proxieskey(*args, proxies=None, **kwargs):
@@ -26,32 +94,303 @@ def proxieskey(*args, proxies=None, **kwargs):
     return key
 
 
-@cached(cache=TTLCache(maxsize=1, ttl=300), key=proxieskey)
+class InsufficientSpaceError(Exception):
+    """Raised when docker's data root has insufficient space for a pull."""
+
+    def __init__(self, required, free, reclaimable=0):
+        """Initialize the error.
+
+        :param required: estimated space required (bytes).
+        :param free: free space (bytes).
+        :param reclaimable: space which may be freed by removing old
+            images (bytes).
+        """
+        self.required = required
+        self.free = free
+        self.reclaimable = reclaimable
+        super().__init__(
+            "Insufficient disk space for download: {:.2f}Gb required, "
+            "{:.2f}Gb available.".format(
+                required / 1024 ** 3, free / 1024 ** 3))
+
+
+class PullError(Exception):
+    """Raised when an image pull fails."""
+
+    def __init__(self, message, kind=None, attempts=1):
+        """Initialize the error.
+
+        :param message: error message.
+        :param kind: class of error, see `classify_pull_error`. By default
+            the class is determined from the message.
+        :param attempts: number of pull attempts made.
+        """
+        super().__init__(message)
+        self.kind = classify_pull_error(message) if kind is None else kind
+        self.attempts = attempts
+
+
+def classify_pull_error(error):
+    """Classify an error raised by (or reported during) an image pull.
+
+    :param error: an exception or error message.
+
+    :returns: one of `NETWORK`, `RATE_LIMIT`, `DISK`, `AUTH` or `OTHER`.
+        Errors of the classes in `RETRYABLE` may succeed if retried.
+    """
+    if isinstance(error, PullError):
+        return error.kind
+    if isinstance(error, InsufficientSpaceError):
+        return DISK
+    if isinstance(error, docker.errors.APIError):
+        code = error.status_code
+        if code == 429:
+            return RATE_LIMIT
+        if code in (401, 403):
+            return AUTH
+    message = str(error).lower()
+    for kind, patterns in PULL_ERROR_MESSAGES:
+        if any(x in message for x in patterns):
+            return kind
+    if isinstance(error, (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            urllib3.exceptions.HTTPError, ConnectionError, socket.timeout)):
+        return NETWORK
+    return OTHER
+
+
+class RateLimitBudget():
+    """Track the remaining requests allowed by a rate limited service.
+
+    Docker Hub reports limits in response headers, either as
+    `RateLimit-Limit: 100;w=21600` and `RateLimit-Remaining: 76;w=21600`
+    (registry, counting pulls over a window of `w` seconds) or as
+    `X-RateLimit-Limit`, `X-RateLimit-Remaining` and `X-RateLimit-Reset`
+    (API, with an epoch reset time).
+    """
+
+    def __init__(self, name, low=10):
+        """Initialize the budget.
+
+        :param name: name of the service.
+        :param low: remaining requests at or below which the budget is
+            considered low, or 10% of the limit if greater.
+        """
+        self.name = name
+        self.threshold = low
+        self.limit = None
+        self._remaining = None
+        self.reset = None
+        self.updated = None
+        self.deferred = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _header(headers, key):
+        for name in (key, 'X-{}'.format(key)):
+            value = headers.get(name)
+            if value is not None:
+                value, _, window = value.partition(';')
+                window = window.strip()
+                if window.startswith('w='):
+                    window = window[2:]
+                return int(value), int(window) if window.isdigit() else None
+        return None, None
+
+    def update(self, headers):
+        """Update the budget from the headers of a response.
+
+        :param headers: response headers (case insensitive mapping).
+        """
+        try:
+            limit, window = self._header(headers, 'RateLimit-Limit')
+            remaining, _ = self._header(headers, 'RateLimit-Remaining')
+            reset, _ = self._header(headers, 'X-RateLimit-Reset')
+        except ValueError:
+            return
+        if limit is None or remaining is None:
+            return
+        now = time.time()
+        with self.lock:
+            self.limit, self._remaining, self.updated = limit, remaining, now
+            if reset is not None:
+                self.reset = reset
+            elif window is not None and (
+                    self.reset is None or self.reset < now):
+                # requests expire from the window progressively, the
+                # budget is certainly restored after a full window
+                self.reset = now + window
+
+    def consume(self, count=1):
+        """Record requests made without observing their response headers.
+
+        :param count: number of requests.
+        """
+        with self.lock:
+            if self._remaining is not None:
+                self._remaining = max(0, self._remaining - count)
+
+    def exhausted(self, retry_after=None):
+        """Record that a request was refused for exceeding the limit.
+
+        :param retry_after: time (seconds) after which requests will be
+            allowed. If unknown, and not known from previous responses, an
+            hour is assumed.
+        """
+        with self.lock:
+            self._remaining = 0
+            self.updated = time.time()
+            if retry_after is not None:
+                self.reset = self.updated + retry_after
+            elif self.reset is None or self.reset < self.updated:
+                self.reset = self.updated + 3600
+
+    @property
+    def remaining(self):
+        """Return the requests remaining, or None if unknown."""
+        with self.lock:
+            if self.reset is not None and time.time() > self.reset:
+                self._remaining, self.reset = None, None
+            return self._remaining
+
+    @property
+    def low(self):
+        """Return whether few requests remain."""
+        remaining = self.remaining
+        if remaining is None:
+            return False
+        threshold = self.threshold
+        if self.limit is not None:
+            threshold = max(threshold, self.limit // 10)
+        return remaining <= threshold
+
+    def allow(self, essential=False):
+        """Return whether a request should be made.
+
+        :param essential: the request is required (e.g. to pull an image
+            the user requested), rather than a refresh or prefetch.
+        """
+        if essential or not self.low:
+            return True
+        with self.lock:
+            self.deferred += 1
+        return False
+
+    def stats(self):
+        """Return a list of (item, value) describing the budget."""
+        remaining = self.remaining
+        items = [(
+            "{}: remaining".format(self.name),
+            "unknown" if remaining is None else "{}/{}".format(
+                remaining, self.limit))]
+        if remaining is not None and self.reset is not None:
+            items.append((
+                "{}: restored within".format(self.name),
+                "{:.0f}min".format(max(0, self.reset - time.time()) / 60)))
+        items.append((
+            "{}: deferred requests".format(self.name), self.deferred))
+        return items
+
+
+# anonymous Docker Hub API (tag listing) and registry (pull) budgets
+HUB_BUDGET = RateLimitBudget("Docker Hub API")
+REGISTRY_BUDGET = RateLimitBudget("Docker Hub pulls")
+
+
+def _check_response(response, budget):
+    """Update a rate limit budget from a response, raising on errors."""
+    budget.update(response.headers)
+    if response.status_code == 429:
+        retry_after = response.headers.get('Retry-After')
+        budget.exhausted(
+            int(retry_after) if retry_after and retry_after.isdigit()
+            else None)
+    response.raise_for_status()
+
+
+IMAGE_META_CACHE = TTLCache(maxsize=1, ttl=300)
+# the last tag meta data retrieved for an image, reused when the Docker
+# Hub budget is low
+_STALE_IMAGE_META = dict()
+
+
+@cached(cache=IMAGE_META_CACHE, key=proxieskey)
 def _get_image_meta(image, proxies=None):
     """Retrieve meta data from docker hub for tags of an image.
 
     :param image: image name.
+
+    When the Docker Hub API budget is low the last data retrieved is
+    returned (and cached), deferring the refresh.
     """
+    if image in _STALE_IMAGE_META and not HUB_BUDGET.allow():
+        labslauncher.get_named_logger("ImageMeta").info(
+            "Docker Hub request budget low, deferring tag refresh.")
+        return _STALE_IMAGE_META[image]
     if proxies is None:
         proxies = dict()
     tags = list()
-    addr = 'https://hub.docker.com/v2/repositories/{}/tags'.format(image)
+    addr = '{}/v2/repositories/{}/tags'.format(HUB_URL, image)
     while True:
         response = requests.get(addr, proxies=proxies)
+        _check_response(response, HUB_BUDGET)
         tags_data = json.loads(response.content.decode())
         tags.extend(tags_data['results'])
         if tags_data['next'] is not None:
             addr = tags_data['next']
         else:
             break
+    _STALE_IMAGE_META[image] = tags
     return tags
 
 
-def get_image_tags(image, prefix='v', proxies=None):
+def host_platform():
+    """Return the platform of this computer, e.g. `linux/arm64`.
+
+    Containers run in a Linux virtual machine on macOS and Windows, the
+    operating system is therefore always `linux`.
+    """
+    machine = platform.machine().lower()
+    return "linux/{}".format(ARCH_ALIASES.get(machine, machine))
+
+
+def tag_platforms(meta):
+    """Return the platforms for which an image tag is available.
+
+    :param meta: docker hub meta data of a tag, see `get_image_meta`.
+
+    :returns: list of platforms, e.g. `linux/amd64`. Empty if unknown.
+    """
+    return [
+        "{}/{}".format(x.get('os'), x.get('architecture'))
+        for x in meta.get('images') or list()]
+
+
+def platform_size(meta, docker_platform=None):
+    """Return the compressed size of an image tag for a platform.
+
+    :param meta: docker hub meta data of a tag, see `get_image_meta`.
+    :param docker_platform: platform, e.g. `linux/arm64`.
+
+    :returns: the size of the image for the platform if available, else
+        the size reported for the tag.
+    """
+    for plat, image in zip(tag_platforms(meta), meta.get('images') or []):
+        if plat == docker_platform and image.get('size'):
+            return image['size']
+    return meta['full_size']
+
+
+def get_image_tags(image, prefix='v', proxies=None, docker_platform=None):
     """Retrieve tags from dockerhub of an image.
 
     :param image: image name, organisation/repository.
     :param prefix: prefix by which to filter images.
+    :param docker_platform: return only tags available for this platform,
+        e.g. `linux/arm64`. Tags for which platforms are not listed are
+        assumed available.
 
     :returns: sorted list of tags, newest first, ordered by semver.
         Or the list [None] if an error occurs fetching tag meta information.
@@ -68,6 +407,10 @@ def get_image_tags(image, prefix='v', proxies=None):
         name = t['name']
         if name[0] != prefix:
             continue
+        platforms = tag_platforms(t)
+        if (docker_platform is not None and len(platforms) > 0
+                and docker_platform not in platforms):
+            continue
         try:
             semver.parse(name[1:])
         except ValueError:
@@ -82,12 +425,16 @@ def get_image_tags(image, prefix='v', proxies=None):
     return ordered_tags
 
 
-@functools.lru_cache(5)
+TAG_META_CACHE = LRUCache(maxsize=5)
+
+
+@cached(cache=TAG_META_CACHE, key=proxieskey)
 def get_image_meta(image, tag, proxies=None):
     """Retrieve meta data from docker hub for a tag.
 
     :param image: image name.
     :param tag: image tag.
+    :param proxies: dictionary of proxies for `requests`.
 
     """
     tags_data = _get_image_meta(image, proxies=proxies)
@@ -98,11 +445,110 @@ def get_image_meta(image, tag, proxies=None):
     raise IndexError("Tag was not found: \"{}\"".format(tag))
 
 
-def newest_tag(image, tags=None, client=None, proxies=None):
+def _registry_token(image, proxies=None):
+    response = requests.get(
+        REGISTRY_AUTH_URL, params={
+            'service': 'registry.docker.io',
+            'scope': 'repository:{}:pull'.format(image)},
+        proxies=proxies, timeout=10)
+    response.raise_for_status()
+    return json.loads(response.content.decode())['token']
+
+
+def _registry_get(
+        image, reference, kind, token, proxies=None, method='GET'):
+    response = requests.request(
+        method,
+        '{}/v2/{}/{}/{}'.format(REGISTRY_URL, image, kind, reference),
+        headers={
+            'Authorization': 'Bearer {}'.format(token),
+            'Accept': ', '.join(MANIFEST_TYPES)},
+        proxies=proxies, timeout=10)
+    _check_response(response, REGISTRY_BUDGET)
+    if method == 'HEAD':
+        return response.headers
+    return json.loads(response.content.decode())
+
+
+def probe_pull_budget(image, tag, proxies=None):
+    """Update `REGISTRY_BUDGET` without consuming it.
+
+    Docker Hub does not count HEAD requests for manifests as pulls, but
+    reports the budget in their response.
+
+    :param image: image name.
+    :param tag: image tag.
+
+    :returns: the remaining pulls, or None if unknown.
+    """
+    token = _registry_token(image, proxies=proxies)
+    _registry_get(image, tag, 'manifests', token, proxies, method='HEAD')
+    return REGISTRY_BUDGET.remaining
+
+
+def remote_digest(image, tag, proxies=None):
+    """Return the registry digest of an image tag, or None.
+
+    The digest is that recorded in `RepoDigests` of a local image pulled
+    by tag. Docker Hub does not count the request against the pull rate
+    limit.
+
+    :param image: image name.
+    :param tag: image tag.
+    """
+    token = _registry_token(image, proxies=proxies)
+    headers = _registry_get(
+        image, tag, 'manifests', token, proxies, method='HEAD')
+    return headers.get('Docker-Content-Digest')
+
+
+IMAGE_LAYERS_CACHE = TTLCache(maxsize=8, ttl=300)
+
+
+@cached(cache=IMAGE_LAYERS_CACHE, key=proxieskey)
+def get_image_layers(image, tag, proxies=None, docker_platform='linux/amd64'):
+    """Retrieve the layers of an image tag from the registry.
+
+    :param image: image name.
+    :param tag: image tag.
+    :param docker_platform: platform for which to select an image from a
+        manifest list, e.g. `linux/arm64`.
+
+    :returns: list of (uncompressed digest, compressed size) tuples. The
+        uncompressed digests are those listed by `docker inspect` for
+        local images.
+
+    .. note:: Docker Hub counts manifest requests against the pull rate
+        limit, see `REGISTRY_BUDGET`.
+    """
+    token = _registry_token(image, proxies=proxies)
+    manifest = _registry_get(image, tag, 'manifests', token, proxies)
+    if 'manifests' in manifest:
+        # a list of manifests, one per platform
+        digest = manifest['manifests'][0]['digest']
+        for item in manifest['manifests']:
+            plat = item.get('platform', dict())
+            if "{}/{}".format(
+                    plat.get('os'), plat.get('architecture')) == \
+                    docker_platform:
+                digest = item['digest']
+                break
+        manifest = _registry_get(image, digest, 'manifests', token, proxies)
+    config = _registry_get(
+        image, manifest['config']['digest'], 'blobs', token, proxies)
+    return list(zip(
+        config['rootfs']['diff_ids'],
+        (x['size'] for x in manifest['layers'])))
+
+
+def newest_tag(
+        image, tags=None, client=None, proxies=None, docker_platform=None):
     """Find the newest available local tag of an image.
 
     :param tag: list of tags, if None dockerhub is queried.
     :param client: a docker client.
+    :param docker_platform: ignore local images not of this platform,
+        e.g. `linux/arm64`.
     """
     if client is None:
         client = docker.from_env()
@@ -112,23 +558,117 @@ def newest_tag(image, tags=None, client=None, proxies=None):
     latest = None
     for tag in tags:
         try:
-            client.images.get("{}:{}".format(image, tag))
+            img = client.images.get("{}:{}".format(image, tag))
         except docker.errors.ImageNotFound:
             pass
         else:
-            latest = tag
-            break
+            if docker_platform in (None, image_platform(img.attrs)):
+                latest = tag
+                break
     return latest
 
 
-def pull_with_progress(image, tag, proxies=None):
+def image_platform(attrs):
+    """Return the platform of a local image, e.g. `linux/arm64`.
+
+    :param attrs: image attributes, as returned by `docker inspect`.
+    """
+    return "{}/{}".format(attrs.get('Os'), attrs.get('Architecture'))
+
+
+def decode_chunks(chunks):
+    """Incrementally decode chunks of UTF-8 bytes.
+
+    :param chunks: iterable of bytes, possibly splitting multibyte
+        characters between chunks.
+
+    :yields: decoded strings.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def tail_bytes(chunks, max_bytes):
+    """Join the trailing bytes of an iterable of byte strings.
+
+    :param chunks: iterable of bytes.
+    :param max_bytes: maximum number of bytes to retain.
+
+    :returns: bytes containing (at most) the last `max_bytes` bytes.
+    """
+    buffer = collections.deque()
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        while size - len(buffer[0]) >= max_bytes:
+            size -= len(buffer.popleft())
+    return b"".join(buffer)[-max_bytes:]
+
+
+def port_available(port, host_only=False):
+    """Return whether a network port can be bound on the host.
+
+    :param port: port number.
+    :param host_only: check only the loopback interface.
+    """
+    host = '127.0.0.1' if host_only else ''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((host, int(port)))
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def next_free_ports(ports, in_use=None, host_only=False):
+    """Find available ports, searching upwards from those requested.
+
+    :param ports: list of requested ports.
+    :param in_use: collection of ports known to be unavailable (e.g.
+        published by docker containers).
+    :param host_only: check only the loopback interface.
+
+    :returns: list of distinct available ports.
+    """
+    if in_use is None:
+        in_use = set()
+    chosen = list()
+    for port in ports:
+        candidate = int(port)
+        while (candidate in in_use or candidate in chosen
+                or not port_available(candidate, host_only=host_only)):
+            candidate += 1
+            if candidate > 65535:
+                raise ValueError("No free port found above {}.".format(port))
+        chosen.append(candidate)
+    return chosen
+
+
+def pull_with_progress(
+        image, tag, proxies=None, docker_platform=None, layers=None):
     """Pull an image, yielding download progress.
 
     :param image: image name.
     :param tag: image tag.
+    :param docker_platform: the platform of the docker daemon, used to
+        determine the download size. The daemon itself chooses the image
+        for its platform from manifest lists.
+    :param layers: dictionary of bytes downloaded by layer, updated in
+        place. Passing the dictionary of a failed attempt carries progress
+        over to a retry, the daemon keeps completed layers.
 
     :yields: downloaded bytes, total bytes.
 
+    :raises: `PullError` for errors reported by the daemon during the pull.
     """
     if platform.system() == "Darwin":
         path = "/Applications/Docker.app/Contents/Resources/bin/"
@@ -136,32 +676,236 @@ def pull_with_progress(image, tag, proxies=None):
             os.environ['PATH'] = "{}:{}".format(path, os.environ['PATH'])
 
     image_tag = get_image_meta(image, tag, proxies=proxies)
-    total = image_tag['full_size']
+    total = platform_size(image_tag, docker_platform)
 
-    # to get feedback we need to use the low-level API
-    client = docker.APIClient()
+    # to get feedback we need to use the low-level API, configured as
+    # docker.from_env() such that e.g. DOCKER_HOST is respected
+    client = docker.APIClient(**docker.utils.kwargs_from_env())
 
-    layers = dict()
+    if layers is None:
+        layers = dict()
     pull_log = client.pull(image, tag=tag, stream=True)
     for response in (x.decode() for x in pull_log):
         for line in response.splitlines():
             resp = json.loads(line)
+            if "error" in resp:
+                raise PullError(resp["error"])
             if "status" in resp and resp["status"] == "Downloading":
                 layers[resp['id']] = resp["progressDetail"]["current"]
                 current = sum(layers.values())
                 yield current, total
 
 
+class TagIndex():
+    """Persistent record of local image tags and their platforms.
+
+    Entries are keyed by full image name (`image:tag`) and hold the image
+    `id`, registry `digest`, `platform` and the time `recorded`.
+    """
+
+    def __init__(self, fname=None):
+        """Initialize the index.
+
+        :param fname: JSON filename.
+        """
+        if fname is None:
+            fname = os.path.join(labslauncher.__LOGDIR__, 'tags.json')
+        self.fname = fname
+        self.lock = threading.Lock()
+        try:
+            with open(self.fname) as fh:
+                self.entries = json.load(fh)
+        except (OSError, ValueError):
+            self.entries = dict()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        tmp = "{}.tmp".format(self.fname)
+        with open(tmp, 'w') as fh:
+            json.dump(self.entries, fh, indent=2, sort_keys=True)
+        os.replace(tmp, self.fname)
+
+    def get(self, name):
+        """Return the entry of an image name, or None.
+
+        :param name: full image name, `image:tag`.
+        """
+        return self.entries.get(name)
+
+    def record(self, attrs):
+        """Record the tags of a local image.
+
+        :param attrs: image attributes, as returned by `docker inspect`.
+        """
+        digests = attrs.get('RepoDigests') or list()
+        entry = {
+            'id': attrs['Id'],
+            'digest': digests[0].rpartition('@')[2] if digests else None,
+            'platform': image_platform(attrs), 'recorded': time.time()}
+        with self.lock:
+            for name in attrs.get('RepoTags') or list():
+                self.entries[name] = dict(entry)
+            self._save()
+
+    def tags(self, image):
+        """Return the recorded tags of an image.
+
+        :param image: image name.
+        """
+        prefix = "{}:".format(image)
+        return [
+            x[len(prefix):] for x in list(self.entries)
+            if x.startswith(prefix)]
+
+    def remove(self, name):
+        """Remove the entry of an image name.
+
+        :param name: full image name, `image:tag`.
+        """
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self._save()
+
+
+class StatsSampler():
+    """Sample statistics of a container periodically in a thread.
+
+    Obtaining container statistics blocks for around two seconds, the
+    sampler allows recent statistics to be obtained without waiting.
+    """
+
+    def __init__(self, client, interval=60):
+        """Initialize the sampler.
+
+        :param client: a `DockerClient`.
+        :param interval: time (seconds) between samples.
+        """
+        self.client = client
+        self.interval = interval
+        self.latest = None
+        self.latest_time = None
+        self._stopped = None
+
+    def start(self):
+        """Start sampling the server container."""
+        if self._stopped is not None:
+            return
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._run, args=(self._stopped,), daemon=True).start()
+
+    def stop(self):
+        """Stop sampling."""
+        if self._stopped is not None:
+            self._stopped.set()
+            self._stopped = None
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            try:
+                self.sample()
+            except Exception:
+                self.client.logger.exception("Failed to sample stats.")
+            stopped.wait(self.interval)
+
+    def sample(self):
+        """Sample statistics, blocking until they are available.
+
+        :returns: statistics dictionary or None if there is no container.
+        """
+        cont = self.client.container
+        if cont is None:
+            return None
+        self.latest = cont.stats(stream=False)
+        self.latest_time = time.monotonic()
+        return self.latest
+
+    def get(self, max_age=None):
+        """Return the most recent sample, sampling only if necessary.
+
+        :param max_age: maximum age (seconds) of a cached sample, by
+            default the sampling interval.
+        """
+        if max_age is None:
+            max_age = self.interval
+        if (self.latest_time is None
+                or time.monotonic() - self.latest_time > max_age):
+            return self.sample()
+        return self.latest
+
+
+def client_options(settings):
+    """Return `DockerClient` initialization options from settings.
+
+    :param settings: application settings.
+    """
+    fixed_tag = settings["fixed_tag"]
+    if fixed_tag == "":
+        fixed_tag = None
+    proxy = None
+    for protocol in ('ftp', 'http', 'https'):
+        value = settings["{}_proxy".format(protocol)]
+        if value != "":
+            if proxy is None:
+                proxy = dict()
+            proxy[protocol] = value
+    return dict(
+        image_name=settings["image_name"],
+        server_name=settings["server_name"],
+        data_bind=settings["data_bind"],
+        container_cmd=settings["container_cmd"],
+        host_only=settings["docker_restrict"],
+        fixed_tag=fixed_tag, proxies=proxy,
+        cache_volumes=settings["cache_volumes"],
+        keep_images=settings["keep_images"],
+        auto_remove_images=settings["auto_remove_images"],
+        native_only=settings["native_only"],
+        channel=settings["channel"],
+        version_range=settings["version_range"])
+
+
+class Value():
+    """A value holder with the interface of `qtext.Property`.
+
+    Assignment does not notify, such that the holder may be used without
+    Qt.
+    """
+
+    def __init__(self, value):
+        """Initialize the holder.
+
+        :param value: initial value.
+        """
+        self.value = value
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Do nothing, there are no notifications to coalesce."""
+        yield self
+
+    def __str__(self):
+        """Return string representation of the value."""
+        return str(self.value)
+
+
 class DockerClient():
-    """Handle interaction with docker."""
+    """Handle interaction with docker.
+
+    This class does not require Qt, see `labslauncher.qdocker` for a client
+    whose state is observable and periodically refreshed.
+    """
 
-    status = qtext.Property(('', 'unknown'))
-    tag = qtext.StringProperty('')
-    _available = qtext.BoolProperty(False)
+    status = Value(('', 'unknown'))
+    states = Value(dict())
+    tag = Value('')
+    _available = Value(False)
 
     def __init__(
             self, image_name, server_name, data_bind, container_cmd,
-            host_only, fixed_tag=None, registry='docker.io', proxies=None):
+            host_only, fixed_tag=None, registry='docker.io', proxies=None,
+            cache_volumes=False, keep_images=2, auto_remove_images=False,
+            native_only=False, channel='stable', version_range='',
+            tag_index=None):
         """Initialize the client."""
         self.image_name = image_name
         self.server_name = server_name
@@ -171,12 +915,20 @@ class DockerClient():
         self.fixed_tag = fixed_tag
         self.registry = registry
         self.proxies = proxies
+        self.cache_volumes = cache_volumes
+        self.keep_images = keep_images
+        self.auto_remove_images = auto_remove_images
+        self.native_only = native_only
+        self.channel = channel
+        self.version_range = version_range
+        self.tag_index = TagIndex() if tag_index is None else tag_index
         # TODO: plumb in registry
         self.logger = labslauncher.get_named_logger("DckrClnt")
         # throttle connection errors to once every 5 minutes
         spam = [
             'Could not create docker client',
-            'Failed to query docker client']
+            'Failed to query docker client',
+            'Ignoring image tag policy']
         self.logger.addFilter(
             RateLimitingFilter(rate=1, per=300, burst=1, match=spam))
         self.logger.info(
@@ -187,25 +939,29 @@ class DockerClient():
            command: {}
            host only: {}
            fixed tag: {}
-           proxies: {}""".format(
+           proxies: {}
+           cache volumes: {}
+           keep images: {}
+           auto remove images: {}
+           native only: {}
+           channel: {}
+           version range: {}""".format(
                image_name, server_name, data_bind, container_cmd,
-               host_only, fixed_tag, proxies))
+               host_only, fixed_tag, proxies, cache_volumes, keep_images,
+               auto_remove_images, native_only, channel, version_range))
         self._client = None
         self.total_size = None
         self.final_stats = None
+        self.sampler = StatsSampler(self)
         self.last_failure = "Unknown error"
         self.last_failure_type = None
-        self.is_running()  # sets up tag, status, and available
-        # docker service heartbeat
-        self.dheartbeat = QTimer()
-        self.dheartbeat.setInterval(1000*5)  # 5 seconds
-        self.dheartbeat.start()
-        self.dheartbeat.timeout.connect(self.is_running)
-        # container status heartbeat
-        self.cheartbeat = QTimer()
-        self.cheartbeat.setInterval(1000*5)  # 5 seconds
-        self.cheartbeat.start()
-        self.cheartbeat.timeout.connect(self.set_status)
+        self._share_cache = dict()
+        self._platform = None
+        self._platform_warned = set()
+        self.platform_warning = None
+        self.pull_stats = None
+        # option changes awaiting the server stopping, see `configure`
+        self.deferred = dict()
 
     @property
     def docker(self):
@@ -228,9 +984,59 @@ class DockerClient():
                 self.logger.info("Connection to docker (re)established.")
         return self._client
 
-    def is_running(self):
+    options = (
+        'image_name', 'server_name', 'data_bind', 'container_cmd',
+        'host_only', 'fixed_tag', 'proxies', 'cache_volumes', 'keep_images',
+        'auto_remove_images', 'native_only', 'channel', 'version_range')
+
+    def configure(self, **options):
+        """Change client options, refreshing only dependent state.
+
+        :param options: new values of any of the initialization options
+            listed in `.options`.
+
+        Options affecting only the creation of containers (e.g. proxies,
+        host restriction) take effect when a server is next started. A
+        change of `server_name` is deferred until no container of the
+        previous name exists (e.g. until the server is stopped or started
+        again), such that the container is not orphaned.
+        """
+        changed = {
+            k: v for k, v in options.items()
+            if k in self.options and getattr(self, k) != v}
+        self.deferred.pop('server_name', None)
+        if ('server_name' in changed
+                and self.status.value[1] != "inactive"):
+            self.deferred['server_name'] = changed.pop('server_name')
+            self.logger.info(
+                "Deferring change of server name to '{}' until '{}' is "
+                "removed.".format(
+                    self.deferred['server_name'], self.server_name))
+        if len(changed) == 0:
+            return changed
+        for key, value in changed.items():
+            self.logger.info("Setting {}: {}.".format(key, value))
+            setattr(self, key, value)
+        if self._available.value:
+            if {'image_name', 'fixed_tag', 'proxies', 'native_only',
+                    'channel', 'version_range'}.intersection(changed):
+                # the share probe uses the image
+                self.clear_share_cache()
+                self.tag.value = self.latest_available_tag
+            if 'server_name' in changed:
+                self.set_status()
+        if self.status.value[1] == "running":
+            self.logger.info(
+                "Running server is unaffected by change to: {}.".format(
+                    ", ".join(sorted(changed))))
+        return changed
+
+    def is_running(self, refresh=True):
         """Return whether docker is connected.
 
+        :param refresh: refresh the image tag and container status when
+            the availability of docker changes.
+
         Note if True value does not guaranteed subsequent API calls
         will necessarily succeed.
         """
@@ -240,29 +1046,148 @@ class DockerClient():
             value = False
         if value != self._available.value:
             self._available.value = value
-            if value:
+            # docker restarts are required to change file sharing
+            self.clear_share_cache()
+            if refresh and value:
                 self.tag.value = self.latest_available_tag
                 self.set_status()
-            else:
+            elif refresh:
                 self.tag.value = 'unknown'
                 self.set_status('unknown')
         return self._available.value
 
+    @property
+    def docker_platform(self):
+        """Return the platform of the docker daemon, e.g. `linux/arm64`.
+
+        If docker cannot be queried the platform of this computer is
+        returned.
+        """
+        if self._platform is None:
+            try:
+                version = self.docker.version()
+                self._platform = "{}/{}".format(
+                    version['Os'], version['Arch'])
+            except Exception:
+                return host_platform()
+        return self._platform
+
+    @property
+    def _native_platform(self):
+        return self.docker_platform if self.native_only else None
+
+    @property
+    def policy(self):
+        """Return the `TagPolicy` selecting server versions.
+
+        An invalid channel or version range is ignored (with a warning).
+        """
+        try:
+            return TagPolicy(
+                self.channel, self.version_range, fixed_tag=self.fixed_tag)
+        except ValueError as e:
+            self.logger.warning("Ignoring image tag policy: {}".format(e))
+            return TagPolicy(fixed_tag=self.fixed_tag)
+
     @property
     def latest_tag(self):
-        """Return the latest tag on dockerhub."""
-        if self.fixed_tag is not None:
-            return self.fixed_tag
-        return get_image_tags(
-            self.image_name, proxies=self.proxies)[0]
+        """Return the latest tag on dockerhub admitted by `policy`.
+
+        If `native_only` is set, the latest tag available for the platform
+        of the docker daemon is returned.
+        """
+        policy = self.policy
+        if policy.pinned_tag is not None:
+            return policy.pinned_tag
+        tags = get_image_tags(
+            self.image_name, proxies=self.proxies,
+            docker_platform=self._native_platform)
+        if tags == [None]:
+            return None
+        tag = policy.select(tags)
+        if tag is None:
+            self.logger.warning(
+                "No image tags available for {} with {}.".format(
+                    self.docker_platform, policy))
+        return tag
 
     @property
     def latest_available_tag(self):
-        """Return the latest tag available locally."""
-        if self.fixed_tag is not None:
-            return self.fixed_tag
+        """Return the latest tag available locally admitted by `policy`.
+
+        If dockerhub cannot be reached, tags recorded in the local tag
+        index are considered.
+        """
+        policy = self.policy
+        if policy.pinned_tag is not None:
+            return policy.pinned_tag
+        tags = get_image_tags(
+            self.image_name, proxies=self.proxies,
+            docker_platform=self._native_platform)
+        if tags == [None]:
+            tags = self.tag_index.tags(self.image_name)
         return newest_tag(
-            self.image_name, client=self.docker, proxies=self.proxies)
+            self.image_name, tags=policy.order(tags), client=self.docker,
+            docker_platform=self._native_platform)
+
+    def image_update_required(self):
+        """Return whether the image should be pulled before starting.
+
+        Versioned tags are immutable, so only need pulling if absent. A
+        mutable tag (e.g. `dev`) is pulled if its registry digest differs
+        from that of the local image.
+        """
+        policy = self.policy
+        tag = self.latest_available_tag
+        if tag is None:
+            return True
+        try:
+            image = self.docker.images.get(self.full_image_name(tag))
+        except docker.errors.ImageNotFound:
+            return True
+        if not policy.mutable:
+            return False
+        local = {
+            x.rpartition('@')[2]
+            for x in image.attrs.get('RepoDigests') or list()}
+        try:
+            remote = remote_digest(
+                self.image_name, tag, proxies=self.proxies)
+        except Exception as e:
+            self.logger.warning(
+                "Could not fetch digest of {}, using local image: "
+                "{}".format(tag, e))
+            return False
+        if remote is None:
+            return False
+        required = remote not in local
+        self.logger.info("Image {} is {}.".format(
+            tag, "outdated" if required else "up to date"))
+        return required
+
+    def foreign_platform(self, tag):
+        """Return a warning if a tag is not built for the docker platform.
+
+        :param tag: image tag.
+
+        :returns: a message, or None if the tag is available for the
+            platform or its platforms are unknown.
+        """
+        try:
+            meta = get_image_meta(self.image_name, tag, proxies=self.proxies)
+        except Exception:
+            return None
+        platforms = tag_platforms(meta)
+        if len(platforms) == 0 or self.docker_platform in platforms:
+            return None
+        msg = (
+            "Server version {} is not available for this computer ({}), "
+            "only for {}. It will run under emulation and may be "
+            "slow.".format(tag, self.docker_platform, ", ".join(platforms)))
+        if tag not in self._platform_warned:
+            self._platform_warned.add(tag)
+            self.logger.warning(msg)
+        return msg
 
     @property
     def update_available(self):
@@ -310,55 +1235,621 @@ class DockerClient():
                 image = self.pull_image(tag)
         return image
 
-    def pull_image(self, tag=None, progress=None, stopped=None):
+    def data_root_free(self):
+        """Return the free space (bytes) on docker's data root, or None.
+
+        When the docker daemon runs in a virtual machine (e.g. Docker
+        Desktop) the space is measured within a container created from the
+        local notebook image, the root filesystem of which resides on the
+        data root.
+        """
+        info = self.docker.info()
+        root = info.get('DockerRootDir')
+        if (platform.system() == "Linux"
+                and 'Docker Desktop' not in info.get('OperatingSystem', '')
+                and root is not None and os.path.isdir(root)):
+            return shutil.disk_usage(root).free
+        try:
+            image = self.full_image_name()
+            output = self.docker.containers.run(
+                image, ['df', '-Pk', '/'], remove=True)
+            return int(output.decode().splitlines()[-1].split()[3]) * 1024
+        except Exception:
+            self.logger.exception("Failed to determine free disk space.")
+            return None
+
+    def local_layers(self):
+        """Return the set of layer digests of local `image_name` images."""
+        layers = set()
+        for img in self.docker.images.list(name=self.image_name):
+            layers.update(img.attrs.get('RootFS', dict()).get('Layers', []))
+        return layers
+
+    def pull_space(self, tag=None):
+        """Estimate the disk space required to pull an image tag.
+
+        Only layers not already present locally are counted. The space
+        required is the compressed size of these layers plus their
+        extracted size, estimated with `EXTRACTION_FACTOR`.
+
+        :param tag: image tag, by default the latest tag.
+
+        :returns: dictionary with keys `layers` and `missing` (numbers of
+            layers in the image and to download, None if unknown),
+            `download` (compressed bytes to download), `required` (bytes)
+            and `free` (bytes free on docker's data root, None if unknown).
+        """
+        if tag is None:
+            tag = self.latest_tag
+        layers, missing, remote = None, None, None
+        if REGISTRY_BUDGET.allow():
+            try:
+                remote = get_image_layers(
+                    self.image_name, tag, proxies=self.proxies,
+                    docker_platform=self.docker_platform)
+            except Exception:
+                self.logger.exception(
+                    "Failed to fetch image layers, assuming all are "
+                    "required.")
+        else:
+            self.logger.info(
+                "Docker Hub pull budget low, assuming all layers are "
+                "required.")
+        if remote is None:
+            download = platform_size(
+                get_image_meta(self.image_name, tag, proxies=self.proxies),
+                self.docker_platform)
+        else:
+            local = self.local_layers()
+            sizes = [size for digest, size in remote if digest not in local]
+            layers, missing = len(remote), len(sizes)
+            download = sum(sizes)
+        space = {
+            'layers': layers, 'missing': missing, 'download': download,
+            'required': int(download * (1 + EXTRACTION_FACTOR)),
+            'free': self.data_root_free()}
+        self.logger.info("Space for pull of {}: {}.".format(tag, space))
+        return space
+
+    def check_pull_space(self, tag=None):
+        """Check there is sufficient disk space to pull an image tag.
+
+        :param tag: image tag, by default the latest tag.
+
+        :raises: `InsufficientSpaceError` if the space required, plus
+            `DISK_RESERVE`, exceeds that free. The space which could be
+            reclaimed by `remove_old_images` is given on the exception.
+
+        :returns: see `pull_space`, or None if the space required could
+            not be estimated.
+        """
+        try:
+            space = self.pull_space(tag)
+        except Exception:
+            self.logger.exception(
+                "Failed to estimate disk space, continuing with download.")
+            return None
+        if space['free'] is None:
+            self.logger.warning(
+                "Free disk space unknown, continuing with download.")
+        elif space['required'] + DISK_RESERVE > space['free']:
+            reclaimable = sum(
+                x['unique_size'] for x in self.image_usage()['images']
+                if x['keep'] is None)
+            raise InsufficientSpaceError(
+                space['required'] + DISK_RESERVE, space['free'], reclaimable)
+        return space
+
+    @labslauncher.log_duration("pull_image")
+    def pull_image(
+            self, tag=None, progress=None, stopped=None, check_space=True,
+            retries=PULL_RETRIES):
         """Pull an image tag whilst updating download progress.
 
         :param tag: tag to fetch. If None the latest tag is pulled.
+        :param check_space: check there is sufficient disk space before
+            starting, see `check_pull_space`.
+        :param retries: number of times to retry a pull failing with a
+            network or rate limit error, with exponential backoff.
 
-        :returns: the image object.
+        :returns: the image object, or None if stopped.
 
+        :raises: `PullError` if the pull fails.
         """
         self.logger.info("Starting pull of image tag: {}.".format(tag))
         if tag is None:
             tag = self.latest_tag
+        if tag is None:
+            raise PullError(
+                "No server version is available to download. Docker Hub "
+                "could not be reached, or no version matches the channel "
+                "and version range settings.", OTHER)
         full_name = self.full_image_name(tag=tag)
+        self.platform_warning = self.foreign_platform(tag)
+        if check_space:
+            self.check_pull_space(tag)
 
         # to get feedback we need to use the low-level API
         self.total_size = None
-        puller = pull_with_progress(
-            self.image_name, tag, proxies=self.proxies)
-        for current, total in puller:
-            if stopped is not None and stopped.is_set():
-                return None
-            if progress is not None:
-                progress.emit(100 * current / total)
-            self.total_size = total
-        progress.emit(100.0)
+        layers = dict()
+        shown = 0
+        attempt = 0
+        waited, failed = 0, 0
+        while True:
+            attempt += 1
+            t0 = time.monotonic()
+            try:
+                puller = pull_with_progress(
+                    self.image_name, tag, proxies=self.proxies,
+                    docker_platform=self.docker_platform, layers=layers)
+                for current, total in puller:
+                    if stopped is not None and stopped.is_set():
+                        return None
+                    # layers interrupted part way restart from zero
+                    shown = max(shown, current)
+                    if progress is not None:
+                        progress.emit(100 * shown / total)
+                    self.total_size = total
+            except Exception as e:
+                failed += time.monotonic() - t0
+                kind = classify_pull_error(e)
+                if kind == RATE_LIMIT:
+                    REGISTRY_BUDGET.exhausted()
+                self.pull_stats = {
+                    'attempts': attempt, 'failed_time': failed,
+                    'backoff': waited, 'error': kind}
+                if kind not in RETRYABLE or attempt > retries:
+                    self.logger.error(
+                        "Pull failed after {} attempt(s) ({} error, {:.1f}s "
+                        "lost): {}".format(attempt, kind, failed + waited, e))
+                    raise PullError(str(e), kind, attempt) from e
+                delay = min(
+                    PULL_BACKOFF_MAX, PULL_BACKOFF * 2 ** (attempt - 1))
+                if kind == RATE_LIMIT:
+                    delay = max(delay, PULL_RATE_LIMIT_BACKOFF)
+                self.logger.warning(
+                    "Pull attempt {} failed ({} error): {}. Retrying in "
+                    "{}s.".format(attempt, kind, str(e).rstrip('.'), delay))
+                if stopped is not None:
+                    if stopped.wait(delay):
+                        return None
+                else:
+                    time.sleep(delay)
+                waited += delay
+            else:
+                break
+        REGISTRY_BUDGET.consume()
+        if attempt > 1:
+            self.logger.info(
+                "Pull succeeded after {} retries, {:.1f}s lost in failed "
+                "attempts and {:.1f}s waiting to retry.".format(
+                    attempt - 1, failed, waited))
+        self.pull_stats = {
+            'attempts': attempt, 'failed_time': failed, 'backoff': waited,
+            'error': None}
+        if progress is not None:
+            progress.emit(100.0)
         image = self.docker.images.get(full_name)
+        self.tag_index.record(image.attrs)
         self.tag.value = self.latest_available_tag
-        self.logger.info("Finished pulling image")
+        self.logger.info("Finished pulling image: {}.".format(
+            image_platform(image.attrs)))
+        if self.auto_remove_images:
+            try:
+                self.remove_old_images()
+            except Exception:
+                self.logger.exception("Failed to remove old images.")
         return image
 
+    def image_usage(self, keep=None, pinned=()):
+        """Return local images of `image_name` and whether to retain them.
+
+        The newest `keep` tags (by semver, then creation time) are
+        retained, in addition to tags used by any container, the fixed tag
+        and tags in `pinned`. Untagged (superseded) images are retained only
+        when used by a container.
+
+        :param keep: number of tags to retain, by default `keep_images`.
+        :param pinned: additional tags to retain.
+
+        :returns: dictionary with keys `layers_size` (total size of image
+            layers, bytes) and `images`, a list of dictionaries with keys
+            `id`, `tags`, `created`, `size`, `unique_size` (bytes not
+            shared with another image), `platform` and `keep` (the reason
+            to retain the image, or None).
+
+        .. note:: Calculating disk usage can be slow, this method should
+            be used from a worker thread.
+        """
+        if keep is None:
+            keep = self.keep_images
+        pinned = set(pinned)
+        if self.policy.pinned_tag is not None:
+            pinned.add(self.policy.pinned_tag)
+        in_use = set(
+            x['ImageID'] for x in self.docker.api.containers(all=True))
+        usage = self.docker.df()
+        repo = "{}:".format(self.image_name)
+        digest = "{}@".format(self.image_name)
+        images = list()
+        for img in usage['Images'] or list():
+            tags = [
+                x[len(repo):] for x in img.get('RepoTags') or list()
+                if x.startswith(repo)]
+            if len(tags) == 0 and not any(
+                    x.startswith(digest)
+                    for x in img.get('RepoDigests') or list()):
+                continue
+            images.append({
+                'id': img['Id'], 'tags': tags, 'created': img['Created'],
+                'size': img['Size'],
+                'unique_size': img['Size'] - max(img['SharedSize'], 0),
+                'platform': self._indexed_platform(img['Id'], tags),
+                'keep': None})
+
+        def newest(image):
+            versions = list()
+            for tag in image['tags']:
+                try:
+                    versions.append(semver.VersionInfo.parse(tag[1:]))
+                except ValueError:
+                    pass
+            if len(versions) == 0:
+                return (0, image['created'])
+            return (1, max(versions), image['created'])
+        images.sort(key=newest, reverse=True)
+        retained = 0
+        for image in images:
+            if image['id'] in in_use:
+                image['keep'] = "in use"
+            elif pinned.intersection(image['tags']):
+                image['keep'] = "pinned"
+            elif len(image['tags']) > 0 and retained < keep:
+                image['keep'] = "newest"
+                retained += 1
+        return {'layers_size': usage['LayersSize'], 'images': images}
+
+    def _indexed_platform(self, image_id, tags):
+        for tag in tags:
+            entry = self.tag_index.get("{}:{}".format(self.image_name, tag))
+            if entry is not None and entry['id'] == image_id:
+                return entry['platform']
+        # not pulled by the launcher, or since replaced
+        attrs = self.docker.images.get(image_id).attrs
+        if len(tags) > 0:
+            self.tag_index.record(attrs)
+        return image_platform(attrs)
+
+    @labslauncher.log_duration("remove_old_images")
+    def remove_old_images(
+            self, keep=None, pinned=(), dry_run=False, **kwargs):
+        """Remove local images of `image_name` not retained by policy.
+
+        :param keep: number of tags to retain, see `image_usage`.
+        :param pinned: additional tags to retain.
+        :param dry_run: report but do not remove images.
+
+        :returns: dictionary with keys `removed` and `failed` (image
+            names), `estimated` (bytes unique to removed images) and
+            `reclaimed` (measured reduction in total layer size, bytes;
+            larger than the estimate when layers are shared only between
+            removed images).
+        """
+        usage = self.image_usage(keep=keep, pinned=pinned)
+        removed, failed = list(), list()
+        estimated = 0
+        for image in usage['images']:
+            if image['keep'] is not None:
+                continue
+            names = ["{}:{}".format(self.image_name, x)
+                     for x in image['tags']] or [image['id']]
+            estimated += image['unique_size']
+            if dry_run:
+                removed.extend(names)
+                continue
+            for name in names:
+                try:
+                    self.docker.images.remove(name)
+                except docker.errors.APIError as e:
+                    self.logger.warning(
+                        "Failed to remove image {}: {}".format(name, e))
+                    failed.append(name)
+                else:
+                    self.logger.info("Removed image: {}.".format(name))
+                    self.tag_index.remove(name)
+                    removed.append(name)
+        reclaimed = 0
+        if len(removed) > 0 and not dry_run:
+            reclaimed = usage['layers_size'] - self.docker.df()['LayersSize']
+        self.logger.info(
+            "Image removal: {} removed, {} failed, {:.2f}Gb estimated, "
+            "{:.2f}Gb reclaimed.".format(
+                len(removed), len(failed), estimated / 1024 ** 3,
+                reclaimed / 1024 ** 3))
+        return {
+            'removed': removed, 'failed': failed, 'estimated': estimated,
+            'reclaimed': reclaimed}
+
     @property
     def container(self):
         """Return the server container if one is present, else None."""
+        return self.get_container(self.server_name)
+
+    def get_container(self, name):
+        """Return a named container if one is present, else None.
+
+        :param name: container name.
+        """
         try:
-            for cont in self.docker.containers.list(True):
-                if cont.name == self.server_name:
-                    return cont
+            return self.docker.containers.get(name)
         except Exception:
             pass
         return None
 
-    def start_container(self, mount, token, port, aux_port):
+    def server_options(self, name=None):
+        """Return the port and token of a server container (or None).
+
+        :param name: container name, by default `server_name`.
+
+        :returns: dictionary with `port` and `token`.
+        """
+        cont = self.get_container(self.server_name if name is None else name)
+        if cont is None:
+            return None
+        options = dict()
+        for arg in cont.attrs['Args']:
+            if arg.startswith('--port='):
+                options['port'] = int(arg.split('=')[1])
+            elif arg.startswith('--NotebookApp.token='):
+                options['token'] = arg.split('=')[1]
+        return options
+
+    def container_states(self):
+        """Return the status of all containers on the host.
+
+        A single (sparse) query is made to docker, such that the states of
+        any number of containers can be obtained without a request for each.
+
+        :returns: dictionary mapping container name to status.
+        """
+        states = dict()
+        try:
+            for cont in self.docker.api.containers(all=True):
+                for name in cont['Names']:
+                    states[name.lstrip('/')] = cont['State']
+        except Exception:
+            pass
+        self.states.value = states
+        return states
+
+    def published_ports(self):
+        """Return the host ports published by running containers.
+
+        :returns: dictionary mapping container name to a set of ports.
+        """
+        published = dict()
+        for cont in self.docker.api.containers():
+            ports = set(
+                x['PublicPort'] for x in cont['Ports'] if 'PublicPort' in x)
+            for name in cont['Names']:
+                published[name.lstrip('/')] = ports
+        return published
+
+    def port_conflicts(self, ports, name=None):
+        """Return those ports which cannot be used by a container.
+
+        :param ports: list of requested ports.
+        :param name: name of the container to be started, by default
+            `server_name`. Ports published by this container are assumed
+            available since it will be removed before (re)starting.
+
+        :returns: tuple of (conflicting ports, ports used by other
+            containers).
+        """
+        if name is None:
+            name = self.server_name
+        try:
+            published = self.published_ports()
+        except Exception:
+            self.logger.exception("Failed to query published ports.")
+            published = dict()
+        own = published.pop(name, set())
+        in_use = set()
+        for value in published.values():
+            in_use.update(value)
+        conflicts = list()
+        for port in ports:
+            port = int(port)
+            if port in own:
+                continue
+            if port in in_use or not port_available(
+                    port, host_only=self.host_only):
+                conflicts.append(port)
+        if len(conflicts) > 0:
+            self.logger.warning(
+                "Requested ports are unavailable: {}.".format(conflicts))
+        return conflicts, in_use
+
+    def free_ports(self, ports, name=None):
+        """Return available ports, preferring those requested.
+
+        :param ports: list of requested ports.
+        :param name: name of the container to be started, see
+            `port_conflicts`.
+        """
+        conflicts, in_use = self.port_conflicts(ports, name=name)
+        if len(conflicts) == 0:
+            return [int(x) for x in ports]
+        return next_free_ports(ports, in_use=in_use, host_only=self.host_only)
+
+    @labslauncher.log_duration("can_share")
+    def can_share(self, path):
+        """Return whether a host path can be bind mounted into containers.
+
+        A container is created (but not started) from the local notebook
+        image with the path mounted. Successful results are cached such
+        that subsequent requests for the path, or any path beneath it, are
+        answered without a query to docker.
+
+        :param path: host path.
+
+        :returns: True or False, or None if the probe could not be made
+            (e.g. no local image is available).
+        """
+        path = os.path.abspath(path)
+        for prefix, shared in self._share_cache.items():
+            if shared and (
+                    path == prefix
+                    or path.startswith(prefix.rstrip(os.sep) + os.sep)):
+                return True
+        if path in self._share_cache:
+            return self._share_cache[path]
+
+        try:
+            image = self.full_image_name()
+        except Exception:
+            return None
+        shared = None
+        try:
+            cont = self.docker.containers.create(
+                image, 'true', volumes={
+                    path: {'bind': self.data_bind, 'mode': 'ro'}})
+        except docker.errors.APIError as e:
+            if is_file_share_error(str(e)):
+                shared = False
+            else:
+                self.logger.exception("Failed to probe file sharing.")
+        except Exception:
+            self.logger.exception("Failed to probe file sharing.")
+        else:
+            shared = True
+            try:
+                cont.remove(force=True)
+            except Exception:
+                self.logger.exception("Failed to remove probe container.")
+        if shared is not None:
+            self.logger.info("File sharing of {}: {}.".format(path, shared))
+            self._share_cache[path] = shared
+        return shared
+
+    def clear_share_cache(self, *args):
+        """Clear cached results of `can_share`."""
+        self._share_cache = dict()
+
+    def cache_volume_names(self, tag, name=None):
+        """Return the names of the cache volumes for an image tag.
+
+        Volumes are versioned by tag such that packages installed against
+        one image are not used with another.
+
+        :param tag: image tag.
+        :param name: container name, by default `server_name`.
+
+        :returns: dictionary mapping cache kind to volume name.
+        """
+        if name is None:
+            name = self.server_name
+        return {
+            kind: "{}-{}-{}".format(name, kind, tag)
+            for kind in CACHE_VOLUMES}
+
+    def cache_volume_binds(self, tag, name=None):
+        """Create (if necessary) cache volumes, returning their binds.
+
+        :param tag: image tag.
+        :param name: container name, by default `server_name`.
+
+        :returns: dictionary suitable for the `volumes` argument of
+            `containers.run`.
+        """
+        if name is None:
+            name = self.server_name
+        existing = set(v.name for v in self.docker.volumes.list(
+            filters={'label': CACHE_LABEL}))
+        binds = dict()
+        for kind, vol in self.cache_volume_names(tag, name=name).items():
+            if vol not in existing:
+                self.logger.info("Creating cache volume: {}.".format(vol))
+                self.docker.volumes.create(vol, labels={
+                    CACHE_LABEL: kind, TAG_LABEL: tag, INSTANCE_LABEL: name})
+            binds[vol] = {'bind': CACHE_VOLUMES[kind], 'mode': 'rw'}
+        return binds
+
+    @labslauncher.log_duration("cache_volume_usage")
+    def cache_volume_usage(self, **kwargs):
+        """Return information on cache volumes.
+
+        :returns: list of dictionaries with keys `name`, `kind`, `tag`,
+            `instance` and `size` (bytes, -1 if unknown).
+
+        .. note:: Calculating disk usage can be slow, this method should
+            be used from a worker thread.
+        """
+        usage = list()
+        for vol in self.docker.df()['Volumes'] or list():
+            labels = vol.get('Labels') or dict()
+            if CACHE_LABEL not in labels:
+                continue
+            usage.append({
+                'name': vol['Name'], 'kind': labels[CACHE_LABEL],
+                'tag': labels.get(TAG_LABEL),
+                'instance': labels.get(INSTANCE_LABEL),
+                'size': vol.get('UsageData', dict()).get('Size', -1)})
+        return usage
+
+    @labslauncher.log_duration("prune_cache_volumes")
+    def prune_cache_volumes(self, keep_current=True, **kwargs):
+        """Remove cache volumes.
+
+        :param keep_current: keep volumes for the most recent local tag.
+
+        :returns: list of names of removed volumes. Volumes in use by a
+            container are not removed.
+        """
+        keep = None
+        if keep_current:
+            keep = self.latest_available_tag
+        removed = list()
+        for vol in self.docker.volumes.list(filters={'label': CACHE_LABEL}):
+            tag = (vol.attrs.get('Labels') or dict()).get(TAG_LABEL)
+            if keep is not None and tag == keep:
+                continue
+            try:
+                vol.remove()
+            except docker.errors.APIError:
+                self.logger.warning(
+                    "Cache volume {} in use, not removed.".format(vol.name))
+            else:
+                self.logger.info("Removed cache volume: {}.".format(vol.name))
+                removed.append(vol.name)
+        return removed
+
+    @labslauncher.log_duration("start_container")
+    def start_container(self, mount, token, port, aux_port, name=None):
         """Start the server container, removing a previous one if necessary.
 
+        :param mount: host path to bind to `data_bind`.
+        :param token: notebook server token.
+        :param port: notebook server port.
+        :param aux_port: auxiliary port.
+        :param name: container name, by default `server_name`.
+
         .. note:: The behaviour of docker.run is that a pull will be invoked if
             the image is not available locally. To ensure more controlled
             behaviour check .fetch_local_image() first.
         """
-        self.logger.info("Starting container.")
-        self.clear_container()
+        # the container states of the host are emitted once, rather than
+        # also on removal of the previous container
+        with self.states.batch():
+            self._start_container(mount, token, port, aux_port, name=name)
+
+    def _start_container(self, mount, token, port, aux_port, name=None):
+        # removing the previous container applies a deferred change of
+        # `server_name`, see `.configure()`
+        self.clear_container(name=name)
+        if name is None:
+            name = self.server_name
+        self.logger.info("Starting container: {}.".format(name))
         CMD = self.container_cmd.split() + [
             "--NotebookApp.token={}".format(token),
             "--port={}".format(port)]
@@ -386,40 +1877,75 @@ class DockerClient():
                     environment.append('{}={}'.format(env, server))
 
             self.logger.info("Container environment: {}.".format(environment))
-            self.docker.containers.run(
-                self.full_image_name(),
+            tag = self.latest_available_tag
+            volumes = {mount: {'bind': self.data_bind, 'mode': 'rw'}}
+            if self.cache_volumes:
+                volumes.update(self.cache_volume_binds(tag, name=name))
+            cont = self.docker.containers.run(
+                self.full_image_name(tag),
                 CMD,
                 detach=True,
                 ports=ports,
                 environment=environment,
-                volumes={
-                    mount: {
-                        'bind': self.data_bind, 'mode': 'rw'}},
-                name=self.server_name)
+                volumes=volumes,
+                labels={INSTANCE_LABEL: name},
+                name=name)
         except Exception:
             self.logger.exception(
                     "Failed to start container.")
-            self.last_failure = traceback.format_exc()
-            self.last_failure_type = 'unknown'
-            win_fs_msg = "Filesharing has been cancelled"
-            osx_fs_msg = "Mounts denied"
-            if (win_fs_msg in self.last_failure) \
-                    or (osx_fs_msg in self.last_failure):
+            failure, failure_type = traceback.format_exc(), 'unknown'
+            if is_file_share_error(failure):
                 self.logger.warning("Detected that sharing was disabled.")
-                self.last_failure_type = "file_share"
+                failure_type = "file_share"
+                self._share_cache[os.path.abspath(mount)] = False
+            # failures of other instances are not those of the server
+            if name == self.server_name:
+                self.last_failure = failure
+                self.last_failure_type = failure_type
         else:
             self.logger.info("Container started: {} {}".format(
-                self.container.id, self.full_image_name()))
-        self.final_stats = None
+                cont.id, self.full_image_name()))
+        if name == self.server_name:
+            self.final_stats = None
         self.set_status()
 
-    def clear_container(self, *args):
-        """Kill and remove the server container."""
-        cont = self.container
+    def write_server_config(self, mount, port, aux_port, send_pings):
+        """Write the configuration of the running server to its mount.
+
+        :param mount: host path mounted in the container.
+        :param port: notebook server port.
+        :param aux_port: auxiliary port.
+        :param send_pings: whether usage pings are enabled.
+        """
+        config = configparser.ConfigParser()
+        config['Host'] = {
+            'hostname': socket.gethostname(),
+            'operating_system': platform.platform()}
+        config['Container'] = {
+            'mount': mount, 'port': port, 'aux_port': aux_port,
+            'image_tag': self.latest_available_tag,
+            'latest_tag': str(self.latest_tag),
+            'id': self.container.id}
+        config['Pings'] = {'enabled': send_pings}
+        fname = os.path.join(mount, os.path.basename(ping.CONTAINER_META))
+        with open(fname, 'w') as config_file:
+            config.write(config_file)
+
+    @labslauncher.log_duration("clear_container")
+    def clear_container(self, *args, name=None):
+        """Kill and remove the server container.
+
+        :param name: container name, by default `server_name`.
+        """
+        if name is None:
+            name = self.server_name
+        cont = self.get_container(name)
         if cont is not None:
             if cont.status == "running":
-                self.logger.info("Stopping container.")
-                self.final_stats = cont.stats(stream=False)
+                self.logger.info("Stopping container: {}.".format(name))
+                if name == self.server_name:
+                    self.final_stats = self.sampler.latest
+                    self.sampler.stop()
                 cont.kill()
                 self.logger.info("Container stopped.")
             self.logger.info("Removing container.")
@@ -427,27 +1953,113 @@ class DockerClient():
             self.logger.info("Container removed.")
         self.set_status()
 
+    def exit_state(self, name=None):
+        """Return the state of an exited container, or None.
+
+        :param name: container name, by default `server_name`.
+
+        :returns: the `State` of `docker inspect`, including `ExitCode`,
+            `OOMKilled` and `Error`.
+        """
+        cont = self.get_container(self.server_name if name is None else name)
+        if cont is None or cont.status != "exited":
+            return None
+        return cont.attrs['State']
+
+    @labslauncher.log_duration("restart_container")
+    def restart_container(self, name=None, running=False, **kwargs):
+        """Start an exited container with its previous configuration.
+
+        :param name: container name, by default `server_name`.
+        :param running: also restart the container if it is running.
+
+        :returns: whether the container was restarted.
+        """
+        if name is None:
+            name = self.server_name
+        cont = self.get_container(name)
+        states = ("exited", "running") if running else ("exited",)
+        if cont is None or cont.status not in states:
+            # the container was removed or started in the meantime
+            return False
+        self.logger.info("Restarting container: {}.".format(name))
+        try:
+            if cont.status == "running":
+                cont.restart(timeout=10)
+            else:
+                cont.start()
+        except Exception:
+            self.logger.exception("Failed to restart container.")
+            if name == self.server_name:
+                self.last_failure = traceback.format_exc()
+                self.last_failure_type = 'unknown'
+            return False
+        finally:
+            self.set_status()
+        return True
+
     def set_status(self, new=None):
         """Set the container status property."""
         # store the old and the new status
         if self._available.value and new is None:
-            c = self.container
-            new = "inactive" if c is None else c.status
+            new = self.container_states().get(self.server_name, "inactive")
         self.status.value = (self.status.value[1], new)
         if self.status.value[0] != self.status.value[1]:
             self.logger.info("status: {}".format(self.status.value))
+        if new == "inactive" and self.deferred:
+            deferred, self.deferred = self.deferred, dict()
+            self.configure(**deferred)
+
+    def container_logs(
+            self, stream=False, tail=1000, since=None,
+            max_bytes=LOG_MAX_BYTES, name=None, follow=None):
+        """Return container logs (or None).
 
-    def container_logs(self, stream=False):
-        """Return container logs (or None)."""
+        :param stream: return a generator of decoded log text chunks.
+        :param tail: number of lines to retrieve from the end of the log,
+            or 'all'.
+        :param since: datetime or timestamp from which to retrieve logs.
+        :param max_bytes: maximum size (bytes) of the log to return when not
+            streaming, earlier content is discarded.
+        :param name: container name, by default `server_name`.
+        :param follow: when streaming, whether to follow the log output
+            rather than end at its current end. By default logs are
+            followed when streamed.
+        """
+        c = None
         if self._available.value:
-            c = self.container
-        if c is not None:
-            if stream:
-                return (
-                    item.decode()
-                    for item in self.container.logs(stream=stream))
-            else:
-                return self.container.logs().decode()
-        else:
+            c = self.get_container(
+                self.server_name if name is None else name)
+        if c is None:
             self.logger.warning("Cannot fetch logs without container.")
             return None
+        if follow is None:
+            follow = stream
+        chunks = c.logs(
+            stream=True, follow=stream and follow, tail=tail, since=since)
+        if stream:
+            return decode_chunks(chunks)
+        # the tail may begin part way through a multibyte character
+        return tail_bytes(chunks, max_bytes).lstrip(
+            bytes(range(0x80, 0xc0))).decode('utf-8', errors='replace')
+
+    @labslauncher.log_duration("save_logs")
+    def save_logs(self, fname, name=None, progress=None, stopped=None):
+        """Write the full container log to a file.
+
+        :param fname: output filename.
+        :param name: container name, by default `server_name`.
+
+        :returns: the filename, or None if the log could not be retrieved.
+        """
+        chunks = self.container_logs(
+            stream=True, tail='all', name=name, follow=False)
+        if chunks is None:
+            return None
+        self.logger.info("Writing container logs to {}.".format(fname))
+        with open(fname, 'w', encoding='utf-8') as fh:
+            for chunk in chunks:
+                if stopped is not None and stopped.is_set():
+                    break
+                fh.write(chunk)
+        return fname
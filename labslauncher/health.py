@@ -0,0 +1,109 @@
+"""Health of a running notebook server, from the latency of its HTTP API."""
+import collections
+import statistics
+import time
+import urllib.request
+
+import labslauncher
+
+
+UNKNOWN, HEALTHY, DEGRADED, UNRESPONSIVE = (
+    'unknown', 'healthy', 'degraded', 'unresponsive')
+
+
+def probe_latency(port, timeout=5.0):
+    """Return the time taken by a notebook server to respond, or None.
+
+    :param port: notebook server port.
+    :param timeout: request timeout (seconds).
+
+    :returns: latency (seconds), or None if the server did not respond
+        successfully within `timeout`.
+    """
+    t0 = time.monotonic()
+    try:
+        with urllib.request.urlopen(
+                "http://127.0.0.1:{}/api".format(port),
+                timeout=timeout) as response:
+            response.read()
+            if response.status != 200:
+                return None
+    except Exception:
+        return None
+    return time.monotonic() - t0
+
+
+class HealthMonitor():
+    """Track notebook server health over a sliding window of probes.
+
+    The server is unresponsive if the most recent `failures` probes all
+    failed, degraded if any probe in the window failed or the median
+    latency exceeds `slow`, and otherwise healthy.
+    """
+
+    def __init__(self, window=10, slow=2.0, failures=3):
+        """Initialize the monitor.
+
+        :param window: number of probes considered.
+        :param slow: median latency (seconds) above which the server is
+            degraded.
+        :param failures: consecutive failed probes after which the server
+            is unresponsive.
+        """
+        self.slow = slow
+        self.failures = failures
+        self.samples = collections.deque(maxlen=window)
+        self.state = UNKNOWN
+        self.probes = 0
+        self.logger = labslauncher.get_named_logger("Health")
+
+    def reset(self):
+        """Forget previous probes, e.g. when the server (re)starts."""
+        self.samples.clear()
+        self.state = UNKNOWN
+
+    def record(self, latency):
+        """Record a probe, returning the health state.
+
+        :param latency: response time (seconds), or None for a failure.
+        """
+        self.probes += 1
+        self.samples.append(latency)
+        state = self.assess()
+        if state != self.state:
+            log = self.logger.info if state == HEALTHY else \
+                self.logger.warning
+            log("Server health changed: {} -> {} ({}).".format(
+                self.state, state, self.describe()))
+        self.state = state
+        return state
+
+    def assess(self):
+        """Return the health state from the recorded probes."""
+        if len(self.samples) == 0:
+            return UNKNOWN
+        recent = list(self.samples)[-self.failures:]
+        if len(recent) == self.failures and all(x is None for x in recent):
+            return UNRESPONSIVE
+        latencies = [x for x in self.samples if x is not None]
+        if len(latencies) < len(self.samples):
+            return DEGRADED
+        if statistics.median(latencies) > self.slow:
+            return DEGRADED
+        return HEALTHY
+
+    def describe(self):
+        """Return a summary of the recorded probes."""
+        latencies = [x for x in self.samples if x is not None]
+        failed = len(self.samples) - len(latencies)
+        if len(latencies) == 0:
+            return "{} of {} probes failed".format(failed, len(self.samples))
+        return "median latency {:.0f}ms, {} of {} probes failed".format(
+            1000 * statistics.median(latencies), failed, len(self.samples))
+
+    def stats(self):
+        """Return a list of (item, value) describing server health."""
+        return [
+            ("State", self.state),
+            ("Probes", self.probes),
+            ("Recent probes", self.describe() if self.samples else "none")]
@@ -0,0 +1,237 @@
+"""Management of multiple notebook server instances."""
+import json
+
+import labslauncher
+from labslauncher import qtext
+
+
+class ServerInstance():
+    """Definition of a notebook server container."""
+
+    fields = ('name', 'mount', 'token', 'port', 'aux_port')
+
+    def __init__(self, name, mount, token, port, aux_port):
+        """Initialize the definition.
+
+        :param name: container name.
+        :param mount: host path to make available to the server.
+        :param token: notebook server token.
+        :param port: notebook server port.
+        :param aux_port: auxiliary port.
+        """
+        self.name = name
+        self.mount = mount
+        self.token = token
+        self.port = int(port)
+        self.aux_port = int(aux_port)
+
+    def to_dict(self):
+        """Return a dictionary representation of the definition."""
+        return {k: getattr(self, k) for k in self.fields}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a definition from a dictionary.
+
+        :param data: dictionary as returned by `.to_dict()`.
+        """
+        return cls(**{k: data[k] for k in cls.fields})
+
+    @property
+    def link(self):
+        """Return the Welcome page link of the instance."""
+        return labslauncher.get_server_link(self.port, self.token)
+
+
+def container_resources(stats):
+    """Summarise the output of `container.stats(stream=False)`.
+
+    :param stats: docker statistics dictionary.
+
+    :returns: dictionary with `cpu` (percent), `memory` and `memory_limit`
+        (bytes).
+    """
+    cpu = 0.0
+    try:
+        cpu_stats, precpu = stats['cpu_stats'], stats['precpu_stats']
+        cpu_delta = (
+            cpu_stats['cpu_usage']['total_usage']
+            - precpu['cpu_usage']['total_usage'])
+        sys_delta = (
+            cpu_stats['system_cpu_usage'] - precpu['system_cpu_usage'])
+        ncpu = cpu_stats.get('online_cpus')
+        if ncpu is None:
+            ncpu = len(cpu_stats['cpu_usage'].get('percpu_usage', [1]))
+        if sys_delta > 0:
+            cpu = 100.0 * ncpu * cpu_delta / sys_delta
+    except (KeyError, TypeError):
+        pass
+    memory = stats.get('memory_stats', dict())
+    return {
+        'cpu': cpu,
+        'memory': memory.get('usage', 0),
+        'memory_limit': memory.get('limit', 0)}
+
+
+class InstanceManager():
+    """Start, stop and monitor several notebook server containers.
+
+    Each instance shares the image and container configuration of a
+    `DockerClient` but has its own container name, ports, mount and token.
+    Instance status is derived from the aggregated container state query
+    made by the client's status heartbeat; no additional polling is
+    performed per instance.
+    """
+
+    # coalesce rapid changes, e.g. when several instances are started
+    statuses = qtext.Property(dict(), delay=100)
+
+    def __init__(self, client, instances=None):
+        """Initialize the manager.
+
+        :param client: a `DockerClient` instance.
+        :param instances: a list of `ServerInstance`.
+        """
+        self.client = client
+        self.logger = labslauncher.get_named_logger("InstMngr")
+        self.instances = dict()
+        for instance in instances or list():
+            self.add(instance)
+        self.client.states.changed.connect(self.on_states)
+        self.client._available.changed.connect(self.on_available)
+        self.on_states(self.client.states.value)
+
+    @classmethod
+    def from_settings(cls, client, settings):
+        """Create a manager from the `instances` setting.
+
+        :param client: a `DockerClient` instance.
+        :param settings: application settings.
+        """
+        try:
+            data = json.loads(settings['instances'])
+        except ValueError:
+            data = list()
+        return cls(client, [ServerInstance.from_dict(x) for x in data])
+
+    def save(self, settings):
+        """Store instance definitions to the `instances` setting.
+
+        :param settings: application settings.
+        """
+        settings['instances'] = json.dumps(
+            [x.to_dict() for x in self.instances.values()])
+
+    def add(self, instance, reserved=None):
+        """Add a server instance definition.
+
+        :param instance: a `ServerInstance`.
+        :param reserved: further ports which may not be used, e.g. those
+            of the main server.
+        """
+        if instance.name == self.client.server_name:
+            raise ValueError(
+                "Instance name '{}' is reserved.".format(instance.name))
+        if instance.name in self.instances:
+            raise ValueError(
+                "Instance '{}' already exists.".format(instance.name))
+        if reserved is not None and not {
+                instance.port, instance.aux_port}.isdisjoint(reserved):
+            raise ValueError("Instance ports are used by the main server.")
+        used = set()
+        for other in self.instances.values():
+            used.update((other.port, other.aux_port))
+        if instance.port in used or instance.aux_port in used:
+            raise ValueError("Instance ports are used by another instance.")
+        self.instances[instance.name] = instance
+        self.logger.info("Added instance: {}.".format(instance.name))
+
+    def remove(self, name, stop=True):
+        """Remove an instance definition, stopping its container.
+
+        :param name: instance name.
+        :param stop: stop and remove the container. If False the container
+            should already have been stopped, see `.stop()`.
+        """
+        if stop:
+            self.stop(name)
+        del self.instances[name]
+        self.logger.info("Removed instance: {}.".format(name))
+
+    def start(self, name):
+        """Start the container of an instance.
+
+        :param name: instance name.
+
+        :raises: `ValueError` if the instance's ports are unavailable.
+        """
+        inst = self.instances[name]
+        conflicts, _ = self.client.port_conflicts(
+            (inst.port, inst.aux_port), name=inst.name)
+        if len(conflicts) > 0:
+            raise ValueError(
+                "Ports of instance '{}' are in use: {}.".format(
+                    name, ", ".join(str(x) for x in conflicts)))
+        self.client.start_container(
+            inst.mount, inst.token, inst.port, inst.aux_port, name=inst.name)
+
+    def stop(self, name):
+        """Stop and remove the container of an instance.
+
+        :param name: instance name.
+        """
+        self.client.clear_container(name=name)
+
+    def stop_all(self, *args):
+        """Stop all instances."""
+        for name in self.instances:
+            self.stop(name)
+
+    def refresh(self):
+        """Update instance statuses with a single docker query."""
+        if self.client._available.value:
+            self.on_states(self.client.container_states())
+        else:
+            self.on_available(False)
+
+    def on_states(self, states):
+        """Update instance statuses from the host container states.
+
+        :param states: dictionary of container name to status.
+        """
+        if not self.client._available.value:
+            return
+        self.statuses.value = {
+            name: states.get(name, "inactive") for name in self.instances}
+
+    def on_available(self, value):
+        """Set unknown status when docker is not available.
+
+        :param value: whether docker is available.
+        """
+        if not value:
+            self.statuses.value = {
+                name: "unknown" for name in self.instances}
+
+    def resources(self, **kwargs):
+        """Return resource usage of running instances.
+
+        :returns: dictionary of instance name to a dictionary of resource
+            usage, see `container_resources`.
+
+        .. note:: This method makes a blocking statistics request for each
+            running container and should be used from a worker thread.
+        """
+        usage = dict()
+        for name, status in self.statuses.value.items():
+            if status != "running":
+                continue
+            cont = self.client.get_container(name)
+            if cont is None:
+                continue
+            try:
+                usage[name] = container_resources(cont.stats(stream=False))
+            except Exception:
+                self.logger.exception(
+                    "Failed to fetch statistics for {}.".format(name))
+        return usage
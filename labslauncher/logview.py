@@ -0,0 +1,242 @@
+"""Live view of notebook server logs."""
+import collections
+import re
+import threading
+
+from PyQt5.QtCore import pyqtSlot as Slot, QTimer
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import (
+    QComboBox, QDialog, QHBoxLayout, QLabel, QLineEdit, QPlainTextEdit,
+    QVBoxLayout)
+
+import labslauncher
+from labslauncher.dockerutil import decode_chunks
+
+
+# jupyter log lines start e.g. "[W 12:00:00.000 NotebookApp]"
+LEVELS = collections.OrderedDict((
+    ('All', 0), ('Info', 20), ('Warning', 30), ('Error', 40)))
+_LEVEL_CHARS = {'D': 10, 'I': 20, 'W': 30, 'E': 40, 'C': 50}
+_LEVEL_RE = re.compile(r'^\[([DIWEC]) ')
+
+
+class LogBuffer():
+    """A thread-safe ring buffer of log lines.
+
+    Lines are stored with a log level parsed from the line, lines without
+    a level (e.g. tracebacks) inherit the level of the previous line.
+    """
+
+    def __init__(self, maxlen=10000):
+        """Initialize the buffer.
+
+        :param maxlen: maximum number of lines to retain.
+        """
+        self.lines = collections.deque(maxlen=maxlen)
+        self.pending = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+        self._partial = ""
+        self._level = LEVELS['Info']
+
+    def feed(self, text):
+        """Add text to the buffer.
+
+        :param text: log text, not necessarily ending in a newline.
+        """
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        items = list()
+        for line in lines:
+            match = _LEVEL_RE.match(line)
+            if match is not None:
+                self._level = _LEVEL_CHARS[match.group(1)]
+            items.append((self._level, line))
+        with self.lock:
+            self.lines.extend(items)
+            self.pending.extend(items)
+
+    def close(self):
+        """Add any incomplete final line to the buffer."""
+        if self._partial != "":
+            self.feed("\n")
+
+    def take_pending(self):
+        """Return and clear lines added since the last call."""
+        with self.lock:
+            items = list(self.pending)
+            self.pending.clear()
+        return items
+
+    def snapshot(self):
+        """Return all lines in the buffer."""
+        with self.lock:
+            self.pending.clear()
+            return list(self.lines)
+
+
+class LogFollower(threading.Thread):
+    """Follow the log stream of a container into a `LogBuffer`."""
+
+    def __init__(self, container, buffer, tail=1000):
+        """Initialize the follower.
+
+        :param container: a docker container.
+        :param buffer: a `LogBuffer`.
+        :param tail: number of existing lines to fetch initially.
+        """
+        super().__init__(daemon=True)
+        self.container = container
+        self.buffer = buffer
+        self.tail = tail
+        self.stream = None
+        self.stopped = threading.Event()
+        self.logger = labslauncher.get_named_logger("LogFollw")
+
+    def run(self):
+        """Read the log stream until stopped or the container exits."""
+        try:
+            self.stream = self.container.logs(
+                stream=True, follow=True, tail=self.tail)
+            for text in decode_chunks(self.stream):
+                if self.stopped.is_set():
+                    break
+                self.buffer.feed(text)
+        except Exception:
+            if not self.stopped.is_set():
+                self.logger.exception("Log stream failed.")
+        self.buffer.close()
+
+    def stop(self):
+        """Stop following the log stream."""
+        self.stopped.set()
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception:
+                pass
+
+
+class LogViewer(QDialog):
+    """Dialog displaying the live log of the notebook server."""
+
+    frame_rate = 10  # widget updates per second
+
+    def __init__(self, client, maxlen=10000, parent=None):
+        """Initialize the dialog.
+
+        :param client: a `DockerClient`.
+        :param maxlen: maximum number of lines to retain.
+        """
+        super().__init__(parent)
+        self.client = client
+        self.buffer = LogBuffer(maxlen=maxlen)
+        self.follower = None
+        self.query = ""
+        self.shown = list()
+        self.setWindowTitle("Server log")
+        self.resize(800, 500)
+        self.layout = QVBoxLayout()
+
+        self.l0 = QHBoxLayout()
+        self.search_txt = QLineEdit()
+        self.search_txt.setPlaceholderText("Search")
+        self.search_txt.textChanged.connect(self.on_search)
+        self.level_box = QComboBox()
+        for name in LEVELS:
+            self.level_box.addItem(name, LEVELS[name])
+        self.level_box.currentIndexChanged.connect(self.rebuild)
+        self.l0.addWidget(QLabel("Filter:"))
+        self.l0.addWidget(self.search_txt)
+        self.l0.addWidget(self.level_box)
+        self.layout.addLayout(self.l0)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setMaximumBlockCount(maxlen)
+        self.text.setFont(QFont("Monospace"))
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.layout.addWidget(self.text)
+        self.setLayout(self.layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000 // self.frame_rate)
+        self.timer.timeout.connect(self.flush)
+        self.client.status.changed.connect(self.on_status)
+
+    def _accept(self, item):
+        level, line = item
+        return (
+            level >= self.level_box.currentData()
+            and self.query.lower() in line.lower())
+
+    def follow(self):
+        """Start following the server log, if not already."""
+        if self.follower is not None and self.follower.is_alive():
+            return
+        container = self.client.container
+        if container is None:
+            return
+        # the follower fetches the tail of the log, so start afresh
+        self.buffer = LogBuffer(maxlen=self.buffer.lines.maxlen)
+        self.follower = LogFollower(container, self.buffer)
+        self.follower.start()
+
+    def stop(self, *args):
+        """Stop following the server log."""
+        if self.follower is not None:
+            self.follower.stop()
+            self.follower = None
+
+    def showEvent(self, event):
+        """Start following logs when shown."""
+        super().showEvent(event)
+        self.follow()
+        self.rebuild()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        """Stop following logs when hidden."""
+        self.timer.stop()
+        self.stop()
+        super().hideEvent(event)
+
+    @Slot(object)
+    def on_status(self, status):
+        """Follow the logs of a new container."""
+        old, new = status
+        if self.isVisible() and new == "running" and old != "running":
+            self.stop()
+            self.follow()
+            self.rebuild()
+
+    def flush(self):
+        """Append new lines to the widget, in a single batch."""
+        items = [x for x in self.buffer.take_pending() if self._accept(x)]
+        if len(items) == 0:
+            return
+        self.shown.extend(items)
+        del self.shown[:-self.buffer.lines.maxlen]
+        self.text.appendPlainText("\n".join(x[1] for x in items))
+
+    def on_search(self, query):
+        """Filter displayed lines as the search query changes.
+
+        :param query: search string.
+        """
+        old, self.query = self.query, query
+        if old.lower() in query.lower():
+            # refinement of previous search, filter what is shown
+            self.shown = [x for x in self.shown if self._accept(x)]
+            self._display()
+        else:
+            self.rebuild()
+
+    def rebuild(self, *args):
+        """Rebuild displayed lines from the buffer."""
+        self.shown = [x for x in self.buffer.snapshot() if self._accept(x)]
+        self._display()
+
+    def _display(self):
+        self.text.setPlainText("\n".join(x[1] for x in self.shown))
+        self.text.verticalScrollBar().setValue(
+            self.text.verticalScrollBar().maximum())
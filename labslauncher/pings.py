@@ -0,0 +1,190 @@
+"""Background delivery of usage pings."""
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import labslauncher
+
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
+
+
+class PingQueue():
+    """Deliver container pings from a background thread.
+
+    Pings which cannot be delivered are written to a spool directory and
+    retried, oldest first, with exponential backoff. Pings remaining in
+    the spool are delivered when the application next starts, if pings are
+    still enabled.
+    """
+
+    def __init__(
+            self, pinger, spool=None, backoff=30, max_backoff=60 * 60,
+            enabled=True):
+        """Initialize the queue.
+
+        :param pinger: an `epi2melabs.ping.Pingu` instance.
+        :param spool: directory in which to store undelivered pings.
+        :param backoff: initial delay (seconds) before retrying delivery.
+        :param max_backoff: maximum delay (seconds) between retries.
+        :param enabled: whether pings may be delivered, see
+            `.set_enabled()`.
+        """
+        self.pinger = pinger
+        if spool is None:
+            spool = os.path.join(labslauncher.__LOGDIR__, 'pings')
+        self.spool = spool
+        os.makedirs(self.spool, exist_ok=True)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self.enabled = enabled
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.logger = labslauncher.get_named_logger("PingQueu")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, state, stats, image_name):
+        """Queue a container ping.
+
+        :param state: the container state (start, update, stop).
+        :param stats: container statistics, or a callable returning them.
+            A callable is evaluated in the background thread.
+        :param image_name: the name of the server image.
+        """
+        self.queue.put((state, stats, image_name, time.time()))
+
+    def set_enabled(self, enabled):
+        """Enable or disable delivery of pings.
+
+        When disabled, undelivered pings are discarded.
+
+        :param enabled: whether pings may be delivered.
+        """
+        self.enabled = enabled
+        if enabled:
+            # wake the thread to deliver any spooled pings
+            self.queue.put(False)
+        else:
+            self.purge()
+
+    def purge(self):
+        """Remove all undelivered pings from the spool."""
+        fnames = glob.glob(os.path.join(self.spool, '*.json'))
+        for fname in fnames:
+            _remove(fname)
+        if len(fnames) > 0:
+            self.logger.info(
+                "Discarded {} undelivered ping(s).".format(len(fnames)))
+
+    def stop(self, timeout=5):
+        """Stop the delivery thread, spooling undelivered pings.
+
+        :param timeout: time (seconds) to wait for delivery of queued pings.
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.stopped.set()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item and self.enabled:
+                self._spool(item)
+
+    def _spool(self, item):
+        state, stats, image_name, created = item
+        if callable(stats):
+            stats = None
+        fname = os.path.join(self.spool, "{:.6f}-{}.json".format(
+            created, uuid.uuid4().hex[:8]))
+        with open(fname, 'w') as fh:
+            json.dump({
+                'state': state, 'stats': stats, 'image_name': image_name,
+                'created': created}, fh)
+
+    def _send(self, state, stats, image_name):
+        with labslauncher.timed(self.logger, "send_ping"):
+            result = self.pinger.send_container_ping(state, stats, image_name)
+        # a disabled pinger returns the data it would have sent
+        return not isinstance(result, int) or 200 <= result < 300
+
+    def _deliver_spool(self):
+        """Deliver spooled pings in order, stopping at the first failure.
+
+        Delivery stops, without failure, if pings are disabled.
+        """
+        for fname in sorted(glob.glob(os.path.join(self.spool, '*.json'))):
+            if not self.enabled:
+                break
+            try:
+                with open(fname) as fh:
+                    data = json.load(fh)
+                state = data['state']
+                stats, image_name = data['stats'], data['image_name']
+            except FileNotFoundError:
+                continue  # purged
+            except (OSError, ValueError, KeyError, TypeError):
+                self.logger.warning(
+                    "Discarding unreadable ping: {}.".format(fname))
+                _remove(fname)
+                continue
+            if not self._send(state, stats, image_name):
+                return False
+            _remove(fname)
+            self.logger.info("Delivered ping, state={}.".format(state))
+        return True
+
+    def _accept(self, item):
+        """Sample the stats of a queued ping and spool it."""
+        state, stats, image_name, created = item
+        if callable(stats):
+            try:
+                stats = stats()
+            except Exception:
+                self.logger.exception("Failed to sample stats.")
+                stats = None
+        self._spool((state, stats, image_name, created))
+
+    def _run(self):
+        delay = 0  # deliver pings spooled by a previous session
+        finished = False
+        while not finished:
+            try:
+                item = self.queue.get(timeout=delay)
+            except queue.Empty:
+                item = False
+            if item is None:  # sentinel from .stop(), make a final attempt
+                finished = True
+            elif item is not False and self.enabled:
+                # errors (e.g. a full disk) must not end the thread
+                try:
+                    self._accept(item)
+                except Exception:
+                    self.logger.exception("Failed to spool ping.")
+            if self.stopped.is_set():
+                break
+            try:
+                delivered = self._deliver_spool()
+            except Exception:
+                self.logger.exception("Failed to deliver pings.")
+                delivered = False
+            if delivered:
+                self.retries, delay = 0, None
+            elif not finished:
+                self.retries += 1
+                delay = min(
+                    self.backoff * 2 ** (self.retries - 1), self.max_backoff)
+                self.logger.warning(
+                    "Ping delivery failed, retry {} in {}s.".format(
+                        self.retries, delay))
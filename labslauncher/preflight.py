@@ -0,0 +1,214 @@
+"""Concurrent checks performed before starting a notebook server."""
+import collections
+import os
+import threading
+import time
+
+import labslauncher
+
+
+CheckResult = collections.namedtuple(
+    'CheckResult', ['name', 'passed', 'value', 'duration'])
+
+
+class CheckFailed(Exception):
+    """Raised by a check function to indicate the check did not pass."""
+
+
+class PortConflict(CheckFailed):
+    """Raised when requested ports are in use."""
+
+    def __init__(self, conflicts, free=None):
+        """Initialize the exception.
+
+        :param conflicts: list of ports in use.
+        :param free: available ports which may be used instead, or None.
+        """
+        super().__init__("Ports in use: {}.".format(
+            ", ".join(str(x) for x in conflicts)))
+        self.conflicts = conflicts
+        self.free = free
+
+
+class Check():
+    """A named check with a timeout."""
+
+    def __init__(self, name, fn, timeout=5):
+        """Initialize the check.
+
+        :param name: name of the check.
+        :param fn: function to call, taking no arguments. The check fails
+            if the function raises an exception. The return value, or the
+            exception message, is recorded in the result. A `CheckFailed`
+            exception is itself recorded, such that it may carry details.
+        :param timeout: time (seconds) after which the check is
+            considered failed.
+        """
+        self.name = name
+        self.fn = fn
+        self.timeout = timeout
+        self.result = None
+        self.thread = None
+
+    def _run(self):
+        t0 = time.monotonic()
+        try:
+            value = self.fn()
+        except Exception as e:
+            self.result = CheckResult(
+                self.name, False, e if isinstance(e, CheckFailed) else str(e),
+                time.monotonic() - t0)
+        else:
+            self.result = CheckResult(
+                self.name, True, value, time.monotonic() - t0)
+
+    def start(self):
+        """Start the check in a background thread."""
+        # daemon threads such that a check blocked on e.g. a stale network
+        # share does not prevent the application exiting
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def wait(self, deadline):
+        """Wait for the check to complete.
+
+        :param deadline: `time.monotonic()` value by which the check should
+            have completed.
+
+        :returns: a `CheckResult`.
+        """
+        self.thread.join(max(0, deadline - time.monotonic()))
+        if self.thread.is_alive():
+            return CheckResult(
+                self.name, False,
+                "Timed out after {}s.".format(self.timeout), self.timeout)
+        return self.result
+
+
+def run_checks(checks, progress=None, stopped=None):
+    """Run checks concurrently.
+
+    :param checks: list of `Check` instances.
+    :param progress: Qt signal to emit percentage completion.
+    :param stopped: unused, for compatibility with `qtext.Worker`.
+
+    :returns: list of `CheckResult`, in the order of `checks`.
+    """
+    logger = labslauncher.get_named_logger("PreFlght")
+    t0 = time.monotonic()
+    for check in checks:
+        check.start()
+    results = list()
+    for i, check in enumerate(checks):
+        results.append(check.wait(t0 + check.timeout))
+        if progress is not None:
+            progress.emit(100 * (i + 1) / len(checks))
+    for result in results:
+        logger.info("Check '{}' {} in {:.3f}s: {}".format(
+            result.name, "passed" if result.passed else "failed",
+            result.duration, result.value))
+    return results
+
+
+def check_mount(mount):
+    """Check a path is an accessible directory.
+
+    :param mount: host path.
+    """
+    if not os.path.isdir(mount):
+        raise CheckFailed("The folder '{}' does not exist.".format(mount))
+    return mount
+
+
+def check_sharing(client, mount):
+    """Check a path is readable, writable and can be shared with docker.
+
+    :param client: a `DockerClient`.
+    :param mount: host path.
+    """
+    if not os.access(mount, os.R_OK | os.W_OK):
+        raise CheckFailed(
+            "The folder '{}' is not readable and writable.".format(mount))
+    if client.can_share(mount) is False:
+        raise CheckFailed(
+            "The folder '{}' is not shared with docker.".format(mount))
+    return True
+
+
+def check_ports(client, ports):
+    """Check ports are available.
+
+    :param client: a `DockerClient`.
+    :param ports: list of ports.
+
+    :raises: `PortConflict`, with free ports to use instead, if any of the
+        ports are in use.
+    """
+    conflicts, _ = client.port_conflicts(ports)
+    if len(conflicts) > 0:
+        try:
+            free = client.free_ports(ports)
+        except ValueError:
+            free = None
+        raise PortConflict(conflicts, free)
+    return ports
+
+
+def check_docker(client):
+    """Check docker is responsive.
+
+    :param client: a `DockerClient`.
+    """
+    return client.docker.version()['Version']
+
+
+def check_image(client):
+    """Check for a local image, returning its tag (or None).
+
+    :param client: a `DockerClient`.
+    """
+    return client.latest_available_tag
+
+
+def check_image_update(client):
+    """Check whether the image must be pulled before starting.
+
+    :param client: a `DockerClient`.
+    """
+    return client.image_update_required()
+
+
+def server_checks(client, mount, ports):
+    """Create the checks required before starting a server.
+
+    :param client: a `DockerClient`.
+    :param mount: host path to be mounted in the container.
+    :param ports: list of ports.
+
+    :returns: list of `Check` instances.
+    """
+    return [
+        Check("Docker", lambda: check_docker(client), timeout=10),
+        Check("Data folder", lambda: check_mount(mount), timeout=5),
+        Check(
+            "File sharing", lambda: check_sharing(client, mount),
+            timeout=10),
+        Check("Ports", lambda: check_ports(client, ports), timeout=5),
+        Check("Image", lambda: check_image(client), timeout=20),
+        Check(
+            "Image update", lambda: check_image_update(client),
+            timeout=20)]
+
+
+def summarise(results):
+    """Return a human readable summary of check results.
+
+    :param results: list of `CheckResult`.
+    """
+    lines = list()
+    for result in results:
+        lines.append("{}: {} ({:.2f}s){}".format(
+            result.name, "OK" if result.passed else "FAILED",
+            result.duration,
+            "" if result.passed else "\n    {}".format(result.value)))
+    return "\n".join(lines)
@@ -0,0 +1,40 @@
+"""Qt integration of the docker client."""
+from PyQt5.QtCore import QTimer
+
+from labslauncher import dockerutil, qtext
+
+
+class DockerClient(dockerutil.DockerClient):
+    """A docker client with observable state refreshed by heartbeats."""
+
+    heartbeat = 5  # seconds
+
+    status = qtext.Property(('', 'unknown'))
+    states = qtext.Property(dict())
+    tag = qtext.StringProperty('')
+    _available = qtext.BoolProperty(False)
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client, see `dockerutil.DockerClient`."""
+        super().__init__(*args, **kwargs)
+        self.is_running()  # sets up tag, status, and available
+        # docker service heartbeat
+        self.dheartbeat = QTimer()
+        self.dheartbeat.setInterval(1000*self.heartbeat)
+        self.dheartbeat.start()
+        self.dheartbeat.timeout.connect(self.is_running)
+        # container status heartbeat
+        self.cheartbeat = QTimer()
+        self.cheartbeat.setInterval(1000*self.heartbeat)
+        self.cheartbeat.start()
+        self.cheartbeat.timeout.connect(self.set_status)
+
+    def set_heartbeat(self, interval=None):
+        """Set the interval between heartbeats.
+
+        :param interval: time (seconds), by default `.heartbeat`.
+        """
+        if interval is None:
+            interval = self.heartbeat
+        for timer in (self.dheartbeat, self.cheartbeat):
+            timer.setInterval(1000*interval)
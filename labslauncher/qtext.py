@@ -1,15 +1,20 @@
 """Extras for Qt."""
-import argparse
+import collections
+import contextlib
 import sys
 import threading
+import time
 import traceback
 
+from PyQt5 import sip
 from PyQt5.QtCore import (
-    pyqtSignal as Signal, pyqtSlot as Slot, QObject, QRunnable, QSettings, Qt)
+    pyqtSignal as Signal, pyqtSlot as Slot, QEvent, QObject, QRunnable,
+    QSettings, Qt, QTimer)
 from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import QLabel
 
 import labslauncher
+from labslauncher.settings import JSONStore, SettingsModel
 
 
 class Property(QObject):
@@ -18,14 +23,40 @@ class Property(QObject):
     For example:
         variable = Property("value")
         variable.connect(callback)
+
+    By default assignment of a value equal to the current value does not
+    cause emission. Changes may additionally be coalesced, either by
+    setting a `delay` such that only the last of a series of rapid changes
+    is emitted, or by making several assignments within a `.batch()`
+    context. The `emitted` and `suppressed` attributes count emissions made
+    and avoided.
     """
 
     changed = Signal(object)
+    _restart = Signal()
+
+    def __init__(self, value, gated=True, delay=None):
+        """Initialize the property.
 
-    def __init__(self, value):
-        """Initialize the property."""
+        :param value: initial value.
+        :param gated: do not emit when the assigned value is equal to the
+            last emitted value.
+        :param delay: time (milliseconds) to wait for further changes
+            before emitting.
+        """
         super().__init__()
         self._value = value
+        self._last = value
+        self.gated = gated
+        self.delay = delay
+        self.emitted = 0
+        self.suppressed = 0
+        self._batch = 0
+        self._pending = False
+        self._timer = None
+        # values may be set from worker threads, the timer must be started
+        # in the thread of the property
+        self._restart.connect(self._start_timer)
 
     @property
     def value(self):
@@ -36,7 +67,51 @@ class Property(QObject):
     def value(self, new_val):
         """Set the value of the property."""
         self._value = new_val
-        self.changed.emit(new_val)
+        if self._batch > 0:
+            self._queue()
+        elif self.delay is not None:
+            self._queue()
+            self._restart.emit()
+        else:
+            self._pending = True
+            self._flush()
+
+    @Slot()
+    def _start_timer(self):
+        if self._timer is None:
+            # created lazily since properties may be created before
+            # the Qt application
+            self._timer = QTimer(self)
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self._flush)
+        self._timer.start(self.delay)
+
+    def _queue(self):
+        if self._pending:
+            self.suppressed += 1
+        self._pending = True
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self._pending = False
+        if self.gated and self._value == self._last:
+            self.suppressed += 1
+            return
+        self._last = self._value
+        self.emitted += 1
+        self.changed.emit(self._value)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Coalesce assignments made within the context to one emission."""
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if self._batch == 0:
+                self._flush()
 
     def __str__(self):
         """Retun string reprepresentation of property value."""
@@ -61,6 +136,79 @@ class FloatProperty(Property):
     changed = Signal(float)
 
 
+class UpdateScheduler(QObject):
+    """Coalesce widget updates to once per event loop iteration.
+
+    Rather than forcing synchronous painting with `repaint()`, widgets are
+    marked dirty with `.schedule()` and `update()` is called on each once
+    the event loop is next idle. Paint events of watched widgets are
+    counted.
+    """
+
+    def __init__(self, parent=None):
+        """Initialize the scheduler."""
+        super().__init__(parent)
+        self._dirty = dict()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
+        self._first = None
+        self.requests = 0
+        self.flushes = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.paints = collections.Counter()
+
+    def schedule(self, widget):
+        """Mark a widget as requiring an update.
+
+        :param widget: a `QWidget`.
+        """
+        self.requests += 1
+        self._dirty[id(widget)] = widget
+        if not self._timer.isActive():
+            self._first = time.monotonic()
+            self._timer.start()
+
+    def flush(self):
+        """Update all dirty widgets, other than those since deleted."""
+        for widget in self._dirty.values():
+            if not sip.isdeleted(widget):
+                widget.update()
+        self._dirty.clear()
+        self.flushes += 1
+        latency = time.monotonic() - self._first
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def watch(self, widget):
+        """Count paint events of a widget.
+
+        :param widget: a `QWidget`.
+        """
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        """Count paint events."""
+        if event.type() == QEvent.Paint:
+            self.paints[type(obj).__name__] += 1
+        return False
+
+    def stats(self):
+        """Return a list of (name, value) statistics."""
+        mean = self.latency / self.flushes if self.flushes > 0 else 0
+        items = [
+            ("Update requests", self.requests),
+            ("Update flushes", self.flushes),
+            ("Mean update latency", "{:.1f}ms".format(1000 * mean)),
+            ("Max. update latency", "{:.1f}ms".format(
+                1000 * self.max_latency))]
+        for name, count in sorted(self.paints.items()):
+            items.append(("Paints: {}".format(name), count))
+        return items
+
+
 class WorkerSignals(QObject):
     """Defines the signals available from a running worker thread.
 
@@ -123,6 +271,246 @@ class Worker(QRunnable):
         self.stopped.set()
 
 
+class TaskHandle(QObject):
+    """A future-like handle to a task run by a `TaskManager`.
+
+    The handle re-emits the signals of the underlying `Worker` and records
+    the outcome of the task, such that it may also be polled or waited
+    upon (from a thread other than the GUI thread).
+    """
+
+    finished = Signal()
+    error = Signal(tuple)
+    result = Signal(object)
+    progress = Signal(float)
+
+    def __init__(self, key, lane, timeout=None):
+        """Initialize the handle.
+
+        :param key: deduplication key of the task (or None).
+        :param lane: priority lane of the task.
+        :param timeout: time (seconds) after which the task is cancelled.
+        """
+        super().__init__()
+        self.key = key
+        self.lane = lane
+        self.timeout = timeout
+        self.worker = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.completed = None
+        self.cancelled = False
+        self.timed_out = False
+        self.last_progress = 0.0
+        self._value = None
+        self._exception = None
+        self._done = threading.Event()
+        self._connected = set()
+        self.progress.connect(self._on_progress)
+
+    @Slot(float)
+    def _on_progress(self, value):
+        self.last_progress = value
+
+    def _run(self, fn, *args, **kwargs):
+        """Run the task function, recording its outcome."""
+        self.started = time.monotonic()
+        try:
+            if self.cancelled:
+                # cancelled whilst queued
+                return None
+            try:
+                self._value = fn(*args, **kwargs)
+            except Exception as e:
+                self._exception = e
+                raise
+            return self._value
+        finally:
+            self.completed = time.monotonic()
+            self._done.set()
+
+    @property
+    def queue_wait(self):
+        """Return time (seconds) the task waited for a thread, or None."""
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    def done(self):
+        """Return whether the task has completed."""
+        return self._done.is_set()
+
+    def cancel(self):
+        """Request cancellation of the task.
+
+        A task which has not started will not be run, a running task is
+        signalled to stop through its `stopped` event.
+        """
+        if not self.done():
+            self.cancelled = True
+            self.worker.stop()
+
+    def _expire(self):
+        if not self.done():
+            self.timed_out = True
+            self.cancel()
+
+    def wait(self, timeout=None):
+        """Wait for the task to complete and return its result.
+
+        :param timeout: maximum time (seconds) to wait.
+
+        :raises: `TimeoutError` if the task did not complete in time, or
+            the exception raised by the task.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("Task {} did not complete.".format(self.key))
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+    def connect(self, result=None, finished=None, error=None, progress=None):
+        """Connect callbacks to the signals of the task.
+
+        Callbacks already connected to a signal are not connected again,
+        such that callers sharing a deduplicated task do not receive
+        repeated calls.
+
+        :param result: callback receiving the return value.
+        :param finished: callback receiving no arguments.
+        :param error: callback receiving (exctype, value, traceback).
+        :param progress: callback receiving percentage progress.
+        """
+        for name, callback in (
+                ('result', result), ('finished', finished),
+                ('error', error), ('progress', progress)):
+            if callback is None or (name, callback) in self._connected:
+                continue
+            self._connected.add((name, callback))
+            getattr(self, name).connect(callback)
+        return self
+
+
+class TaskManager(QObject):
+    """Run functions in a thread pool, returning `TaskHandle` instances.
+
+    Tasks submitted with a `key` equal to that of a task which has not yet
+    completed are not run again, rather the existing handle is returned.
+    Tasks are queued in one of two lanes, interactive tasks (for which the
+    user is waiting) are started in preference to background tasks.
+    """
+
+    INTERACTIVE = 'interactive'
+    BACKGROUND = 'background'
+    priorities = {INTERACTIVE: 10, BACKGROUND: 0}
+
+    def __init__(self, pool, parent=None):
+        """Initialize the manager.
+
+        :param pool: a `QThreadPool`.
+        """
+        super().__init__(parent)
+        self.pool = pool
+        self.active = dict()
+        self.handles = set()
+        self.submitted = collections.Counter()
+        self.deduplicated = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.waits = {
+            lane: collections.deque(maxlen=100) for lane in self.priorities}
+        self.logger = labslauncher.get_named_logger("TaskMngr")
+
+    def submit(
+            self, fn, *args, key=None, lane=BACKGROUND, timeout=None,
+            **kwargs):
+        """Submit a function to be run in the pool.
+
+        :param fn: function to run, see `Worker`.
+        :param args: arguments to pass to the function.
+        :param key: hashable identifying the task, for deduplication.
+        :param lane: `INTERACTIVE` or `BACKGROUND`.
+        :param timeout: time (seconds) after which the task is cancelled.
+        :param kwargs: keyword arguments to pass to the function.
+
+        :returns: a `TaskHandle`.
+        """
+        if key is not None and key in self.active:
+            handle = self.active[key]
+            if not handle.done():
+                self.deduplicated += 1
+                self.logger.info(
+                    "Task {} already in progress.".format(key))
+                return handle
+        handle = TaskHandle(key, lane, timeout)
+        worker = Worker(handle._run, fn, *args, **kwargs)
+        worker.setAutoDelete(True)
+        handle.worker = worker
+        # bookkeeping is connected first to precede callers' callbacks
+        handle.finished.connect(lambda: self._on_finished(handle))
+        worker.signals.progress.connect(handle.progress)
+        worker.signals.result.connect(handle.result)
+        worker.signals.error.connect(handle.error)
+        worker.signals.finished.connect(handle.finished)
+        if key is not None:
+            self.active[key] = handle
+        self.handles.add(handle)
+        if timeout is not None:
+            QTimer.singleShot(int(1000 * timeout), handle._expire)
+        self.submitted[lane] += 1
+        self.pool.start(worker, self.priorities[lane])
+        return handle
+
+    def _on_finished(self, handle):
+        self.handles.discard(handle)
+        if handle.key is not None and self.active.get(handle.key) is handle:
+            del self.active[handle.key]
+        if handle.queue_wait is not None:
+            self.waits[handle.lane].append(handle.queue_wait)
+        if handle.timed_out:
+            self.timed_out += 1
+            self.logger.warning("Task {} timed out after {}s.".format(
+                handle.key, handle.timeout))
+        elif handle.cancelled:
+            self.cancelled += 1
+
+    def in_progress(self, lane=None):
+        """Return the number of tasks which have not completed.
+
+        :param lane: count only tasks of this lane.
+        """
+        return sum(
+            1 for handle in self.handles
+            if lane is None or handle.lane == lane)
+
+    def cancel_all(self, *args):
+        """Cancel all tasks which have not completed."""
+        for handle in list(self.handles):
+            handle.cancel()
+
+    def stats(self):
+        """Return a list of (name, value) statistics."""
+        items = [
+            ("Pool occupancy", "{}/{}".format(
+                self.pool.activeThreadCount(), self.pool.maxThreadCount())),
+            ("Tasks in progress", len(self.handles)),
+            ("Deduplicated submissions", self.deduplicated),
+            ("Cancelled", self.cancelled),
+            ("Timed out", self.timed_out)]
+        for lane in sorted(self.priorities):
+            waits = self.waits[lane]
+            mean = sum(waits) / len(waits) if len(waits) > 0 else 0
+            items.append((
+                "Submitted: {}".format(lane), self.submitted[lane]))
+            items.append((
+                "Mean queue wait: {}".format(lane),
+                "{:.1f}ms".format(1000 * mean)))
+            items.append((
+                "Max. queue wait: {}".format(lane),
+                "{:.1f}ms".format(1000 * max(waits, default=0))))
+        return items
+
+
 class ClickLabel(QLabel):
     """A Label that can be clicked."""
 
@@ -158,61 +546,57 @@ class ClickLabel(QLabel):
 AppQSettings = QSettings("EPIME Labs", "Launcher")
 
 
-class Settings():
-    """Wrapper around QSettings to provide defaults."""
+class QSettingsStore():
+    """A settings store backed by `QSettings`.
 
-    def __init__(self, specification):
-        """Initialize settings.
+    Values are saved by the writer thread of `SettingsModel`, the
+    `QSettings` instance should not otherwise be used after loading.
+    """
 
-        :param specification: an item like `labslauncher.Settings`.
+    def __init__(self, qsettings=AppQSettings, mirror=None):
+        """Initialize the store.
 
+        :param qsettings: a `QSettings` instance.
+        :param mirror: a further store to which values are saved.
         """
-        self.qsettings = AppQSettings
-        self.spec = specification
-        self.overrides = None
-
-        # add defaults options to Qsettings, maybe reset
-        reset = False
-        prev_version = self.qsettings.value("version", None)
-        if prev_version is None or prev_version != self.spec['version']:
-            reset = True
-        for item in self.spec:
-            key = item["key"]
-            if reset or not self.qsettings.contains(key):
-                self.qsettings.setValue(key, item["default"])
-
-        # setup a cmdline parser acoording to our options
-        self.parser = argparse.ArgumentParser(
-            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-            add_help=False)
-        for item in self.spec:
-            key = item["key"]
-            arg_type = self.spec.get_type(key)
-            if arg_type == bool:  # just to help parsing
-                arg_type = int
-            self.parser.add_argument(
-                "--{}".format(key), type=arg_type,
-                help=self.spec.get_description(key))
-
-    def __getitem__(self, key):
-        """Get the value of a setting."""
-        type = self.spec.get_type(key)
-        if self.overrides is not None and self.overrides[key] is not None:
-            value = self.overrides[key]
-            if type == bool:
-                value = bool(value)
-        else:
-            value = type(self.qsettings.value(key))
-        return value
+        self.qsettings = qsettings
+        self.mirror = mirror
+
+    def load(self):
+        """Return a dictionary of stored values."""
+        return {
+            key: self.qsettings.value(key)
+            for key in self.qsettings.allKeys()}
+
+    def save(self, values):
+        """Store values, writing them to permanent storage.
 
-    def __setitem__(self, key, value):
-        """Set the value of a setting."""
-        self.qsettings.setValue(key, value)
+        :param values: dictionary of values to store.
+        """
+        for key, value in values.items():
+            self.qsettings.setValue(key, value)
+        self.qsettings.sync()
+        if self.mirror is not None:
+            self.mirror.save(values)
+
+
+class Settings(SettingsModel):
+    """Application settings stored with `QSettings`.
+
+    Changes are observed with `.subscribe()`, see `SettingsModel`.
+    """
 
-    def override(self, args):
-        """Set command line overrides."""
-        self.overrides = vars(args)
+    def __init__(self, specification, store=None):
+        """Initialize settings.
 
-    def clear_override(self):
-        """Clear command line overrides."""
-        self.overrides = None
+        :param specification: an item like `labslauncher.Defaults`.
+        :param store: settings store, by default a `QSettingsStore`
+            mirrored to a `JSONStore`.
+        """
+        if store is None:
+            store = QSettingsStore(mirror=JSONStore())
+            super().__init__(specification, store=store)
+            # ensure the mirror is complete
+            self.save_all()
+        else:
+            super().__init__(specification, store=store)
@@ -0,0 +1,245 @@
+"""Typed in-memory application settings."""
+import argparse
+import contextlib
+from enum import Enum
+import json
+import os
+import queue
+import threading
+
+import labslauncher
+
+
+def convert(kind, value):
+    """Convert a stored setting value to its type.
+
+    :param kind: python type of the setting.
+    :param value: stored value, as returned by a settings store.
+    """
+    if isinstance(value, kind):
+        return value
+    if kind is bool:
+        if isinstance(value, str):
+            return value.lower() in ('true', '1', 'yes')
+        return bool(value)
+    if issubclass(kind, Enum):
+        return kind(value)
+    return kind(value)
+
+
+class MemoryStore():
+    """A settings store which does not persist values."""
+
+    def __init__(self, values=None):
+        """Initialize the store.
+
+        :param values: dictionary of initial values.
+        """
+        self.values = dict() if values is None else dict(values)
+
+    def load(self):
+        """Return a dictionary of stored values."""
+        return dict(self.values)
+
+    def save(self, values):
+        """Store values.
+
+        :param values: dictionary of values to store.
+        """
+        self.values.update(values)
+
+
+class JSONStore():
+    """A settings store persisting values to a JSON file.
+
+    The graphical application mirrors its settings to this store such
+    that they can be read without Qt, see `labslauncher.cli`.
+    """
+
+    def __init__(self, fname=None):
+        """Initialize the store.
+
+        :param fname: JSON filename.
+        """
+        if fname is None:
+            fname = os.path.join(labslauncher.__LOGDIR__, 'settings.json')
+        self.fname = fname
+
+    def load(self):
+        """Return a dictionary of stored values."""
+        try:
+            with open(self.fname) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return dict()
+
+    def save(self, values):
+        """Store values.
+
+        :param values: dictionary of values to store.
+        """
+        data = self.load()
+        data.update(values)
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        tmp = "{}.tmp".format(self.fname)
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+        os.replace(tmp, self.fname)
+
+
+class SettingsModel():
+    """Application settings, loaded once and held in memory.
+
+    Values are read from the store at initialization and converted to the
+    type of their default. Assignments update the in-memory values
+    immediately, notify subscribers of keys whose value changed, and are
+    written back to the store by a background thread. Command line
+    overrides take precedence over stored values.
+    """
+
+    def __init__(self, specification, store=None):
+        """Initialize settings.
+
+        :param specification: an item like `labslauncher.Defaults`.
+        :param store: an object with `load()` and `save(values)` methods,
+            see `MemoryStore`.
+        """
+        self.spec = specification
+        self.store = MemoryStore() if store is None else store
+        self.overrides = None
+        self.subscribers = list()
+        self._batch = 0
+        self._changed = set()
+        self.logger = labslauncher.get_named_logger("Settings")
+
+        # load stored values, resetting to defaults on version change
+        stored = self.store.load()
+        reset = stored.get('version') != self.spec['version']
+        self.values = dict()
+        missing = dict()
+        for item in self.spec:
+            key = item["key"]
+            if reset or key not in stored:
+                self.values[key] = item["default"]
+                missing[key] = item["default"]
+            else:
+                try:
+                    self.values[key] = convert(item["type"], stored[key])
+                except (TypeError, ValueError):
+                    self.logger.warning(
+                        "Invalid stored value for '{}', using default."
+                        .format(key))
+                    self.values[key] = item["default"]
+                    missing[key] = item["default"]
+
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+        if len(missing) > 0:
+            self._writes.put(missing)
+
+        # setup a cmdline parser acoording to our options
+        self.parser = argparse.ArgumentParser(
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            add_help=False)
+        for item in self.spec:
+            key = item["key"]
+            arg_type = self.spec.get_type(key)
+            if arg_type == bool:  # just to help parsing
+                arg_type = int
+            self.parser.add_argument(
+                "--{}".format(key), type=arg_type,
+                help=self.spec.get_description(key))
+
+    def __getitem__(self, key):
+        """Get the value of a setting."""
+        if self.overrides is not None and self.overrides.get(key) is not None:
+            return convert(self.spec.get_type(key), self.overrides[key])
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        """Set the value of a setting."""
+        value = convert(self.spec.get_type(key), value)
+        if value == self.values[key]:
+            return
+        old = self[key]
+        self.values[key] = value
+        self._writes.put({key: value})
+        if self[key] != old:
+            self._changed.add(key)
+            if self._batch == 0:
+                self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, set()
+        if len(changed) == 0:
+            return
+        self.logger.info("Settings changed: {}.".format(
+            ", ".join(sorted(changed))))
+        for keys, callback in list(self.subscribers):
+            common = changed.intersection(keys)
+            if len(common) > 0:
+                callback(common)
+
+    def subscribe(self, keys, callback):
+        """Call a function when any of a set of settings change.
+
+        :param keys: iterable of setting keys.
+        :param callback: function called with the set of changed keys.
+            Changes made within a `.batch()` context result in a single
+            call.
+        """
+        self.subscribers.append((frozenset(keys), callback))
+
+    def unsubscribe(self, callback):
+        """Stop calling a function subscribed with `.subscribe()`.
+
+        :param callback: the subscribed function.
+        """
+        self.subscribers = [
+            (keys, cb) for keys, cb in self.subscribers if cb != callback]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Notify subscribers once for all assignments in the context."""
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if self._batch == 0:
+                self._notify()
+
+    def _write(self):
+        while True:
+            values = self._writes.get()
+            count = 1
+            # coalesce assignments made in quick succession
+            while True:
+                try:
+                    values.update(self._writes.get_nowait())
+                    count += 1
+                except queue.Empty:
+                    break
+            try:
+                self.store.save(values)
+            except Exception:
+                self.logger.exception("Failed to store settings.")
+            for _ in range(count):
+                self._writes.task_done()
+
+    def save_all(self):
+        """Queue all stored values to be written to the store."""
+        self._writes.put(dict(self.values))
+
+    def flush(self, *args):
+        """Wait for pending changes to be written to the store."""
+        self._writes.join()
+
+    def override(self, args):
+        """Set command line overrides."""
+        self.overrides = vars(args)
+
+    def clear_override(self):
+        """Clear command line overrides."""
+        self.overrides = None
@@ -0,0 +1,152 @@
+"""Restart of exited notebook servers, with crash loop detection."""
+import collections
+import time
+
+import labslauncher
+
+
+# exit codes of a command which could not be run, restarting will not help
+CONFIG_EXIT_CODES = (126, 127)
+# classes of container exit, see `classify_exit`, and of a running server
+# which stopped responding
+STOPPED, OOM, CONFIG, CRASH, HUNG = (
+    'stopped', 'out of memory', 'configuration error', 'crash',
+    'unresponsive')
+FAILURES = (OOM, CRASH, HUNG)
+
+ExitRecord = collections.namedtuple(
+    'ExitRecord', ['time', 'exit_code', 'oom_killed', 'error', 'reason'])
+
+
+def classify_exit(state):
+    """Classify the exit of a container.
+
+    :param state: the `State` of `docker inspect`.
+
+    :returns: one of `STOPPED`, `OOM`, `CONFIG` or `CRASH`.
+    """
+    if state.get('OOMKilled'):
+        return OOM
+    code = state.get('ExitCode')
+    if code == 0:
+        return STOPPED
+    if code in CONFIG_EXIT_CODES or state.get('Error'):
+        return CONFIG
+    return CRASH
+
+
+class RestartSupervisor():
+    """Decide whether, and when, to restart an exited server.
+
+    Restarts are delayed with exponential backoff. Too many exits within
+    a time window are considered a crash loop, after which restarts stop
+    until `.reset()` is called (e.g. when the user starts the server).
+    """
+
+    def __init__(
+            self, limit=5, window=600, backoff=5, backoff_max=300,
+            clock=time.monotonic):
+        """Initialize the supervisor.
+
+        :param limit: number of exits within `window` considered a crash
+            loop.
+        :param window: time window (seconds) over which exits are counted.
+        :param backoff: delay (seconds) before the first restart, doubled
+            for each subsequent exit within `window`.
+        :param backoff_max: maximum restart delay (seconds).
+        :param clock: function returning the time in seconds.
+        """
+        self.limit = limit
+        self.window = window
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.history = collections.deque(maxlen=100)
+        self.restarts = 0
+        self.crash_loop = False
+        # exits before this time are not counted, see `.reset()`
+        self.since = None
+        self.logger = labslauncher.get_named_logger("Supervsr")
+
+    def reset(self):
+        """Clear a detected crash loop, allowing restarts.
+
+        Exits recorded before the reset are no longer counted towards a
+        crash loop, though remain in `.history`.
+        """
+        if self.crash_loop:
+            self.logger.info("Crash loop cleared.")
+        self.crash_loop = False
+        self.since = self.clock()
+
+    def recent(self):
+        """Return the exits within the time window, since any reset."""
+        start = self.clock() - self.window
+        if self.since is not None:
+            start = max(start, self.since)
+        return [x for x in self.history if x.time >= start]
+
+    def record(self, state):
+        """Record the exit of a container.
+
+        :param state: the `State` of `docker inspect`.
+
+        :returns: an `ExitRecord`.
+        """
+        record = ExitRecord(
+            self.clock(), state.get('ExitCode'), bool(state.get('OOMKilled')),
+            state.get('Error') or None, classify_exit(state))
+        self.history.append(record)
+        self.logger.warning(
+            "Server exited with code {} ({}){}.".format(
+                record.exit_code, record.reason,
+                "" if record.error is None else ": {}".format(record.error)))
+        return record
+
+    def on_exit(self, state):
+        """Record an exit, returning the restart delay.
+
+        :param state: the `State` of `docker inspect`.
+
+        :returns: (`ExitRecord`, delay in seconds). The delay is None if
+            the server should not be restarted: it was stopped, could not
+            run, or is in a crash loop.
+        """
+        return self._decide(self.record(state))
+
+    def on_unresponsive(self):
+        """Record a running server which stopped responding.
+
+        :returns: (`ExitRecord`, delay in seconds), see `.on_exit()`.
+        """
+        record = ExitRecord(self.clock(), None, False, None, HUNG)
+        self.history.append(record)
+        self.logger.warning("Server stopped responding.")
+        return self._decide(record)
+
+    def _decide(self, record):
+        if record.reason not in FAILURES or self.crash_loop:
+            return record, None
+        failures = len([x for x in self.recent() if x.reason in FAILURES])
+        if failures >= self.limit:
+            self.crash_loop = True
+            self.logger.error(
+                "Server failed {} times in {}s, not restarting.".format(
+                    failures, self.window))
+            return record, None
+        delay = min(self.backoff * 2 ** (failures - 1), self.backoff_max)
+        self.restarts += 1
+        self.logger.info("Restarting server in {}s.".format(delay))
+        return record, delay
+
+    def stats(self):
+        """Return a list of (item, value) describing restarts."""
+        last = self.history[-1] if len(self.history) > 0 else None
+        return [
+            ("Restarts", self.restarts),
+            ("Exits and hangs counted (last {}s)".format(self.window),
+                len(self.recent())),
+            ("Crash loop", "yes" if self.crash_loop else "no"),
+            ("Last exit", "none" if last is None else last.reason if
+                last.exit_code is None else "code {} ({})".format(
+                    last.exit_code, last.reason))]
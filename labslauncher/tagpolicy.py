@@ -0,0 +1,175 @@
+"""Selection of server image tags by release channel and version range."""
+import functools
+import re
+
+import semver
+
+
+STABLE, PRERELEASE, DEV = 'stable', 'prerelease', 'dev'
+CHANNELS = (STABLE, PRERELEASE, DEV)
+# the mutable tag followed by the dev channel
+DEV_TAG = 'dev'
+COMPARATORS = {
+    '>=': lambda x, y: x >= y, '<=': lambda x, y: x <= y,
+    '>': lambda x, y: x > y, '<': lambda x, y: x < y,
+    '==': lambda x, y: x == y, '!=': lambda x, y: x != y}
+_CLAUSE = re.compile(r'^(>=|<=|>|<|==|!=)?\s*v?(\d+(?:\.\d+){0,2}.*)$')
+
+
+def parse_version(text):
+    """Parse a, possibly partial, version.
+
+    :param text: version e.g. `1.2`, `1.2.3` or `1.2.3-rc1`. Missing minor
+        and patch components are taken to be zero.
+
+    :returns: a `semver.VersionInfo`.
+    """
+    core, sep, rest = text.partition('-')
+    parts = core.split('.')
+    if len(parts) < 3 and sep == '' and all(x.isdigit() for x in parts):
+        core = '.'.join(parts + ['0'] * (3 - len(parts)))
+    return semver.VersionInfo.parse(core + sep + rest)
+
+
+def parse_range(text):
+    """Parse a version range.
+
+    :param text: comma separated comparisons, e.g. `>=1.2,<2`. A version
+        without an operator must match exactly. An upper bound excludes
+        prereleases of versions beyond it, see `TagPolicy.allows`.
+
+    :returns: list of (operator, `semver.VersionInfo`).
+
+    :raises: ValueError if the range is invalid.
+    """
+    clauses = list()
+    for clause in text.split(','):
+        clause = clause.strip()
+        if clause == '':
+            continue
+        match = _CLAUSE.match(clause)
+        if match is None:
+            raise ValueError("Invalid version range: '{}'.".format(clause))
+        try:
+            version = parse_version(match.group(2))
+        except ValueError:
+            raise ValueError("Invalid version: '{}'.".format(clause))
+        clauses.append((match.group(1) or '==', version))
+    return clauses
+
+
+class TagPolicy():
+    """Choose an image tag according to a channel and version range.
+
+    Versioned tags take the form `v<semver>`. The stable channel follows
+    the newest release, the prerelease channel additionally admits
+    prereleases (e.g. `v1.2.0-rc1`) and the dev channel follows the
+    mutable `dev` tag. A fixed tag overrides the channel and range.
+    """
+
+    def __init__(
+            self, channel=STABLE, version_range='', fixed_tag=None,
+            prefix='v'):
+        """Initialize the policy.
+
+        :param channel: one of `CHANNELS`.
+        :param version_range: version range admitted, see `parse_range`.
+        :param fixed_tag: a tag to use regardless of channel and range.
+        :param prefix: prefix of versioned tags.
+
+        :raises: ValueError if the channel or range are invalid.
+        """
+        if channel not in CHANNELS:
+            raise ValueError("Invalid channel '{}', choose from: {}.".format(
+                channel, ", ".join(CHANNELS)))
+        self.channel = channel
+        self.version_range = version_range
+        self.clauses = parse_range(version_range)
+        self.fixed_tag = fixed_tag
+        self.prefix = prefix
+
+    def __repr__(self):
+        """Return a description of the policy."""
+        if self.fixed_tag is not None:
+            return "fixed tag {}".format(self.fixed_tag)
+        text = "{} channel".format(self.channel)
+        if self.channel != DEV and len(self.clauses) > 0:
+            text += ", versions {}".format(self.version_range)
+        return text
+
+    def version(self, tag):
+        """Return the version of a versioned tag, or None.
+
+        :param tag: image tag.
+        """
+        if tag is None or not tag.startswith(self.prefix):
+            return None
+        try:
+            return semver.VersionInfo.parse(tag[len(self.prefix):])
+        except ValueError:
+            return None
+
+    def allows(self, tag):
+        """Return whether a versioned tag is admitted by the policy.
+
+        :param tag: image tag.
+        """
+        version = self.version(tag)
+        if version is None:
+            return False
+        if version.prerelease is not None:
+            if self.channel == STABLE:
+                return False
+            # a prerelease precedes its release, such that e.g. 2.0.0-rc1
+            # satisfies <2. Prereleases of releases excluded by an upper
+            # bound are excluded.
+            release = version.finalize_version()
+            if not all(
+                    COMPARATORS[op](release, ref) for op, ref in self.clauses
+                    if op in ('<', '<=')):
+                return False
+        return all(COMPARATORS[op](version, ref) for op, ref in self.clauses)
+
+    @property
+    def pinned_tag(self):
+        """Return the single tag followed by the policy, or None."""
+        if self.fixed_tag is not None:
+            return self.fixed_tag
+        if self.channel == DEV:
+            return DEV_TAG
+        return None
+
+    @property
+    def mutable(self):
+        """Return whether the policy follows a tag which may be updated.
+
+        Such tags (e.g. `dev`) should be compared by digest to determine
+        whether an update is available.
+        """
+        tag = self.pinned_tag
+        return tag is not None and self.version(tag) is None
+
+    def select(self, tags):
+        """Return the newest admitted tag, or None.
+
+        :param tags: iterable of tags, in any order.
+        """
+        if self.pinned_tag is not None:
+            return self.pinned_tag
+        admitted = [x for x in tags if self.allows(x)]
+        if len(admitted) == 0:
+            return None
+        return max(admitted, key=functools.cmp_to_key(
+            lambda x, y: self.version(x).compare(self.version(y))))
+
+    def order(self, tags):
+        """Return admitted tags, newest first.
+
+        :param tags: iterable of tags, in any order.
+        """
+        if self.pinned_tag is not None:
+            return [self.pinned_tag]
+        return sorted(
+            (x for x in tags if self.allows(x)), reverse=True,
+            key=functools.cmp_to_key(
+                lambda x, y: self.version(x).compare(self.version(y))))
@@ -67,6 +67,7 @@ setup(
     data_files=data_files,
     entry_points={
         'console_scripts': [
-            'labslauncher = {}.app:main'.format(__pkg_name__)
+            'labslauncher = {}.app:main'.format(__pkg_name__),
+            'labslauncher-cli = {}.cli:main'.format(__pkg_name__)
         ]},
 )